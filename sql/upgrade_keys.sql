@@ -0,0 +1,11 @@
+-- 已有数据库的升级脚本：以下表由 python manage.py migrate 根据模型类创建，不在 xiaoyu11.sql 中
+-- 新建的数据库在migrate时已经按模型类创建了这些键，不需要执行
+-- 在这些键加到模型类之前创建的数据库，执行一次：mysql -u<用户> -p <数据库> < sql/upgrade_keys.sql
+
+-- 每个类别每天一条访问量记录（执行前先合并重复的记录）
+ALTER TABLE `tb_goods_visit`
+  ADD UNIQUE KEY `tb_goods_visit_category_date_uniq` (`category_id`,`date`);
+
+-- 商品评价按时间倒序分页
+ALTER TABLE `tb_order_goods`
+  ADD KEY `tb_order_goods_comment_idx` (`sku_id`,`is_commented`,`create_time` DESC,`id` DESC);
@@ -4414,6 +4414,9 @@ CREATE TABLE `tb_sku` (
   PRIMARY KEY (`id`),
   KEY `tb_sku_category_id_23dd76b7_fk_tb_goods_category_id` (`category_id`),
   KEY `tb_sku_spu_id_120b25f6_fk_tb_spu_id` (`spu_id`),
+  KEY `tb_sku_list_default_idx` (`category_id`,`is_launched`,`create_time`,`id`),
+  KEY `tb_sku_list_price_idx` (`category_id`,`is_launched`,`price`,`id`),
+  KEY `tb_sku_list_hot_idx` (`category_id`,`is_launched`,`sales` DESC,`id`),
   CONSTRAINT `tb_sku_category_id_23dd76b7_fk_tb_goods_category_id` FOREIGN KEY (`category_id`) REFERENCES `tb_goods_category` (`id`),
   CONSTRAINT `tb_sku_spu_id_120b25f6_fk_tb_spu_id` FOREIGN KEY (`spu_id`) REFERENCES `tb_spu` (`id`)
 ) ENGINE=InnoDB AUTO_INCREMENT=17 DEFAULT CHARSET=utf8;
@@ -4722,3 +4725,25 @@ CREATE TABLE `tb_users_user_permissions` (
 -- ----------------------------
 -- Records of tb_users_user_permissions
 -- ----------------------------
+
+-- ----------------------------
+-- Comment statistics of tb_sku and tb_spu
+-- ----------------------------
+ALTER TABLE `tb_sku`
+  ADD COLUMN `comment_score_sum` int(11) NOT NULL DEFAULT '0',
+  ADD COLUMN `comment_score_avg` decimal(3,2) NOT NULL DEFAULT '0.00',
+  ADD COLUMN `comment_score_0` int(11) NOT NULL DEFAULT '0',
+  ADD COLUMN `comment_score_1` int(11) NOT NULL DEFAULT '0',
+  ADD COLUMN `comment_score_2` int(11) NOT NULL DEFAULT '0',
+  ADD COLUMN `comment_score_3` int(11) NOT NULL DEFAULT '0',
+  ADD COLUMN `comment_score_4` int(11) NOT NULL DEFAULT '0',
+  ADD COLUMN `comment_score_5` int(11) NOT NULL DEFAULT '0';
+ALTER TABLE `tb_spu`
+  ADD COLUMN `comment_score_sum` int(11) NOT NULL DEFAULT '0',
+  ADD COLUMN `comment_score_avg` decimal(3,2) NOT NULL DEFAULT '0.00',
+  ADD COLUMN `comment_score_0` int(11) NOT NULL DEFAULT '0',
+  ADD COLUMN `comment_score_1` int(11) NOT NULL DEFAULT '0',
+  ADD COLUMN `comment_score_2` int(11) NOT NULL DEFAULT '0',
+  ADD COLUMN `comment_score_3` int(11) NOT NULL DEFAULT '0',
+  ADD COLUMN `comment_score_4` int(11) NOT NULL DEFAULT '0',
+  ADD COLUMN `comment_score_5` int(11) NOT NULL DEFAULT '0';
@@ -0,0 +1,128 @@
+"""
+cookie购物车编解码：{sku_id: {'count': 数量, 'selected': 是否勾选}} <==> cookie字符串
+
+格式：base64url(版本号 + 内容 + 签名)
+    版本号：1个字节
+    内容：按sku_id排序，每个商品两个varint：与上一个sku_id的差值，(zigzag(数量) << 1) | 勾选
+    签名：内容的HMAC-SHA256前CART_COOKIE_MAC_SIZE个字节，防止篡改
+相比pickle，不会执行任何代码，一般的购物车每个商品只占3～4个字节
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+
+from django.conf import settings
+
+from carts import constants
+
+_HMAC_SALT = 'carts.codec'
+
+
+class CartDecodeError(ValueError):
+    """cookie购物车格式、版本或签名错误"""
+
+
+def _write_varint(buf, n):
+    while n >= 0x80:
+        buf.append(n & 0x7f | 0x80)
+        n >>= 7
+    buf.append(n)
+
+
+def _read_varints(data, pos):
+    """读取从pos开始的所有varint"""
+    values = []
+    append = values.append
+    end = len(data)
+    while pos < end:
+        byte = data[pos]
+        pos += 1
+        if byte < 0x80:
+            # 绝大多数值小于128，只占一个字节
+            append(byte)
+            continue
+        result = byte & 0x7f
+        shift = 7
+        while True:
+            byte = data[pos]
+            pos += 1
+            result |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+            if shift > 63:
+                raise CartDecodeError('varint过长')
+        append(result)
+    return values
+
+
+# 签名密钥：与django.utils.crypto.salted_hmac相同的派生方式，按SECRET_KEY缓存，避免每次重新派生
+_mac_keys = {}
+
+
+def _sign(data):
+    secret = settings.SECRET_KEY
+    key = _mac_keys.get(secret)
+    if key is None:
+        key = _mac_keys[secret] = hashlib.sha256((_HMAC_SALT + secret).encode()).digest()
+    return hmac.new(key, data, hashlib.sha256).digest()[:constants.CART_COOKIE_MAC_SIZE]
+
+
+def encode(cart_dict):
+    """购物车字典编码为字节串"""
+    buf = bytearray([constants.CART_COOKIE_VERSION])
+    prev_id = 0
+    for sku_id in sorted(cart_dict, key=int):
+        item = cart_dict[sku_id]
+        count = int(item['count'])
+        _write_varint(buf, int(sku_id) - prev_id)
+        # zigzag：负数也编码为较短的非负整数
+        _write_varint(buf, ((count << 1) ^ (count >> 63)) << 1 | bool(item['selected']))
+        prev_id = int(sku_id)
+    buf += _sign(bytes(buf))
+    return bytes(buf)
+
+
+def decode(data):
+    """字节串解码为购物车字典，格式错误时抛出CartDecodeError"""
+    size = constants.CART_COOKIE_MAC_SIZE
+    if len(data) < 1 + size:
+        raise CartDecodeError('长度不足')
+    body, mac = data[:-size], data[-size:]
+    if not hmac.compare_digest(_sign(body), mac):
+        raise CartDecodeError('签名错误')
+    if body[0] != constants.CART_COOKIE_VERSION:
+        raise CartDecodeError('不支持的版本：%d' % body[0])
+    try:
+        values = _read_varints(body, 1)
+    except IndexError:
+        raise CartDecodeError('内容不完整')
+    if len(values) % 2:
+        raise CartDecodeError('内容不完整')
+    cart_dict = {}
+    sku_id = 0
+    for i in range(0, len(values), 2):
+        sku_id += values[i]
+        value = values[i + 1]
+        zigzag = value >> 1
+        cart_dict[sku_id] = {
+            'count': (zigzag >> 1) ^ -(zigzag & 1),
+            'selected': bool(value & 1),
+        }
+    return cart_dict
+
+
+def dumps(cart_dict):
+    """购物车字典编码为cookie字符串"""
+    return base64.urlsafe_b64encode(encode(cart_dict)).decode().rstrip('=')
+
+
+def loads(cart_str):
+    """cookie字符串解码为购物车字典，没有购物车或cookie无效（包括旧的pickle格式）时返回空字典"""
+    if not cart_str:
+        return {}
+    try:
+        return decode(base64.urlsafe_b64decode(cart_str + '=' * (-len(cart_str) % 4)))
+    except (CartDecodeError, binascii.Error, ValueError):
+        return {}
@@ -0,0 +1,12 @@
+# cookie购物车编码格式的版本号
+CART_COOKIE_VERSION = 1
+# cookie购物车签名的字节数
+CART_COOKIE_MAC_SIZE = 8
+# 服务端匿名购物车id的cookie名
+ANONYMOUS_CART_COOKIE = 'cart_id'
+# 服务端匿名购物车的有效期，单位：秒（每次修改购物车时重新计算）
+ANONYMOUS_CART_EXPIRES = 3600 * 24 * 7
+# 购物车中每件商品的数量上限，与购物车页面的上限一致
+CART_SKU_MAX_COUNT = 5
+# 购物车中商品种数上限
+CART_MAX_ITEMS = 100
@@ -0,0 +1,49 @@
+import base64
+import pickle
+import random
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from carts import codec as cart_codec
+
+
+def pickle_dumps(cart_dict):
+    """原来的cookie购物车格式"""
+    return base64.b64encode(pickle.dumps(cart_dict)).decode()
+
+
+def pickle_loads(cart_str):
+    return pickle.loads(base64.b64decode(cart_str.encode()))
+
+
+class Command(BaseCommand):
+    """
+    对比cookie购物车编码格式：python manage.py benchmark_cart_codec --sizes 1 5 20 50
+    输出不同商品数量下原pickle+base64格式与新格式的cookie长度及编码、解码耗时
+    """
+    help = '对比cookie购物车pickle格式与新编码格式的长度和速度'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1, 5, 20, 50], help='购物车商品数量')
+        parser.add_argument('--number', type=int, default=2000, help='每项测试的执行次数')
+
+    def handle(self, *args, **options):
+        number = options['number']
+        self.stdout.write('%6s %10s %10s %12s %12s %12s %12s' % (
+            '商品数', 'pickle长度', '新格式长度', 'pickle编码us', '新格式编码us', 'pickle解码us', '新格式解码us'))
+        for size in options['sizes']:
+            sku_ids = random.sample(range(1, 100000), size)
+            cart_dict = {sku_id: {'count': random.randint(1, 5), 'selected': random.random() < 0.8}
+                         for sku_id in sku_ids}
+            old_str = pickle_dumps(cart_dict)
+            new_str = cart_codec.dumps(cart_dict)
+            assert pickle_loads(old_str) == cart_dict and cart_codec.loads(new_str) == cart_dict
+
+            def timing(func, arg):
+                return timeit.timeit(lambda: func(arg), number=number) / number * 1e6
+
+            self.stdout.write('%6d %10d %10d %12.1f %12.1f %12.1f %12.1f' % (
+                size, len(old_str), len(new_str),
+                timing(pickle_dumps, cart_dict), timing(cart_codec.dumps, cart_dict),
+                timing(pickle_loads, old_str), timing(cart_codec.loads, new_str)))
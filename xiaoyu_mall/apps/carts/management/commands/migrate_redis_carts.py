@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+from django_redis import get_redis_connection
+
+from carts.storage import cart_hash_key
+
+# 旧格式购物车转换为新格式：勾选的商品数量为正数，未勾选的为负数
+# 新购物车中已有的商品（迁移期间新写入的）保持不变；匿名购物车保留剩余有效期；最后删除旧的键
+# KEYS: 旧购物车哈希, 旧勾选集合, 新购物车哈希
+MIGRATE_SCRIPT = """
+local items = redis.call('HGETALL', KEYS[1])
+for i = 1, #items, 2 do
+    local count = tonumber(items[i + 1])
+    if count > 0 then
+        if redis.call('SISMEMBER', KEYS[2], items[i]) == 0 then
+            count = -count
+        end
+        redis.call('HSETNX', KEYS[3], items[i], count)
+    end
+end
+local ttl = redis.call('PTTL', KEYS[1])
+if ttl > 0 and redis.call('EXISTS', KEYS[3]) == 1 then
+    redis.call('PEXPIRE', KEYS[3], ttl)
+end
+redis.call('DEL', KEYS[1], KEYS[2])
+return #items / 2
+"""
+
+
+class Command(BaseCommand):
+    """
+    迁移redis购物车：python manage.py migrate_redis_carts [--dry-run]
+    旧格式为 carts_<后缀> 哈希 + selected_<后缀> 集合，新格式为 cart_<后缀> 一个哈希，见carts.storage
+    部署新版本后执行一次，每个购物车在一个Lua脚本中完成，可以在线上运行期间执行
+    """
+    help = '将redis购物车由哈希+集合的旧格式迁移为单个哈希'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='每次SCAN的键数量')
+        parser.add_argument('--dry-run', action='store_true', help='只统计需要迁移的购物车，不修改数据')
+
+    def handle(self, *args, **options):
+        redis_conn = get_redis_connection('carts')
+        migrate = redis_conn.register_script(MIGRATE_SCRIPT)
+        batch_size = options['batch_size']
+        carts = items = 0
+        for key in redis_conn.scan_iter(match='carts_*', count=batch_size):
+            suffix = key.decode()[len('carts_'):]
+            carts += 1
+            if options['dry_run']:
+                items += redis_conn.hlen(key)
+                continue
+            items += migrate(keys=[key, 'selected_%s' % suffix, cart_hash_key(suffix)])
+        # 没有对应购物车哈希的勾选集合已经没有意义，一并删除
+        orphans = 0
+        for key in redis_conn.scan_iter(match='selected_*', count=batch_size):
+            if not redis_conn.exists('carts_%s' % key.decode()[len('selected_'):]):
+                orphans += 1
+                if not options['dry_run']:
+                    redis_conn.delete(key)
+        action = '需要迁移' if options['dry_run'] else '已迁移'
+        self.stdout.write(self.style.SUCCESS('%s%d个购物车，共%d个商品，%d个无效的勾选集合' % (
+            action, carts, items, orphans)))
@@ -0,0 +1,372 @@
+"""
+redis购物车存储：每个购物车一个哈希 cart_<后缀>，字段为sku_id，值为数量，未勾选的商品数量存为负数
+数量和勾选状态在同一个键中，读取购物车只需一次HGETALL
+后缀为user_id或anon_<匿名购物车id>，见carts.utils.get_redis_cart_key
+旧格式（carts_<后缀>哈希 + selected_<后缀>集合）使用 python manage.py migrate_redis_carts 迁移
+
+修改购物车都是一次Lua脚本调用：商品是否存在、库存、单个商品数量上限和购物车商品种数上限在同一次往返中校验
+商品是否存在和库存来自库存缓存 sku_stocks 哈希 {sku_id: 库存}，不查询数据库
+"""
+from django.db import transaction
+from django_redis import get_redis_connection
+
+from carts import constants
+from goods.models import SKU
+from xiaoyu_mall.utils.response_code import RETCODE
+
+# 库存缓存，与购物车在同一个redis库中，Lua脚本才能同时访问
+SKU_STOCKS_KEY = 'sku_stocks'
+
+# Lua脚本的返回值：不小于0为修改后的数量，小于0为错误
+SKU_NOT_FOUND = -1
+OUT_OF_STOCK = -2
+OVER_SKU_MAX_COUNT = -3
+OVER_CART_MAX_ITEMS = -4
+STOCKS_NOT_LOADED = -5
+
+# 校验修改后的数量：减少数量总是允许，增加数量时不能超过单个商品上限和库存，新加入的商品不能超过购物车种数上限
+# 调用前 old 为原数量（绝对值），count 为修改后的数量，KEYS[2] 为库存缓存，ARGV[1] 为sku_id，ARGV[5]、ARGV[6] 为上限
+_CHECK_ITEM = """
+local stock = redis.call('HGET', KEYS[2], ARGV[1])
+if not stock then
+    if redis.call('EXISTS', KEYS[2]) == 0 then
+        return %(STOCKS_NOT_LOADED)d
+    end
+    return %(SKU_NOT_FOUND)d
+end
+if count > 0 and old == 0 and redis.call('HLEN', KEYS[1]) >= tonumber(ARGV[6]) then
+    return %(OVER_CART_MAX_ITEMS)d
+end
+if count > old then
+    if count > tonumber(ARGV[5]) then
+        return %(OVER_SKU_MAX_COUNT)d
+    end
+    if count > tonumber(stock) then
+        return %(OUT_OF_STOCK)d
+    end
+end
+""" % {
+    'SKU_NOT_FOUND': SKU_NOT_FOUND,
+    'OUT_OF_STOCK': OUT_OF_STOCK,
+    'OVER_SKU_MAX_COUNT': OVER_SKU_MAX_COUNT,
+    'OVER_CART_MAX_ITEMS': OVER_CART_MAX_ITEMS,
+    'STOCKS_NOT_LOADED': STOCKS_NOT_LOADED,
+}
+
+# 保存修改后的数量：数量不大于0时删除；selected 为勾选状态（true/false）
+_SAVE_ITEM = """
+if count <= 0 then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    count = 0
+elseif selected then
+    redis.call('HSET', KEYS[1], ARGV[1], count)
+else
+    redis.call('HSET', KEYS[1], ARGV[1], -count)
+end
+if tonumber(ARGV[4]) > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[4])
+end
+return count
+"""
+
+# 增加商品数量：勾选时设为勾选，不勾选时保持原来的勾选状态
+# KEYS: 购物车哈希, 库存缓存  ARGV: sku_id, 增加的数量, 是否勾选(1/0), 有效期(0表示不过期), 单个商品数量上限, 购物车种数上限
+ADD_SCRIPT = """
+local value = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+local old = math.abs(value)
+local count = old + tonumber(ARGV[2])
+local selected = ARGV[3] == '1' or value > 0
+""" + _CHECK_ITEM + _SAVE_ITEM
+
+# 覆盖写入商品数量和勾选状态
+# KEYS: 购物车哈希, 库存缓存  ARGV: sku_id, 数量, 是否勾选(1/0), 有效期(0表示不过期), 单个商品数量上限, 购物车种数上限
+SET_SCRIPT = """
+local old = math.abs(tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0'))
+local count = tonumber(ARGV[2])
+local selected = ARGV[3] == '1'
+""" + _CHECK_ITEM + _SAVE_ITEM
+
+# 删除商品，返回删除的商品种数
+# KEYS: 购物车哈希  ARGV: 有效期(0表示不过期), sku_id...
+REMOVE_SCRIPT = """
+local removed = redis.call('HDEL', KEYS[1], unpack(ARGV, 2))
+if removed > 0 and tonumber(ARGV[1]) > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return removed
+"""
+
+# 全选或取消全选
+# KEYS: 购物车哈希  ARGV: 是否勾选(1/0), 有效期(0表示不过期)
+SELECT_ALL_SCRIPT = """
+local items = redis.call('HGETALL', KEYS[1])
+for i = 1, #items, 2 do
+    local count = math.abs(tonumber(items[i + 1]))
+    if ARGV[1] ~= '1' then
+        count = -count
+    end
+    redis.call('HSET', KEYS[1], items[i], count)
+end
+if #items > 0 and tonumber(ARGV[2]) > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return #items / 2
+"""
+
+# 批量覆盖写入，超过购物车种数上限的新商品不再加入，返回写入的商品种数
+# 调用前 items 为 {sku_id, 值, ...}，KEYS[1] 为目标购物车，ARGV[1] 为种数上限，ARGV[2] 为有效期
+_UPDATE_ITEMS = """
+local size = redis.call('HLEN', KEYS[1])
+local written = 0
+for i = 1, #items, 2 do
+    if redis.call('HEXISTS', KEYS[1], items[i]) == 1 then
+        redis.call('HSET', KEYS[1], items[i], items[i + 1])
+        written = written + 1
+    elseif size < tonumber(ARGV[1]) then
+        redis.call('HSET', KEYS[1], items[i], items[i + 1])
+        size = size + 1
+        written = written + 1
+    end
+end
+if written > 0 and tonumber(ARGV[2]) > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+"""
+
+# KEYS: 购物车哈希  ARGV: 购物车种数上限, 有效期(0表示不过期), sku_id, 值, ...
+UPDATE_SCRIPT = """
+local items = {unpack(ARGV, 3)}
+""" + _UPDATE_ITEMS + """
+return written
+"""
+
+# 合并购物车：数量和勾选状态以源购物车为准，然后删除源购物车
+# 与cookie购物车合并一致：已删除的商品不合并，数量不超过单个商品上限和当前库存，库存为0的商品不合并
+# KEYS: 目标购物车哈希, 源购物车哈希, 库存缓存  ARGV: 购物车种数上限, 有效期(0表示不过期), 单个商品数量上限
+MERGE_SCRIPT = """
+if redis.call('EXISTS', KEYS[3]) == 0 then
+    return %(STOCKS_NOT_LOADED)d
+end
+local source = redis.call('HGETALL', KEYS[2])
+local items = {}
+for i = 1, #source, 2 do
+    local stock = redis.call('HGET', KEYS[3], source[i])
+    if stock then
+        local value = tonumber(source[i + 1])
+        local count = math.min(math.abs(value), tonumber(ARGV[3]), tonumber(stock))
+        if count > 0 then
+            if value < 0 then
+                count = -count
+            end
+            items[#items + 1] = source[i]
+            items[#items + 1] = count
+        end
+    end
+end
+""" % {'STOCKS_NOT_LOADED': STOCKS_NOT_LOADED} + _UPDATE_ITEMS + """
+redis.call('DEL', KEYS[2])
+return written
+"""
+
+# 更新库存缓存：库存缓存还没有加载时不写入，否则只有部分商品，其他商品会被当作不存在
+# KEYS: 库存缓存  ARGV: sku_id, 库存, ...
+SET_STOCKS_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('HSET', KEYS[1], unpack(ARGV))
+end
+"""
+
+# 增减库存缓存：只修改已有的商品
+# KEYS: 库存缓存  ARGV: sku_id, 库存变化, ...
+INCR_STOCKS_SCRIPT = """
+for i = 1, #ARGV, 2 do
+    if redis.call('HEXISTS', KEYS[1], ARGV[i]) == 1 then
+        redis.call('HINCRBY', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+end
+"""
+
+# 已注册的脚本 {脚本: Script}，通过EVALSHA执行，redis中没有脚本时自动重新加载
+_scripts = {}
+
+
+def run_script(redis_conn, source, keys, args):
+    script = _scripts.get(source)
+    if script is None:
+        script = _scripts[source] = redis_conn.register_script(source)
+    return script(keys=keys, args=args, client=redis_conn)
+
+
+class CartError(Exception):
+    """修改购物车失败：库存不足或超过购物车上限，errmsg可以直接提示用户"""
+
+    def __init__(self, retcode, errmsg):
+        super().__init__(errmsg)
+        self.retcode = retcode
+        self.errmsg = errmsg
+
+
+def raise_cart_error(result):
+    """Lua脚本（或cookie购物车校验）的错误码转换为异常"""
+    if result == SKU_NOT_FOUND:
+        raise SKU.DoesNotExist('商品不存在')
+    if result == OUT_OF_STOCK:
+        raise CartError(RETCODE.STOCKERR, '库存不足')
+    if result == OVER_SKU_MAX_COUNT:
+        raise CartError(RETCODE.PARAMERR, '超过商品数量上限，每件商品最多购买%d件' % constants.CART_SKU_MAX_COUNT)
+    if result == OVER_CART_MAX_ITEMS:
+        raise CartError(RETCODE.PARAMERR, '购物车已满，最多添加%d种商品' % constants.CART_MAX_ITEMS)
+
+
+def load_sku_stocks(redis_conn=None):
+    """从数据库加载库存缓存，返回商品数量"""
+    redis_conn = redis_conn or get_redis_connection('carts')
+    stocks = dict(SKU.objects.values_list('id', 'stock'))
+    pl = redis_conn.pipeline()
+    pl.delete(SKU_STOCKS_KEY)
+    if stocks:
+        pl.hset(SKU_STOCKS_KEY, mapping=stocks)
+    pl.execute()
+    return len(stocks)
+
+
+def get_sku_stocks(sku_ids, redis_conn=None):
+    """查询库存缓存：{sku_id: 库存}，不存在的商品不在结果中"""
+    sku_ids = list(sku_ids)
+    if not sku_ids:
+        return {}
+    redis_conn = redis_conn or get_redis_connection('carts')
+    stocks = redis_conn.hmget(SKU_STOCKS_KEY, sku_ids)
+    if not any(stocks) and not redis_conn.exists(SKU_STOCKS_KEY):
+        load_sku_stocks(redis_conn)
+        stocks = redis_conn.hmget(SKU_STOCKS_KEY, sku_ids)
+    return {int(sku_id): int(stock) for sku_id, stock in zip(sku_ids, stocks) if stock is not None}
+
+
+def update_sku_stocks(stocks):
+    """SKU保存后，事务提交后更新库存缓存：{sku_id: 库存}"""
+    args = [value for item in stocks.items() for value in item]
+    if args:
+        transaction.on_commit(
+            lambda: run_script(get_redis_connection('carts'), SET_STOCKS_SCRIPT, [SKU_STOCKS_KEY], args))
+
+
+def incr_sku_stocks(changes):
+    """下单等批量修改库存后，事务提交后增减库存缓存：{sku_id: 库存变化}"""
+    args = [value for item in changes.items() for value in item]
+    if args:
+        transaction.on_commit(
+            lambda: run_script(get_redis_connection('carts'), INCR_STOCKS_SCRIPT, [SKU_STOCKS_KEY], args))
+
+
+def remove_sku_stocks(sku_ids):
+    """SKU删除后，事务提交后从库存缓存中删除"""
+    sku_ids = list(sku_ids)
+    if sku_ids:
+        transaction.on_commit(lambda: get_redis_connection('carts').hdel(SKU_STOCKS_KEY, *sku_ids))
+
+
+def check_cart_item(cart_dict, sku_id, count):
+    """
+    cookie购物车的校验，规则与Lua脚本一致
+    :param cart_dict: 修改前的购物车
+    :param count: 修改后的数量
+    """
+    old = cart_dict[sku_id]['count'] if sku_id in cart_dict else 0
+    stock = get_sku_stocks([sku_id]).get(sku_id)
+    if stock is None:
+        raise_cart_error(SKU_NOT_FOUND)
+    if count > 0 and not old and len(cart_dict) >= constants.CART_MAX_ITEMS:
+        raise_cart_error(OVER_CART_MAX_ITEMS)
+    if count > old:
+        if count > constants.CART_SKU_MAX_COUNT:
+            raise_cart_error(OVER_SKU_MAX_COUNT)
+        if count > stock:
+            raise_cart_error(OUT_OF_STOCK)
+
+
+def cart_hash_key(cart_key):
+    return 'cart_%s' % cart_key
+
+
+def encode_item(count, selected):
+    return count if selected else -count
+
+
+def decode_item(value):
+    value = int(value)
+    return {'count': abs(value), 'selected': value > 0}
+
+
+class RedisCart(object):
+    """redis购物车：读取和修改都是一次往返"""
+
+    def __init__(self, cart_key, redis_conn=None):
+        self.cart_key = cart_key
+        self.key = cart_hash_key(cart_key)
+        self.redis_conn = redis_conn or get_redis_connection('carts')
+        # 匿名购物车每次修改后重新设置有效期
+        self.expires = constants.ANONYMOUS_CART_EXPIRES if cart_key.startswith('anon_') else 0
+
+    def get(self):
+        """所有商品：{sku_id: {'count': 数量, 'selected': 是否勾选}}，与cookie购物车格式一致"""
+        return {int(sku_id): decode_item(value) for sku_id, value in self.redis_conn.hgetall(self.key).items()}
+
+    def get_selected(self):
+        """勾选的商品：{sku_id: 数量}"""
+        return {int(sku_id): int(value) for sku_id, value in self.redis_conn.hgetall(self.key).items()
+                if int(value) > 0}
+
+    def _run_item_script(self, source, sku_id, count, selected):
+        args = [sku_id, count, int(bool(selected)), self.expires,
+                constants.CART_SKU_MAX_COUNT, constants.CART_MAX_ITEMS]
+        result = run_script(self.redis_conn, source, [self.key, SKU_STOCKS_KEY], args)
+        if result == STOCKS_NOT_LOADED:
+            # redis重启或清空后第一次修改购物车，加载库存缓存后重试
+            load_sku_stocks(self.redis_conn)
+            result = run_script(self.redis_conn, source, [self.key, SKU_STOCKS_KEY], args)
+        raise_cart_error(result)
+        return result
+
+    def add(self, sku_id, count, selected=True):
+        """
+        增加商品数量，返回增加后的数量
+        :raises SKU.DoesNotExist: 商品不存在
+        :raises CartError: 库存不足或超过购物车上限
+        """
+        return self._run_item_script(ADD_SCRIPT, sku_id, count, selected)
+
+    def set(self, sku_id, count, selected=True):
+        """覆盖写入商品数量和勾选状态，异常同add"""
+        return self._run_item_script(SET_SCRIPT, sku_id, count, selected)
+
+    def update(self, cart_dict):
+        """
+        批量覆盖写入：{sku_id: {'count', 'selected'}}
+        不存在的商品不写入，数量不超过单个商品上限和库存，超过购物车种数上限的新商品不再加入
+        """
+        stocks = get_sku_stocks(cart_dict.keys(), self.redis_conn)
+        args = [constants.CART_MAX_ITEMS, self.expires]
+        for sku_id, item in cart_dict.items():
+            count = min(item['count'], constants.CART_SKU_MAX_COUNT, stocks.get(int(sku_id), 0))
+            if count > 0:
+                args += [sku_id, encode_item(count, item['selected'])]
+        if len(args) > 2:
+            run_script(self.redis_conn, UPDATE_SCRIPT, [self.key], args)
+
+    def remove(self, *sku_ids):
+        if sku_ids:
+            run_script(self.redis_conn, REMOVE_SCRIPT, [self.key], [self.expires] + list(sku_ids))
+
+    def select_all(self, selected):
+        return run_script(self.redis_conn, SELECT_ALL_SCRIPT, [self.key], [int(bool(selected)), self.expires])
+
+    def merge_into(self, other):
+        """合并到另一个购物车并删除本购物车，返回合并的商品种数"""
+        keys = [other.key, self.key, SKU_STOCKS_KEY]
+        args = [constants.CART_MAX_ITEMS, other.expires, constants.CART_SKU_MAX_COUNT]
+        result = run_script(self.redis_conn, MERGE_SCRIPT, keys, args)
+        if result == STOCKS_NOT_LOADED:
+            load_sku_stocks(self.redis_conn)
+            result = run_script(self.redis_conn, MERGE_SCRIPT, keys, args)
+        return result
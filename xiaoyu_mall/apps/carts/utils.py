@@ -1,6 +1,61 @@
-import base64
-import pickle
-from django_redis import get_redis_connection
+import re
+import secrets
+
+from django.conf import settings
+
+from carts import codec as cart_codec
+from carts import constants
+from carts.storage import RedisCart
+
+# 匿名购物车id：secrets.token_urlsafe(12)生成的16个字符
+ANONYMOUS_CART_ID_RE = re.compile(r'^[A-Za-z0-9_-]{16}$')
+
+
+def anonymous_carts_in_redis():
+    """匿名购物车是否保存在redis中（否则保存在cookie中）"""
+    return getattr(settings, 'CARTS_ANONYMOUS_STORAGE', 'cookie') == 'redis'
+
+
+def get_redis_cart_key(request):
+    """
+    redis购物车键的后缀：登录用户为user_id，服务端匿名购物车为anon_<购物车id>
+    购物车键为 cart_<后缀>，见carts.storage
+    :return: 匿名购物车保存在cookie中时返回None
+    """
+    if request.user.is_authenticated:
+        return str(request.user.id)
+    if not anonymous_carts_in_redis():
+        return None
+    cart_id = request.COOKIES.get(constants.ANONYMOUS_CART_COOKIE, '')
+    if not ANONYMOUS_CART_ID_RE.match(cart_id):
+        # 还没有购物车：生成新的购物车id，修改购物车时写入cookie
+        cart_id = getattr(request, '_anonymous_cart_id', None) or secrets.token_urlsafe(12)
+        request._anonymous_cart_id = cart_id
+    return 'anon_%s' % cart_id
+
+
+def set_anonymous_cart_cookie(request, response, cart_key):
+    """修改匿名购物车时写入购物车id的cookie，有效期与redis中的购物车一致"""
+    if cart_key.startswith('anon_'):
+        response.set_cookie(constants.ANONYMOUS_CART_COOKIE, cart_key[len('anon_'):],
+                            max_age=constants.ANONYMOUS_CART_EXPIRES, httponly=True)
+    return response
+
+
+def merge_anonymous_cart_redis(request, user, response):
+    """
+    登录后合并服务端匿名购物车到用户购物车：一次Lua脚本完成，不经过应用服务器
+    :return: response
+    """
+    cart_id = request.COOKIES.get(constants.ANONYMOUS_CART_COOKIE, '')
+    if not ANONYMOUS_CART_ID_RE.match(cart_id):
+        return response
+    # 数量和勾选状态以匿名购物车为准，合并后删除匿名购物车
+    RedisCart('anon_%s' % cart_id).merge_into(RedisCart(str(user.id)))
+    response.delete_cookie(constants.ANONYMOUS_CART_COOKIE)
+    return response
+
+
 def merge_carts_cookies_redis(request,user,response):
     """合并购物车"""
     """
@@ -11,30 +66,17 @@ def merge_carts_cookies_redis(request,user,response):
         :return: response
         """
     # 获取cookie中的购物车数据
-    cookie_cart_str = request.COOKIES.get('carts')
+    cookie_cart_dict = cart_codec.loads(request.COOKIES.get('carts'))
     # cookie中没有数据就响应结果
-    if not cookie_cart_str:
+    if not cookie_cart_dict:
         return response
-    cookie_cart_dict = pickle.loads(base64.b64decode(cookie_cart_str.encode()))
-    new_cart_dict = {}
-    new_cart_selected_add = []
-    new_cart_selected_remove = []
-    # 同步cookie中购物车数据
-    for sku_id, cookie_dict in cookie_cart_dict.items():
-        new_cart_dict[sku_id] = cookie_dict['count']
-        if cookie_dict['selected']:
-            new_cart_selected_add.append(sku_id)
-        else:
-            new_cart_selected_remove.append(sku_id)
-    # 将new_cart_dict写入到Redis数据库
-    redis_conn = get_redis_connection('carts')
-    pl = redis_conn.pipeline()
-    pl.hmset('carts_%s' % user.id, new_cart_dict)
-    # 将勾选状态同步到Redis数据库
-    if new_cart_selected_add:
-        pl.sadd('selected_%s' % user.id, *new_cart_selected_add)
-    if new_cart_selected_remove:
-        pl.srem('selected_%s' % user.id, *new_cart_selected_remove)
-    pl.execute()
+    # 将cookie中的购物车数据覆盖写入到Redis数据库，数量和勾选状态一次写入
+    RedisCart(str(user.id)).update(cookie_cart_dict)
     response.delete_cookie('carts') # 清除cookie
     return response
+
+
+def merge_carts(request, user, response):
+    """登录后合并匿名购物车：cookie购物车和服务端匿名购物车"""
+    merge_carts_cookies_redis(request, user, response)
+    return merge_anonymous_cart_redis(request, user, response)
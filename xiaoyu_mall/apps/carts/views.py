@@ -1,46 +1,39 @@
 from django.shortcuts import render
 from django.views import View
-import json, base64, pickle
+import json
 from django.http import HttpResponseForbidden, JsonResponse
 from goods.models import SKU
-from django_redis import get_redis_connection
 from xiaoyu_mall.utils.response_code import RETCODE
-from django.conf import settings
+from goods.utils import sku_card_cache
+from carts import codec as cart_codec
+from carts.storage import RedisCart, CartError, check_cart_item, get_sku_stocks
+from carts.utils import get_redis_cart_key, set_anonymous_cart_cookie
 # Create your views here.
 
 class CartsSimpleView(View):
     """商品页面右上角购物车"""
     def get(self, request):
-        user = request.user  # 判断用户是否登录
-        if user.is_authenticated:
-            # 用户已登录，查询Redis购物车
-            redis_conn = get_redis_connection('carts')
-            redis_cart = redis_conn.hgetall('carts_%s' % user.id)
-            cart_selected = redis_conn.smembers('selected_%s' % user.id)
-            # 将redis中的两个数据统一格式，跟cookie中的格式一致，方便统一查询
-            cart_dict = {}
-            for sku_id, count in redis_cart.items():
-                cart_dict[int(sku_id)] = {
-                    'count': int(count),
-                    'selected': sku_id in cart_selected
-                }
+        # 登录用户和服务端匿名购物车查询redis
+        cart_key = get_redis_cart_key(request)
+        if cart_key is not None:
+            # 查询Redis购物车：一次往返取出数量和勾选状态，格式跟cookie中的一致，方便统一查询
+            cart_dict = RedisCart(cart_key).get()
         else:
             # 用户未登录，查询cookie购物车
-            cart_str = request.COOKIES.get('carts')
-            if cart_str:
-                cart_dict = pickle.loads(base64.b64decode(cart_str.encode()))
-            else:
-                cart_dict = {}
-                # 构造简单购物车JSON数据
+            cart_dict = cart_codec.loads(request.COOKIES.get('carts'))
+        # 构造简单购物车JSON数据
         cart_skus = []
-        sku_ids = cart_dict.keys()
-        skus = SKU.objects.filter(id__in=sku_ids)
-        for sku in skus:
+        # 商品卡片数据来自SKU卡片缓存，不查询商品表
+        cards = sku_card_cache.get_many(cart_dict.keys())
+        for sku_id, item in cart_dict.items():
+            card = cards.get(sku_id)
+            if card is None:
+                continue
             cart_skus.append({
-                'id': sku.id,
-                'name': sku.name,
-                'count': cart_dict.get(sku.id).get('count'),
-                'default_image_url': settings.STATIC_URL + 'images/goods/' + sku.default_image.url + '.jpg',
+                'id': sku_id,
+                'name': card['name'],
+                'count': item.get('count'),
+                'default_image_url': card['default_image_url'],
             })
         # 响应json列表数据
         return JsonResponse({'code': RETCODE.OK, 'errmsg': 'OK', 'cart_skus': cart_skus})
@@ -56,29 +49,22 @@ class CartsSelectAllView(View):
         if selected and not isinstance(selected, bool):
             return HttpResponseForbidden('参数selected有误')
         # 判断用户是否登录
-        user = request.user
-        if user.is_authenticated:
-            # 用户已登录，操作redis购物车
-            redis_conn = get_redis_connection('carts')
-            cart = redis_conn.hgetall('carts_%s' % user.id)
-            sku_id_list = cart.keys()
-            if selected:
-                # 全选
-                redis_conn.sadd('selected_%s' % user.id, *sku_id_list)
-            else:
-                # 取消全选
-                redis_conn.srem('selected_%s' % user.id, *sku_id_list)
-            return JsonResponse({'code': RETCODE.OK, 'errmsg': '全选购物车成功'})
+        cart_key = get_redis_cart_key(request)
+        if cart_key is not None:
+            # 用户已登录或匿名购物车保存在服务端，操作redis购物车
+            response = JsonResponse({'code': RETCODE.OK, 'errmsg': '全选购物车成功'})
+            # 全选或取消全选
+            if RedisCart(cart_key).select_all(selected):
+                set_anonymous_cart_cookie(request, response, cart_key)
+            return response
         else:
             # 用户未登录，操作cookie购物车
-            cart = request.COOKIES.get('carts')
+            cart = cart_codec.loads(request.COOKIES.get('carts'))
             response = JsonResponse({'code': RETCODE.OK, 'errmsg': '全选购物车成功'})
-            if cart is not None:
-                cart = pickle.loads(base64.b64decode(cart.encode()))
+            if cart:
                 for sku_id in cart:
                     cart[sku_id]['selected'] = selected
-                cookie_cart = base64.b64encode(pickle.dumps(cart)).decode()
-                response.set_cookie('carts', cookie_cart)
+                response.set_cookie('carts', cart_codec.dumps(cart))
             return response
 
 
@@ -94,12 +80,11 @@ class CartsView(View):
         # 校验参数
         if not all([sku_id, count]):
             return HttpResponseForbidden('缺少必传参数')
-        # 校验sku_id是否合法
+        # 校验sku_id、count是否是数字，商品是否存在在修改购物车时由库存缓存校验，不查询数据库
         try:
-            SKU.objects.get(id=sku_id)
-        except SKU.DoesNotExist:
+            sku_id = int(sku_id)
+        except Exception:
             return HttpResponseForbidden('参数sku_id错误')
-        # 校验count是否是数字
         try:
             count = int(count)
         except Exception as e:
@@ -109,46 +94,40 @@ class CartsView(View):
             if not isinstance(selected, bool):
                 return HttpResponseForbidden('参数selected错误')
         # 判断用户是否登录
-        user = request.user
-        if user.is_authenticated:
-                # 如果用户已登录，操作Redis购物车
-                redis_conn = get_redis_connection('carts')
-                pl = redis_conn.pipeline()
-                # 需要以增量计算的形式保存商品数据
-                pl.hincrby('carts_%s' % user.id, sku_id, count)
-                # 保存商品勾选状态
-                if selected:
-                    pl.sadd('selected_%s' % user.id, sku_id)
-                pl.execute()# 执行
+        cart_key = get_redis_cart_key(request)
+        if cart_key is not None:
+                # 如果用户已登录或匿名购物车保存在服务端，操作Redis购物车
+                # 需要以增量计算的形式保存商品数据，勾选时同时保存勾选状态，同时校验库存和购物车上限
+                try:
+                    RedisCart(cart_key).add(sku_id, count, selected)
+                except SKU.DoesNotExist:
+                    return HttpResponseForbidden('参数sku_id错误')
+                except CartError as e:
+                    return JsonResponse({'code': e.retcode, 'errmsg': e.errmsg})
                 # 响应结果
-                return JsonResponse({'code': RETCODE.OK, 'errmsg': 'OK'})
+                response = JsonResponse({'code': RETCODE.OK, 'errmsg': 'OK'})
+                return set_anonymous_cart_cookie(request, response, cart_key)
         else:  # 用户未登录，操作Cookie购物车
             # 获取cookie中的购物车数据，并且判断是否有购物车数据
-            cart_str = request.COOKIES.get('carts')
-            if cart_str:
-                # 将 cart_str转成bytes类型的字符串
-                cart_str_bytes = cart_str.encode()
-                # 将cart_str_bytes转成bytes类型的字典
-                cart_dict_bytes = base64.b64decode(cart_str_bytes)
-                # 将cart_dict_bytes转成真正的字典
-                cart_dict = pickle.loads(cart_dict_bytes)
-            else:
-                cart_dict = {}
+            cart_dict = cart_codec.loads(request.COOKIES.get('carts'))
             # 判断当前要添加的商品在cart_dict中是否存在
             if sku_id in cart_dict:
                 # 购物车已存在，增量计算
                 origin_count = cart_dict[sku_id]['count']
                 count += origin_count
+            # 校验库存和购物车上限
+            try:
+                check_cart_item(cart_dict, sku_id, count)
+            except SKU.DoesNotExist:
+                return HttpResponseForbidden('参数sku_id错误')
+            except CartError as e:
+                return JsonResponse({'code': e.retcode, 'errmsg': e.errmsg})
             cart_dict[sku_id] = {
                 'count': count,
                 'selected': selected
             }
-            # 将cart_dict转成bytes类型的字典
-            cart_dict_bytes = pickle.dumps(cart_dict)
-            # 将cart_dict_bytes转成bytes类型的字符串
-            cart_str_bytes = base64.b64encode(cart_dict_bytes)
-            # 将cart_str_bytes转成字符串
-            cookie_cart_str = cart_str_bytes.decode()
+            # 将cart_dict编码为cookie字符串
+            cookie_cart_str = cart_codec.dumps(cart_dict)
             # 将新的购物车数据写入到cookie
             response = JsonResponse({'code': RETCODE.OK, 'errmsg': 'OK'})
             response.set_cookie('carts', cookie_cart_str)
@@ -156,47 +135,32 @@ class CartsView(View):
 
     def get(self, request):
         """查询购物车"""
-        user = request.user # 判断用户是否登录
-        if user.is_authenticated:
-            # 用户已登录，查询redis购物车
-            # 创建链接到redis的对象
-            redis_conn = get_redis_connection('carts')
-            # 查询hash数据
-            redis_cart = redis_conn.hgetall('carts_%s' % user.id)
-            # 查询set数据
-            redis_selected = redis_conn.smembers('selected_%s' % user.id)
-            cart_dict = {}
-            # 将redis_cart和redis_selected进行数据结构的构造，合并数据，数据结构跟未登录用户购物车结构一致
-            for sku_id, count in redis_cart.items():
-                cart_dict[int(sku_id)] = {
-                    "count": int(count),
-                    "selected": sku_id in redis_selected
-                }
+        # 登录用户和服务端匿名购物车查询redis
+        cart_key = get_redis_cart_key(request)
+        if cart_key is not None:
+            # 查询redis购物车：一次往返取出数量和勾选状态，数据结构跟未登录用户购物车结构一致
+            cart_dict = RedisCart(cart_key).get()
         else:
             # 用户未登录，查询cookies购物车
-            cart_str = request.COOKIES.get('carts')
-            if cart_str:
-                # 将 cart_str转成bytes类型的字符串
-                cart_str_bytes = cart_str.encode()
-                # 将cart_str_bytes转成bytes类型的字典
-                cart_dict_bytes = base64.b64decode(cart_str_bytes)
-                # 将cart_dict_bytes转成真正的字典
-                cart_dict = pickle.loads(cart_dict_bytes)
-            else:
-                cart_dict = {}
-        sku_ids = cart_dict.keys()                   # 构造响应数据
-        skus = SKU.objects.filter(id__in=sku_ids) # 一次性查询出所有的skus
+            cart_dict = cart_codec.loads(request.COOKIES.get('carts'))
+        # 构造响应数据：商品卡片数据来自SKU卡片缓存
+        cards = sku_card_cache.get_many(cart_dict.keys())
+        # 库存随下单频繁变化，不在卡片缓存中，从库存缓存中查询
+        stocks = get_sku_stocks(cards.keys())
         cart_skus = []
-        for sku in skus:
+        for sku_id, item in cart_dict.items():
+            card = cards.get(sku_id)
+            if card is None:
+                continue
             cart_skus.append({
-                'id': sku.id,
-                'count': cart_dict.get(sku.id).get('count'),
-                'selected': str(cart_dict.get(sku.id).get('selected')),
-                'name': sku.name,
-                'default_image_url': settings.STATIC_URL + 'images/goods/' + sku.default_image.url+'.jpg',
-                'price': str(sku.price),
-                'amount': str(sku.price * cart_dict.get(sku.id).get('count')),
-                'stock': sku.stock
+                'id': sku_id,
+                'count': item.get('count'),
+                'selected': str(item.get('selected')),
+                'name': card['name'],
+                'default_image_url': card['default_image_url'],
+                'price': str(card['price']),
+                'amount': str(card['price'] * item.get('count')),
+                'stock': stocks.get(sku_id, 0)
             })
         context = {
             'cart_skus': cart_skus
@@ -214,64 +178,60 @@ class CartsView(View):
         # 判断参数是否齐全
         if not all([sku_id, count]):
             return HttpResponseForbidden('缺少必传参数')
-        # 判断sku_id是否存在
+        # 判断sku_id、count是否为数字
         try:
-            sku = SKU.objects.get(id=sku_id)
-        except SKU.DoesNotExist:
+            sku_id = int(sku_id)
+        except Exception:
             return HttpResponseForbidden('商品sku_id不存在')
-        # 判断count是否为数字
         try:
             count = int(count)
         except Exception:
             return HttpResponseForbidden('参数count有误')
+        # 判断sku_id是否存在：从SKU卡片缓存中查询
+        card = sku_card_cache.get(sku_id)
+        if card is None:
+            return HttpResponseForbidden('商品sku_id不存在')
         # 判断selected是否为bool值
         if selected:
             if not isinstance(selected, bool):
                 return HttpResponseForbidden('参数selected有误')
 
         # 判断用户是否登录
-        user = request.user
-        if user.is_authenticated:
-            # 用户已登录，修改redis购物车
-            redis_conn = get_redis_connection('carts')
-            pl = redis_conn.pipeline()
-
-            # 由于后端收到的数据是最终的结果，所以"覆盖写入"
-            # redis_conn.hincrby() # 使用新值加上旧值（增量）
-            pl.hset('carts_%s' % user.id, sku_id, count)
-            # 修改勾选状态
-            if selected:
-                pl.sadd('selected_%s' % user.id, sku_id)
-            else:
-                pl.srem('selected_%s' % user.id, sku_id)
-            # 执行
-            pl.execute()
+        cart_key = get_redis_cart_key(request)
+        if cart_key is not None:
+            # 用户已登录或匿名购物车保存在服务端，修改redis购物车
+            # 由于后端收到的数据是最终的结果，所以"覆盖写入"数量和勾选状态，同时校验库存和购物车上限
+            try:
+                RedisCart(cart_key).set(sku_id, count, selected)
+            except SKU.DoesNotExist:
+                return HttpResponseForbidden('商品sku_id不存在')
+            except CartError as e:
+                return JsonResponse({'code': e.retcode, 'errmsg': e.errmsg})
 
             # 创建响应对象
             cart_sku = {
                 'id': sku_id,
                 'count': count,
                 'selected': selected,
-                'name': sku.name,
-                'price': sku.price,
-                'amount': sku.price * count,
-                'default_image_url': settings.STATIC_URL + 'images/goods/' + sku.default_image.url + '.jpg',
+                'name': card['name'],
+                'price': card['price'],
+                'amount': card['price'] * count,
+                'default_image_url': card['default_image_url'],
             }
-            return JsonResponse({'code': RETCODE.OK, 'errmsg': '修改购物车成功', 'cart_sku': cart_sku})
+            response = JsonResponse({'code': RETCODE.OK, 'errmsg': '修改购物车成功', 'cart_sku': cart_sku})
+            return set_anonymous_cart_cookie(request, response, cart_key)
         else:
             # 用户未登录，修改cookie购物车
             # 获取cookie中的购物车数据，并且判断是否有购物车数据
-            cart_str = request.COOKIES.get('carts')
-            if cart_str:
-                # 将 cart_str转成bytes类型的字符串
-                cart_str_bytes = cart_str.encode()
-                # 将cart_str_bytes转成bytes类型的字典
-                cart_dict_bytes = base64.b64decode(cart_str_bytes)
-                # 将cart_dict_bytes转成真正的字典
-                cart_dict = pickle.loads(cart_dict_bytes)
-            else:
-                cart_dict = {}
+            cart_dict = cart_codec.loads(request.COOKIES.get('carts'))
 
+            # 校验库存和购物车上限
+            try:
+                check_cart_item(cart_dict, sku_id, count)
+            except SKU.DoesNotExist:
+                return HttpResponseForbidden('商品sku_id不存在')
+            except CartError as e:
+                return JsonResponse({'code': e.retcode, 'errmsg': e.errmsg})
             # 由于后端收到的是最终的结果，所以"覆盖写入"
             cart_dict[sku_id] = {
                 'count': count,
@@ -283,18 +243,14 @@ class CartsView(View):
                 'id': sku_id,
                 'count': count,
                 'selected': selected,
-                'name': sku.name,
-                'price': sku.price,
-                'amount': sku.price * count,
-                'default_image_url': settings.STATIC_URL + 'data_images/' + sku.default_image.url + '.jpg'
+                'name': card['name'],
+                'price': card['price'],
+                'amount': card['price'] * count,
+                'default_image_url': card['default_image_url']
             }
 
-            # 将cart_dict转成bytes类型的字典
-            cart_dict_bytes = pickle.dumps(cart_dict)
-            # 将cart_dict_bytes转成bytes类型的字符串
-            cart_str_bytes = base64.b64encode(cart_dict_bytes)
-            # 将cart_str_bytes转成字符串
-            cookie_cart_str = cart_str_bytes.decode()
+            # 将cart_dict编码为cookie字符串
+            cookie_cart_str = cart_codec.dumps(cart_dict)
 
             # 将新的购物车数据写入到cookie
             response = JsonResponse({'code': RETCODE.OK, 'errmsg': 'OK', 'cart_sku': cart_sku})
@@ -307,47 +263,29 @@ class CartsView(View):
         # 接收参数
         json_dict = json.loads(request.body.decode())
         sku_id = json_dict.get('sku_id')
-        # 判断sku_id是否存在
+        # 判断sku_id是否为数字，删除不存在的商品不影响购物车，不查询数据库（已下架删除的商品也可以从购物车中删除）
         try:
-            SKU.objects.get(id=sku_id)
-        except SKU.DoesNotExist:
+            sku_id = int(sku_id)
+        except Exception:
             return HttpResponseForbidden('商品不存在')
         # 判断用户是否登录
-        user = request.user
-        if user is not None and user.is_authenticated:
-            # 用户已登录，删除redis购物车
-            redis_conn = get_redis_connection('carts')
-            pl = redis_conn.pipeline()
-            # 删除hash购物车商品记录
-            pl.hdel('carts_%s' % user.id, sku_id)
-            # 同步移除勾选状态
-            pl.srem('selected_%s' % user.id, sku_id)
-            pl.execute()
+        cart_key = get_redis_cart_key(request)
+        if cart_key is not None:
+            # 用户已登录或匿名购物车保存在服务端，删除redis购物车
+            # 删除购物车商品记录，勾选状态在同一个哈希中
+            RedisCart(cart_key).remove(sku_id)
             return JsonResponse({'code': RETCODE.OK, 'errmsg': 'OK'})
         else:
             # 用户未登录，删除cookie购物车
             # 获取cookie中的购物车数据，并且判断是否有购物车数据
-            cart_str = request.COOKIES.get('carts')
-            if cart_str:
-                # 将 cart_str转成bytes类型的字符串
-                cart_str_bytes = cart_str.encode()
-                # 将cart_str_bytes转成bytes类型的字典
-                cart_dict_bytes = base64.b64decode(cart_str_bytes)
-                # 将cart_dict_bytes转成真正的字典
-                cart_dict = pickle.loads(cart_dict_bytes)
-            else:
-                cart_dict = {}
+            cart_dict = cart_codec.loads(request.COOKIES.get('carts'))
             # 构造响应对象
             response = JsonResponse({'code': RETCODE.OK, 'errmsg': 'OK'})
             # 删除字典指定key所对应的记录
             if sku_id in cart_dict:
                 del cart_dict[sku_id]  # 如果删除的key不存在，会抛出异常
-                # 将cart_dict转成bytes类型的字典
-                cart_dict_bytes = pickle.dumps(cart_dict)
-                # 将cart_dict_bytes转成bytes类型的字符串
-                cart_str_bytes = base64.b64encode(cart_dict_bytes)
-                # 将cart_str_bytes转成字符串
-                cookie_cart_str = cart_str_bytes.decode()
+                # 将cart_dict编码为cookie字符串
+                cookie_cart_str = cart_codec.dumps(cart_dict)
                 # 写入新的cookie
                 response.set_cookie('carts', cookie_cart_str)
             return response
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ContentConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'contents'
+
+    def ready(self):
+        # 注册信号接收者
+        from . import signals  # noqa
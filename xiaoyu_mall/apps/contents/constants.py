@@ -0,0 +1,10 @@
+# 商品分类缓存版本名：分类、频道、频道组变化时递增
+CATEGORIES_VERSION = 'categories'
+# 商品分类缓存有效期，单位：秒（版本号变化时立即失效）
+CATEGORIES_CACHE_EXPIRES = 3600 * 24
+# 静态化首页文件名，相对于settings.STATIC_HTML_DIR
+STATIC_INDEX_HTML = 'index.html'
+# 广告类别缓存版本名：广告类别变化时递增
+CONTENT_CATEGORIES_VERSION = 'content_categories'
+# 广告位缓存有效期，单位：秒（版本号变化时立即失效）
+CONTENTS_CACHE_EXPIRES = 3600 * 24
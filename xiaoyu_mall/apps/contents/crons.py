@@ -0,0 +1,28 @@
+import logging
+
+from django.template import loader
+
+from contents import constants
+from contents.utils import get_categories, get_contents
+from xiaoyu_mall.utils.static_html import write_static_html
+
+logger = logging.getLogger('django')
+
+
+def generate_static_index_html():
+    """
+    生成静态的主页html文件
+    :return: 文件的绝对路径
+    """
+    # 渲染模板的上下文
+    context = {
+        'categories': get_categories(),
+        'contents': get_contents(),
+    }
+    # 获取首页模板文件并渲染
+    template = loader.get_template('index.html')
+    html_text = template.render(context)
+    # 写入静态文件，原子替换旧文件
+    file_path = write_static_html(constants.STATIC_INDEX_HTML, html_text)
+    logger.info('generate_static_index_html: %s' % file_path)
+    return file_path
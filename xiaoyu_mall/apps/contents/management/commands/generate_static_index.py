@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from contents.crons import generate_static_index_html
+
+
+class Command(BaseCommand):
+    """生成静态首页：python manage.py generate_static_index"""
+    help = '生成静态首页html文件'
+
+    def handle(self, *args, **options):
+        file_path = generate_static_index_html()
+        self.stdout.write(self.style.SUCCESS('静态首页已生成：%s' % file_path))
@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from contents import constants
+from contents.crons import generate_static_index_html
+from contents.models import Content, ContentCategory
+from contents.utils import content_version_name
+from goods.models import GoodsCategory, GoodsChannel, GoodsChannelGroup
+from xiaoyu_mall.utils.versions import incr_version_on_commit
+
+
+def regenerate_static_index_on_commit():
+    """首页静态化开启时，事务提交后重新生成静态首页"""
+    if settings.INDEX_STATIC_ENABLED:
+        transaction.on_commit(generate_static_index_html)
+
+
+@receiver([post_save, post_delete], sender=GoodsCategory)
+@receiver([post_save, post_delete], sender=GoodsChannel)
+@receiver([post_save, post_delete], sender=GoodsChannelGroup)
+def expire_categories(sender, **kwargs):
+    """商品分类、频道或频道组变化时，递增商品分类缓存版本"""
+    incr_version_on_commit(constants.CATEGORIES_VERSION)
+    regenerate_static_index_on_commit()
+
+
+@receiver(pre_save, sender=Content)
+def remember_content_category(sender, instance, **kwargs):
+    """记录修改前的广告类别，广告换到其它广告位时新旧广告位都要失效"""
+    if instance.pk:
+        instance.origin_category_id = Content.objects.filter(pk=instance.pk).values_list(
+            'category_id', flat=True).first()
+
+
+@receiver([post_save, post_delete], sender=Content)
+def expire_contents(sender, instance, **kwargs):
+    """广告内容变化时，只递增所在广告位的缓存版本，并重新生成静态首页"""
+    incr_version_on_commit(content_version_name(instance.category_id))
+    origin_category_id = getattr(instance, 'origin_category_id', None)
+    if origin_category_id and origin_category_id != instance.category_id:
+        incr_version_on_commit(content_version_name(origin_category_id))
+    regenerate_static_index_on_commit()
+
+
+@receiver([post_save, post_delete], sender=ContentCategory)
+def expire_content_categories(sender, **kwargs):
+    """广告类别变化时，递增广告类别缓存版本，并重新生成静态首页"""
+    incr_version_on_commit(constants.CONTENT_CATEGORIES_VERSION)
+    regenerate_static_index_on_commit()
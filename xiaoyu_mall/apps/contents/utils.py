@@ -4,17 +4,29 @@
 # @File: utils
 # @Describle: 
 # =====================
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
 
-from goods.models import GoodsChannel
+from django.core.cache import cache
 
+from contents import constants
+from contents.models import Content, ContentCategory
+from goods.models import GoodsCategory, GoodsChannel
+from xiaoyu_mall.utils.versions import get_version, get_versions
 
-def get_categories():
-    """获取商品分类"""
+# 进程内缓存：(版本号, 商品分类)
+_categories_local = (None, None)
+
+
+def build_categories():
+    """批量查询构造商品分类：频道组 ==> 一级 ==> 二级 ==> 三级"""
     # 准备商品分类对应的字典
     categories = OrderedDict()
-    # 查询并展示商品分类 37个一级类别
-    channels = GoodsChannel.objects.order_by('group_id', 'sequence')
+    # 一次性查询出所有二级和三级类别，按父类别分组
+    subs = defaultdict(list)
+    for cat in GoodsCategory.objects.filter(parent__isnull=False).order_by('id').values('id', 'name', 'parent_id'):
+        subs[cat['parent_id']].append(cat)
+    # 查询频道及其一级类别 37个一级类别
+    channels = GoodsChannel.objects.select_related('category').order_by('group_id', 'sequence')
     # 遍历所有频道
     for channel in channels:
         group_id = channel.group_id  # 当前组
@@ -28,12 +40,68 @@ def get_categories():
             'name': cat1.name,
             'url': channel.url
         })
-        # 查询二级和三级类别
-        for cat2 in cat1.subs.all():  # 从一级类别查找二级类别
-            cat2.sub_cats = []  # 给二级类别添加一个保存三级类别的列表
-            for cat3 in cat2.subs.all():  # 从二级类别查找三级类别
-                cat2.sub_cats.append(cat3)  # 将三级类别添加到二级sub_cats
-                # 将二级类别添加到一级类别的sub_cats
-
-            categories[group_id]['sub_cats'].append(cat2)
+        # 从分组结果中取出二级和三级类别
+        for cat2 in subs[cat1.id]:
+            categories[group_id]['sub_cats'].append({
+                'id': cat2['id'],
+                'name': cat2['name'],
+                'sub_cats': [{'id': cat3['id'], 'name': cat3['name']} for cat3 in subs[cat2['id']]]
+            })
+    return categories
+
+
+def get_categories():
+    """获取商品分类：进程内缓存 ==> Redis缓存 ==> 数据库"""
+    global _categories_local
+    version = get_version(constants.CATEGORIES_VERSION)
+    local_version, categories = _categories_local
+    if local_version == version:
+        return categories
+    cache_key = 'categories_%s' % version
+    categories = cache.get(cache_key)
+    if categories is None:
+        categories = build_categories()
+        cache.set(cache_key, categories, constants.CATEGORIES_CACHE_EXPIRES)
+    _categories_local = (version, categories)
     return categories
+
+
+def content_version_name(category_id):
+    """广告位缓存版本名：每个广告类别单独一个版本"""
+    return 'contents_%s' % category_id
+
+
+def get_content_categories():
+    """获取广告类别：[(类别id, 类别键名)]"""
+    version = get_version(constants.CONTENT_CATEGORIES_VERSION)
+    cache_key = 'content_categories_%s' % version
+    content_categories = cache.get(cache_key)
+    if content_categories is None:
+        content_categories = list(ContentCategory.objects.order_by('id').values_list('id', 'key'))
+        cache.set(cache_key, content_categories, constants.CONTENTS_CACHE_EXPIRES)
+    return content_categories
+
+
+def get_contents():
+    """获取首页广告数据：{广告类别键名: [广告内容]}，每个广告位单独缓存"""
+    content_categories = get_content_categories()
+    # 一次往返取出所有广告位的版本号，拼接缓存键
+    versions = get_versions(*[content_version_name(category_id) for category_id, _ in content_categories])
+    cache_keys = {}
+    for category_id, _ in content_categories:
+        cache_keys[category_id] = 'contents_%s_%s' % (category_id, versions[content_version_name(category_id)])
+    slots = cache.get_many(list(cache_keys.values()))
+    missing = [category_id for category_id, cache_key in cache_keys.items() if cache_key not in slots]
+    if missing:
+        # 一次查询出未命中广告位的所有未下架广告，再按类别分组并排序
+        grouped = {category_id: [] for category_id in missing}
+        queryset = Content.objects.filter(category_id__in=missing, status=True).order_by('category_id', 'sequence')
+        for content in queryset.values('id', 'category_id', 'title', 'url', 'image', 'text'):
+            grouped[content.pop('category_id')].append(content)
+        new_slots = {cache_keys[category_id]: grouped[category_id] for category_id in missing}
+        cache.set_many(new_slots, constants.CONTENTS_CACHE_EXPIRES)
+        slots.update(new_slots)
+    contents = OrderedDict()
+    for category_id, key in content_categories:
+        contents[key] = slots[cache_keys[category_id]]
+    return contents
@@ -1,22 +1,24 @@
-from collections import OrderedDict
-
+from django.conf import settings
+from django.http import HttpResponse
 from django.shortcuts import render
 from django.views import View
 
-from contents.models import ContentCategory
-from contents.utils import get_categories
+from contents import constants
+from contents.utils import get_categories, get_contents
+from xiaoyu_mall.utils.static_html import read_static_html
+
 
 class IndexView(View):
     def get(self, request):
         """提供首页广告页面"""
+        if settings.INDEX_STATIC_ENABLED:
+            # 静态化模式：直接返回生成好的首页，不访问数据库和Redis
+            html = read_static_html(constants.STATIC_INDEX_HTML)
+            if html is not None:
+                return HttpResponse(html)
         categories = get_categories()
         # 查询首页广告数据
-        # 查询所有的广告类别
-        content_categories = ContentCategory.objects.all()
-        # 使用广告类别查询出该类别对应的所有的广告内容
-        contents = OrderedDict()
-        for content_categorie in content_categories:
-            contents[content_categorie.key] = content_categorie.content_set.filter(status=True).order_by('sequence')  # 查询出未下架的广告并排序
+        contents = get_contents()
         # 渲染模板的上下文
         context = {
                 'categories': categories,
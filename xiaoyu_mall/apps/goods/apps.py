@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class GoodsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'goods'
+
+    def ready(self):
+        # 注册信号接收者
+        from . import signals  # noqa
@@ -0,0 +1,86 @@
+# 商品类别索引版本名：商品类别变化时递增
+CATEGORY_INDEX_VERSION = 'category_index'
+# 商品类别索引检查版本号的最小间隔，单位：秒
+CATEGORY_INDEX_CHECK_INTERVAL = 1
+# 商品列表页每页记录条数
+LIST_PER_PAGE = 5
+# 分类上架商品数量缓存有效期，单位：秒（商品上下架时立即删除）
+SKU_COUNT_CACHE_EXPIRES = 3600
+# 商品列表页排序规则 ==> 排序字段
+LIST_SORT_FIELDS = {
+    'default': 'create_time',  # 默认按照上架时间排序
+    'price': 'price',  # 按照价格由低到高排序
+    'hot': '-sales',  # 按照销量由高到低排序
+}
+# 商品列表页缓存有效期，单位：秒（商品价格、上下架、销量变化时立即失效）
+LIST_CACHE_EXPIRES = 600
+# SPU规格矩阵缓存有效期，单位：秒（SKU和规格变化时立即失效）
+SPU_SPECS_CACHE_EXPIRES = 3600 * 24
+# 静态化商品详情页目录（相对STATIC_HTML_DIR），文件名为 <sku_id>.html
+STATIC_DETAIL_DIR = 'detail'
+# 记录上一次生成静态详情页的时间，增量生成时只处理此后变化的商品
+STATIC_DETAIL_LAST_RUN = 'detail/.last_run'
+# 生成静态详情页时每个子进程任务处理的商品数量
+STATIC_DETAIL_BATCH_SIZE = 50
+# 热销排行默认返回的商品数量
+HOT_GOODS_LIMIT = 2
+# 热销排行最多返回的商品数量
+HOT_GOODS_MAX_LIMIT = 20
+# 热销排行的时间窗口 ==> 统计天数（不指定时间窗口按累计销量排行）
+HOT_GOODS_WINDOWS = {
+    'today': 1,
+    '7d': 7,
+    '30d': 30,
+}
+# 每日销量排行榜保留的天数
+HOT_GOODS_DAYS = 30
+# 没有上架商品的类别，空排行榜标记的有效期，单位：秒（期间不再查询数据库重建）
+HOT_GOODS_EMPTY_EXPIRES = 300
+# 重建热销排行榜的锁的有效期，单位：秒（期间其他请求不再查询数据库重建）
+HOT_GOODS_REBUILD_LOCK_EXPIRES = 60
+# 多日销量合并结果的缓存有效期，单位：秒（下单时立即删除）
+HOT_GOODS_WINDOW_CACHE_EXPIRES = 60
+# 分类商品访问量在redis中的保留天数，需大于写入数据库的间隔
+VISIT_COUNT_EXPIRES_DAYS = 7
+# 访问量写入数据库的锁的有效期，单位：秒（两次写入不能同时进行，否则重复累加）
+VISIT_COUNT_FLUSH_LOCK_EXPIRES = 600
+# 商品评价每页条数
+COMMENTS_PER_PAGE = 30
+# 商品评价缓存有效期，单位：秒（有新评价时立即失效）
+COMMENTS_CACHE_EXPIRES = 3600
+# 搜索联想词返回的商品数量
+SUGGEST_LIMIT = 10
+# 搜索联想词的最大输入长度
+SUGGEST_MAX_QUERY_LENGTH = 50
+# 搜索联想词每次最多扫描的前缀匹配数量，保证短前缀也能快速返回
+SUGGEST_MAX_SCAN = 2000
+# 搜索联想词索引检查商品变化的最小间隔，单位：秒
+SUGGEST_CHECK_INTERVAL = 1
+# 搜索联想词索引全量重建的间隔，单位：秒（商品销量变化不触发信号，定期重建更新排序）
+SUGGEST_REBUILD_INTERVAL = 600
+# 商品筛选位图索引检查版本号的最小间隔，单位：秒
+FACET_CHECK_INTERVAL = 1
+# 商品筛选的价格区间：[下限, 上限)，上限为None表示不限
+FACET_PRICE_BANDS = [
+    (0, 1000),
+    (1000, 3000),
+    (3000, 5000),
+    (5000, 10000),
+    (10000, None),
+]
+# 规格筛选的查询参数前缀，如 spec_颜色=金色
+FACET_SPEC_PREFIX = 'spec_'
+# 搜索结果缓存有效期，单位：秒（索引更新后立即失效）
+SEARCH_CACHE_EXPIRES = 3600
+# 每日热门搜索词保留的数量：远多于预热的数量，新出现的搜索词有机会累积次数
+SEARCH_TOP_QUERIES_KEEP = 1000
+# 每日搜索词超过该数量时才裁剪到SEARCH_TOP_QUERIES_KEEP个，而不是每次搜索都裁剪
+SEARCH_TOP_QUERIES_TRIM = 2 * SEARCH_TOP_QUERIES_KEEP
+# 更新索引后预热的热门搜索词数量
+SEARCH_PREWARM_QUERIES = 50
+# SKU卡片数据在redis中的有效期，单位：秒（商品卡片字段变化时立即删除）
+SKU_CARD_EXPIRES = 3600 * 24
+# 每个进程内缓存的SKU卡片数量
+SKU_CARD_LRU_SIZE = 2000
+# 进程内SKU卡片缓存检查商品变化的最小间隔，单位：秒
+SKU_CARD_CHECK_INTERVAL = 1
@@ -0,0 +1,188 @@
+import datetime
+import logging
+import os
+
+from django.db import transaction
+from django.db.models import Q
+from django.template import loader
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django_redis import get_redis_connection
+from redis.exceptions import LockError
+
+from goods import constants
+from goods.models import SKU, SPUSpecification, SpecificationOption, SKUSpecification, GoodsCategory, \
+    GoodsChannel, GoodsChannelGroup, GoodsVisitCount
+from goods.utils import get_detail_context, visit_count_key
+from xiaoyu_mall.utils.static_html import get_static_html_path, write_static_html
+
+logger = logging.getLogger('django')
+
+
+def detail_html_name(sku_id):
+    """静态化详情页的文件名（相对STATIC_HTML_DIR）"""
+    return '%s/%s.html' % (constants.STATIC_DETAIL_DIR, sku_id)
+
+
+def render_detail_html(sku):
+    """
+    渲染商品详情页
+    :return: html字符串，规格信息不完整时返回None
+    """
+    context = get_detail_context(sku)
+    if context is None:
+        return None
+    # 库存变化频繁，静态页面通过接口获取实时库存
+    context['stock'] = ''
+    template = loader.get_template('detail.html')
+    return template.render(context)
+
+
+def generate_static_sku_detail_html(sku_ids):
+    """
+    生成一批商品的静态详情页，在子进程中执行
+    :param sku_ids: 商品id列表
+    :return: 成功生成的页面数量
+    """
+    count = 0
+    for sku in SKU.objects.select_related('spu').filter(id__in=sku_ids):
+        html_text = render_detail_html(sku)
+        if html_text is None:
+            logger.error('generate_static_sku_detail_html: sku %s 规格信息不完整' % sku.id)
+            continue
+        write_static_html(detail_html_name(sku.id), html_text)
+        count += 1
+    return count
+
+
+def remove_static_sku_detail_html(sku_ids):
+    """删除商品的静态详情页（商品下架或删除）"""
+    count = 0
+    for sku_id in sku_ids:
+        try:
+            os.remove(get_static_html_path(detail_html_name(sku_id)))
+        except FileNotFoundError:
+            continue
+        count += 1
+    return count
+
+
+def get_generated_sku_ids():
+    """已生成静态详情页的商品id"""
+    try:
+        names = os.listdir(get_static_html_path(constants.STATIC_DETAIL_DIR))
+    except FileNotFoundError:
+        return set()
+    sku_ids = set()
+    for name in names:
+        sku_id, ext = os.path.splitext(name)
+        if ext == '.html' and sku_id.isdigit():
+            sku_ids.add(int(sku_id))
+    return sku_ids
+
+
+def get_last_run():
+    """上一次生成静态详情页的时间，没有记录时返回None"""
+    try:
+        with open(get_static_html_path(constants.STATIC_DETAIL_LAST_RUN), encoding='utf-8') as f:
+            return parse_datetime(f.read().strip())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def set_last_run(started):
+    """记录本次生成的开始时间，下一次增量生成从该时间开始"""
+    write_static_html(constants.STATIC_DETAIL_LAST_RUN, started.isoformat())
+
+
+def get_changed_sku_ids(since):
+    """
+    查询since之后需要重新生成详情页的商品
+    :return: 商品id集合，商品分类或频道变化（影响所有页面的导航）时返回None表示全部重新生成
+    注意：根据update_time判断，数据库中直接删除的记录无法发现，需要定期全量生成
+    """
+    # 商品分类、频道变化：所有页面的分类导航和面包屑都可能变化
+    for model in (GoodsCategory, GoodsChannel, GoodsChannelGroup):
+        if model.objects.filter(update_time__gt=since).exists():
+            return None
+
+    # SPU、规格、规格选项、SKU规格变化：同一SPU下所有SKU的规格选择区域都要更新
+    spu_ids = set()
+    spu_ids.update(SKU.objects.filter(update_time__gt=since).values_list('spu_id', flat=True))
+    spu_ids.update(SPUSpecification.objects.filter(update_time__gt=since).values_list('spu_id', flat=True))
+    spu_ids.update(SpecificationOption.objects.filter(update_time__gt=since).values_list('spec__spu_id', flat=True))
+    spu_ids.update(SKUSpecification.objects.filter(update_time__gt=since).values_list('sku__spu_id', flat=True))
+    return set(SKU.objects.filter(Q(spu_id__in=spu_ids) | Q(spu__update_time__gt=since)).values_list('id', flat=True))
+
+
+# 访问量写入数据库的锁，同一时间只有一个进程写入
+VISIT_COUNT_FLUSH_LOCK = 'visit_count_flush_lock'
+
+
+def flush_visit_count():
+    """
+    将redis中记录的分类商品访问量批量写入数据库
+    读出访问量写入数据库后再从redis中减去，期间新增的访问量保留到下一次
+    两次写入同时进行会读到相同的访问量，重复累加到数据库，redis中减成负数，所以加锁，上一次还没有结束时跳过
+    :return: 写入的访问量总数
+    """
+    redis_conn = get_redis_connection('visit_count')
+    lock = redis_conn.lock(VISIT_COUNT_FLUSH_LOCK, timeout=constants.VISIT_COUNT_FLUSH_LOCK_EXPIRES, blocking=False)
+    if not lock.acquire():
+        logger.info('flush_visit_count: 上一次写入还没有结束，跳过')
+        return 0
+    try:
+        return _flush_visit_count(redis_conn)
+    finally:
+        try:
+            lock.release()
+        except LockError:
+            # 写入时间超过了锁的有效期
+            logger.warning('flush_visit_count: 锁已过期')
+
+
+def _flush_visit_count(redis_conn):
+    today = timezone.localdate()
+    days = [today - datetime.timedelta(days=i) for i in range(constants.VISIT_COUNT_EXPIRES_DAYS)]
+    pl = redis_conn.pipeline()
+    for day in days:
+        pl.hgetall(visit_count_key(day))
+    # {(date, category_id): 访问量}
+    visits = {}
+    for day, counts in zip(days, pl.execute()):
+        for category_id, count in counts.items():
+            if int(count) > 0:
+                visits[(day, int(category_id))] = int(count)
+    if not visits:
+        return 0
+
+    # 已删除的类别不再统计
+    category_ids = set(GoodsCategory.objects.filter(id__in={category_id for _, category_id in visits})
+                       .values_list('id', flat=True))
+    with transaction.atomic():
+        records = GoodsVisitCount.objects.select_for_update().filter(
+            date__in={day for day, _ in visits}, category_id__in=category_ids)
+        existing = {(record.date, record.category_id): record for record in records}
+        updated = []
+        created = []
+        for (day, category_id), count in visits.items():
+            if category_id not in category_ids:
+                continue
+            record = existing.get((day, category_id))
+            if record is None:
+                created.append(GoodsVisitCount(category_id=category_id, date=day, count=count))
+            else:
+                record.count += count
+                record.update_time = timezone.now()
+                updated.append(record)
+        GoodsVisitCount.objects.bulk_update(updated, ['count', 'update_time'])
+        GoodsVisitCount.objects.bulk_create(created)
+
+    # 写入成功后从redis中减去已写入的访问量（已删除类别的访问量直接丢弃）
+    pl = redis_conn.pipeline()
+    for (day, category_id), count in visits.items():
+        pl.hincrby(visit_count_key(day), category_id, -count)
+    pl.execute()
+    total = sum(count for (_, category_id), count in visits.items() if category_id in category_ids)
+    logger.info('flush_visit_count: %d' % total)
+    return total
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from goods.crons import flush_visit_count
+
+
+class Command(BaseCommand):
+    """
+    将redis中的分类商品访问量写入数据库，由crontab定期执行：
+    * * * * * cd /path/to/xiaoyu_mall && python manage.py flush_visit_count
+    """
+    help = '将redis中记录的分类商品访问量批量写入数据库'
+
+    def handle(self, *args, **options):
+        count = flush_visit_count()
+        self.stdout.write(self.style.SUCCESS('已写入%d次访问' % count))
@@ -0,0 +1,80 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+
+from goods import constants
+from goods.crons import generate_static_sku_detail_html, remove_static_sku_detail_html, get_generated_sku_ids, \
+    get_last_run, set_last_run, get_changed_sku_ids
+from goods.models import SKU
+
+
+class Command(BaseCommand):
+    """
+    生成静态商品详情页：
+    python manage.py generate_static_detail               全量生成
+    python manage.py generate_static_detail --incremental 只生成上一次之后变化的商品
+    python manage.py generate_static_detail --spu 1 2     只生成指定SPU的商品
+    """
+    help = '使用多进程将上架商品的详情页生成为静态html文件'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true', help='只生成上一次生成之后变化的商品')
+        parser.add_argument('--sku', type=int, nargs='+', default=[], help='只生成指定的商品')
+        parser.add_argument('--spu', type=int, nargs='+', default=[], help='只生成指定SPU的商品')
+        parser.add_argument('--category', type=int, nargs='+', default=[], help='只生成指定三级类别的商品')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='子进程数量，0表示在当前进程中生成')
+        parser.add_argument('--batch-size', type=int, default=constants.STATIC_DETAIL_BATCH_SIZE,
+                            help='每个子进程任务处理的商品数量')
+
+    def handle(self, *args, **options):
+        started = timezone.now()
+        start = time.time()
+
+        # 确定需要处理的商品
+        queryset = SKU.objects.all()
+        selected = options['sku'] or options['spu'] or options['category']
+        full = False
+        if selected:
+            queryset = queryset.filter(Q(id__in=options['sku']) | Q(spu_id__in=options['spu']) |
+                                       Q(category_id__in=options['category']))
+        else:
+            last_run = get_last_run() if options['incremental'] else None
+            sku_ids = get_changed_sku_ids(last_run) if last_run else None
+            if sku_ids is None:
+                full = True
+            else:
+                queryset = queryset.filter(id__in=sku_ids)
+
+        sku_ids = []
+        removed_ids = []
+        for sku_id, is_launched in queryset.values_list('id', 'is_launched'):
+            (sku_ids if is_launched else removed_ids).append(sku_id)
+        if full:
+            # 全量生成时清理已删除商品的页面
+            removed_ids = get_generated_sku_ids() - set(sku_ids)
+        removed = remove_static_sku_detail_html(removed_ids)
+
+        # 分批交给子进程渲染
+        batch_size = options['batch_size']
+        batches = [sku_ids[i:i + batch_size] for i in range(0, len(sku_ids), batch_size)]
+        if options['workers'] > 0 and len(batches) > 1:
+            # 子进程不能复用父进程的数据库连接，fork之前先关闭
+            connections.close_all()
+            # 以spawn方式启动的子进程需要重新初始化Django
+            with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as executor:
+                count = sum(executor.map(generate_static_sku_detail_html, batches))
+        else:
+            count = sum(generate_static_sku_detail_html(batch) for batch in batches)
+
+        # 只有全量和增量生成才更新记录时间，生成指定商品不影响下一次增量生成的范围
+        if not selected:
+            set_last_run(started)
+
+        self.stdout.write(self.style.SUCCESS('已生成%d个商品详情页，删除%d个，耗时%.2f秒' %
+                                             (count, removed, time.time() - start)))
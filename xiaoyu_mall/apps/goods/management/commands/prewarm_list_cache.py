@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from goods.models import SKU
+from goods.utils import prewarm_list_pages
+
+
+class Command(BaseCommand):
+    """预热商品列表页缓存：python manage.py prewarm_list_cache --pages 3"""
+    help = '预热所有类别商品列表页每个排序的前N页'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=3, help='每个排序预热的页数')
+
+    def handle(self, *args, **options):
+        category_ids = SKU.objects.filter(is_launched=True).values_list('category_id', flat=True).distinct()
+        count = 0
+        for category_id in category_ids:
+            prewarm_list_pages(category_id, options['pages'])
+            count += 1
+        self.stdout.write(self.style.SUCCESS('已预热%d个类别的商品列表页' % count))
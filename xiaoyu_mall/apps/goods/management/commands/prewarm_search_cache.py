@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from goods import constants
+from goods.utils import prewarm_search_cache
+from xiaoyu_mall.utils.search_signals import SEARCH_INDEX_VERSION
+from xiaoyu_mall.utils.versions import incr_version
+
+
+class Command(BaseCommand):
+    """
+    预热搜索结果缓存：python manage.py prewarm_search_cache [--expire]
+    使用haystack的rebuild_index、update_index更新索引后，加--expire使旧的搜索结果缓存失效
+    """
+    help = '预热热门搜索词的搜索结果缓存'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=constants.SEARCH_PREWARM_QUERIES, help='预热的搜索词数量')
+        parser.add_argument('--expire', action='store_true', help='先递增索引代数，使旧的搜索结果缓存失效')
+
+    def handle(self, *args, **options):
+        if options['expire']:
+            incr_version(SEARCH_INDEX_VERSION)
+        count = prewarm_search_cache(options['queries'])
+        self.stdout.write(self.style.SUCCESS('已预热%d个搜索词的结果' % count))
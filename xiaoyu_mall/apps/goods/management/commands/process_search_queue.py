@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from goods.utils import prewarm_search_cache
+from xiaoyu_mall.utils.search_signals import process_search_queue
+
+
+class Command(BaseCommand):
+    """
+    批量更新搜索索引：python manage.py process_search_queue [--loop]
+    不加--loop时处理完队列中的记录后退出，可由crontab定期执行
+    """
+    help = '从redis队列中取出修改过的记录，批量更新搜索索引'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='持续运行，队列为空时等待')
+        parser.add_argument('--interval', type=float, default=1, help='队列为空时的等待时间，单位：秒')
+        parser.add_argument('--batch-size', type=int, default=500, help='每次更新索引的记录数量')
+
+    def handle(self, *args, **options):
+        total = 0
+        # 本轮是否更新过索引，队列处理完后预热热门搜索词的结果缓存
+        updated = False
+        while True:
+            count = process_search_queue(options['batch_size'])
+            total += count
+            if count:
+                updated = True
+                continue
+            if updated:
+                prewarm_search_cache()
+                updated = False
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS('已更新%d条记录的索引' % total))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from goods.models import GoodsCategory
+from goods.utils import rebuild_hot_goods
+
+
+class Command(BaseCommand):
+    """重建热销排行榜：python manage.py rebuild_hot_goods [--category 115]"""
+    help = '从数据库重建三级类别的累计和每日热销排行榜'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--category', type=int, nargs='+', default=[], help='只重建指定的三级类别')
+
+    def handle(self, *args, **options):
+        category_ids = options['category']
+        if not category_ids:
+            # 三级类别：没有下级类别的类别
+            category_ids = GoodsCategory.objects.filter(subs=None).values_list('id', flat=True)
+        count = skipped = 0
+        for category_id in category_ids:
+            # 其他进程正在重建的类别跳过
+            if rebuild_hot_goods(category_id) is None:
+                skipped += 1
+            else:
+                count += 1
+        self.stdout.write(self.style.SUCCESS('已重建%d个类别的热销排行榜，跳过%d个正在重建的类别' % (count, skipped)))
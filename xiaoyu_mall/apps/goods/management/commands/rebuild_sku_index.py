@@ -0,0 +1,134 @@
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections as db_connections
+from django.utils import timezone
+from haystack import connections
+from haystack.backends.whoosh_backend import WhooshSearchBackend
+
+from goods.models import SKU
+from goods.utils import prewarm_search_cache
+from xiaoyu_mall.utils.search_signals import mark_dirty, SEARCH_INDEX_VERSION
+from xiaoyu_mall.utils.versions import incr_version
+
+
+def index_sku_range(connection_alias, start_id, end_id, part_path):
+    """
+    在子进程中为一段id范围内的上架商品建立独立的索引
+    :return: 索引的商品数量
+    """
+    backend = WhooshSearchBackend(connection_alias, PATH=part_path)
+    index = connections[connection_alias].get_unified_index().get_index(SKU)
+    skus = list(index.index_queryset(using=connection_alias).filter(id__gte=start_id, id__lte=end_id))
+    if skus:
+        backend.update(index, skus)
+    return len(skus)
+
+
+def merge_indexes(connection_alias, index_path, part_paths):
+    """将各部分索引合并到新的索引目录"""
+    backend = WhooshSearchBackend(connection_alias, PATH=index_path)
+    backend.setup()
+    writer = backend.index.writer()
+    for part_path in part_paths:
+        part_index = WhooshSearchBackend(connection_alias, PATH=part_path)
+        part_index.setup()
+        with part_index.index.reader() as reader:
+            writer.add_reader(reader)
+    writer.commit(optimize=True)
+
+
+def swap_index(index_path, new_path):
+    """
+    将索引路径（符号链接）原子地指向新的索引目录，正在使用旧索引的进程不受影响
+    索引路径不纳入版本控制；原来是haystack创建的普通目录时先改名为 <索引路径>_legacy，只有这一次不是原子操作
+    :return: 原来的索引目录
+    """
+    if os.path.isdir(index_path) and not os.path.islink(index_path):
+        os.rename(index_path, index_path + '_legacy')
+        old_path = index_path + '_legacy'
+    else:
+        old_path = os.path.realpath(index_path)
+    tmp_link = index_path + '.tmp'
+    if os.path.lexists(tmp_link):
+        os.unlink(tmp_link)
+    os.symlink(os.path.basename(new_path), tmp_link)
+    os.replace(tmp_link, index_path)
+    return old_path
+
+
+def remove_old_indexes(index_path, keep):
+    """删除旧的索引目录，保留当前和上一次的，避免还在读取的进程找不到文件"""
+    parent, name = os.path.split(index_path)
+    old_paths = sorted(os.path.join(parent, entry) for entry in os.listdir(parent)
+                       if entry.startswith(name + '_') and os.path.isdir(os.path.join(parent, entry)))
+    for path in old_paths:
+        if path not in keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class Command(BaseCommand):
+    """
+    并行重建商品搜索索引：python manage.py rebuild_sku_index --workers 4 --chunk-size 1000
+    按id范围分段，子进程并行建立各段索引，合并到新目录后切换，重建期间旧索引继续提供搜索
+    """
+    help = '使用多进程分段重建SKU的Whoosh索引，完成后原子切换'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--using', default='default', help='haystack连接名')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='子进程数量')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='每段的商品数量')
+
+    def handle(self, *args, **options):
+        alias = options['using']
+        connection_options = settings.HAYSTACK_CONNECTIONS[alias]
+        if not issubclass(type(connections[alias].get_backend()), WhooshSearchBackend):
+            raise CommandError('只支持Whoosh引擎')
+        index_path = os.path.abspath(connection_options['PATH'].rstrip(os.sep))
+        started = timezone.now()
+        start = time.time()
+
+        # 按id范围分段
+        index = connections[alias].get_unified_index().get_index(SKU)
+        sku_ids = list(index.index_queryset(using=alias).order_by('id').values_list('id', flat=True))
+        chunk_size = options['chunk_size']
+        ranges = [(sku_ids[i], sku_ids[min(i + chunk_size, len(sku_ids)) - 1])
+                  for i in range(0, len(sku_ids), chunk_size)]
+
+        new_path = '%s_%s' % (index_path, started.strftime('%Y%m%d%H%M%S%f'))
+        work_dir = tempfile.mkdtemp(prefix='.rebuild_', dir=os.path.dirname(index_path))
+        try:
+            part_paths = [os.path.join(work_dir, 'part_%d' % i) for i in range(len(ranges))]
+            # 子进程不能复用父进程的数据库连接，fork之前先关闭
+            db_connections.close_all()
+            with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as executor:
+                futures = [executor.submit(index_sku_range, alias, start_id, end_id, part_path)
+                           for (start_id, end_id), part_path in zip(ranges, part_paths)]
+                count = sum(future.result() for future in futures)
+            indexed = time.time()
+            merge_indexes(alias, new_path, part_paths)
+        except BaseException:
+            shutil.rmtree(new_path, ignore_errors=True)
+            raise
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        old_path = swap_index(index_path, new_path)
+        remove_old_indexes(index_path, keep={new_path, old_path})
+        # 切换索引后搜索结果缓存失效，预热热门搜索词
+        incr_version(SEARCH_INDEX_VERSION)
+        prewarm_search_cache()
+        # 重建期间修改的商品写入的是旧索引，重新放入更新队列
+        changed = SKU.objects.filter(update_time__gte=started).values_list('id', flat=True)
+        mark_dirty('goods.sku.%s' % sku_id for sku_id in changed)
+
+        elapsed = time.time() - start
+        self.stdout.write(self.style.SUCCESS(
+            '已索引%d个商品，分%d段，建立索引%.2f秒，合并%.2f秒，共%.2f秒，%.0f docs/s' %
+            (count, len(ranges), indexed - start, time.time() - indexed, elapsed, count / elapsed if elapsed else 0)))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from goods.models import SKU, SPU
+from orders.models import OrderGoods
+
+
+class Command(BaseCommand):
+    """
+    校对SKU和SPU的评价统计：python manage.py reconcile_comment_stats [--dry-run]
+    评价统计在评价时增量维护，批量修改订单商品等绕过信号的操作之后需要重新校对
+    """
+    help = '根据已评价的订单商品重新计算SKU和SPU的评价统计，修正不一致的记录'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='只报告不一致的记录，不修改')
+
+    def handle(self, *args, **options):
+        # 按(SKU, 评分)分组统计评价数量 {sku_id: {评分: 数量}}
+        sku_histograms = {}
+        spu_histograms = {}
+        rows = OrderGoods.objects.filter(is_commented=True).values_list('sku_id', 'sku__spu_id', 'score') \
+            .annotate(count=Count('id')).order_by()
+        for sku_id, spu_id, score, count in rows:
+            for histograms, key in ((sku_histograms, sku_id), (spu_histograms, spu_id)):
+                histogram = histograms.setdefault(key, {})
+                histogram[score] = histogram.get(score, 0) + count
+
+        fixed = {}
+        for model, histograms in ((SKU, sku_histograms), (SPU, spu_histograms)):
+            fixed[model] = 0
+            for obj in model.objects.only(*model.COMMENT_STATS_FIELDS).iterator():
+                stats = model.build_comment_stats(histograms.get(obj.id, {}))
+                if all(getattr(obj, field) == value for field, value in stats.items()):
+                    continue
+                fixed[model] += 1
+                self.stdout.write('%s %s: %s' % (model.__name__, obj.id, stats))
+                if not options['dry_run']:
+                    model.objects.filter(id=obj.id).update(**stats)
+
+        action = '发现' if options['dry_run'] else '已修正'
+        self.stdout.write(self.style.SUCCESS('%s%d个SKU、%d个SPU的评价统计不一致' % (action, fixed[SKU], fixed[SPU])))
@@ -1,5 +1,8 @@
+from decimal import Decimal
+
 from django.db import models
-from xiaoyu_mall.utils.models import BaseModel
+from django.utils import timezone
+from xiaoyu_mall.utils.models import BaseModel, ChangeTrackingMixin
 
 
 # Create your models here.
@@ -62,7 +65,62 @@ class Brand(BaseModel):
         return self.name
 
 
-class SPU(BaseModel):
+class CommentStatsModel(models.Model):
+    """
+    评价统计：评价数量使用comments字段，评分总和、平均分和各评分的评价数量在评价时增量维护
+    """
+    comment_score_sum = models.IntegerField(default=0, verbose_name='评分总和')
+    comment_score_avg = models.DecimalField(max_digits=3, decimal_places=2, default=0, verbose_name='平均评分')
+    comment_score_0 = models.IntegerField(default=0, verbose_name='0分评价数')
+    comment_score_1 = models.IntegerField(default=0, verbose_name='1分评价数')
+    comment_score_2 = models.IntegerField(default=0, verbose_name='2分评价数')
+    comment_score_3 = models.IntegerField(default=0, verbose_name='3分评价数')
+    comment_score_4 = models.IntegerField(default=0, verbose_name='4分评价数')
+    comment_score_5 = models.IntegerField(default=0, verbose_name='5分评价数')
+
+    # 评分取值，与OrderGoods.SCORE_CHOICES一致
+    COMMENT_SCORES = range(6)
+    COMMENT_STATS_FIELDS = ['comments', 'comment_score_sum', 'comment_score_avg'] + \
+                           ['comment_score_%d' % score for score in COMMENT_SCORES]
+
+    class Meta:
+        abstract = True
+
+    @property
+    def comment_score_histogram(self):
+        """各评分的评价数量：[0分, 1分, ..., 5分]"""
+        return [getattr(self, 'comment_score_%d' % score) for score in self.COMMENT_SCORES]
+
+    @classmethod
+    def build_comment_stats(cls, histogram):
+        """
+        根据各评分的评价数量计算统计字段
+        :param histogram: {评分: 评价数量}
+        :return: {字段名: 值}
+        """
+        stats = {'comment_score_%d' % score: histogram.get(score, 0) for score in cls.COMMENT_SCORES}
+        count = sum(stats.values())
+        score_sum = sum(score * histogram.get(score, 0) for score in cls.COMMENT_SCORES)
+        stats['comments'] = count
+        stats['comment_score_sum'] = score_sum
+        stats['comment_score_avg'] = (Decimal(score_sum) / count).quantize(Decimal('0.01')) if count else Decimal(0)
+        return stats
+
+    def get_comment_stats(self, added=(), removed=()):
+        """
+        加入、移除若干评分后的统计字段
+        :param added: 新增评价的评分
+        :param removed: 撤销评价的评分
+        """
+        histogram = dict(zip(self.COMMENT_SCORES, self.comment_score_histogram))
+        for score in added:
+            histogram[score] += 1
+        for score in removed:
+            histogram[score] = max(histogram[score] - 1, 0)
+        return self.build_comment_stats(histogram)
+
+
+class SPU(ChangeTrackingMixin, CommentStatsModel, BaseModel):
     """商品SPU"""
     name = models.CharField(max_length=50, verbose_name='名称')
     brand = models.ForeignKey(Brand, on_delete=models.PROTECT, verbose_name='品牌')
@@ -84,7 +142,7 @@ class SPU(BaseModel):
         return self.name
 
 
-class SKU(BaseModel):
+class SKU(ChangeTrackingMixin, CommentStatsModel, BaseModel):
     """商品SKU"""
     name = models.CharField(max_length=50, verbose_name='名称')
     caption = models.CharField(max_length=100, verbose_name='副标题')
@@ -103,6 +161,12 @@ class SKU(BaseModel):
         db_table = 'tb_sku'
         verbose_name = '商品SKU'
         verbose_name_plural = verbose_name
+        # 商品列表页键集分页：类别 + 上架状态 + (排序字段, id)
+        indexes = [
+            models.Index(fields=['category', 'is_launched', 'create_time', 'id'], name='tb_sku_list_default_idx'),
+            models.Index(fields=['category', 'is_launched', 'price', 'id'], name='tb_sku_list_price_idx'),
+            models.Index(fields=['category', 'is_launched', '-sales', 'id'], name='tb_sku_list_hot_idx'),
+        ]
 
     def __str__(self):
         return '%s: %s' % (self.id, self.name)
@@ -169,9 +233,14 @@ class GoodsVisitCount(BaseModel):
     """统计分类商品访问量模型类"""
     category = models.ForeignKey(GoodsCategory, on_delete=models.CASCADE, verbose_name='商品分类')
     count = models.IntegerField(verbose_name='访问量', default=0)
-    date = models.DateField(auto_now_add=True, verbose_name='统计日期')
+    # 访问量先记录在redis中再定期写入，统计日期取访问当天而不是写入当天
+    date = models.DateField(default=timezone.localdate, verbose_name='统计日期')
 
     class Meta:
         db_table = 'tb_goods_visit'
         verbose_name = '统计分类商品访问量'
         verbose_name_plural = verbose_name
+        constraints = [
+            # 每个类别每天一条记录
+            models.UniqueConstraint(fields=['category', 'date'], name='tb_goods_visit_category_date_uniq'),
+        ]
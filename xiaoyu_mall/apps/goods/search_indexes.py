@@ -6,6 +6,8 @@ class SKUIndex(indexes.SearchIndex, indexes.Indexable):
     """SKU索引数据模型类"""
     # 接收索引字段：使用文档定义索引字段，并且使用模板语法渲染
     text = indexes.CharField(document=True, use_template=True)
+    # 影响索引内容的字段：模板和index_queryset用到的字段，只有这些字段变化时才需要更新索引
+    tracked_fields = {'name', 'caption', 'is_launched'}
 
     def get_model(self):
         """返回建立索引的模型类"""
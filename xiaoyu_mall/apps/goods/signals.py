@@ -0,0 +1,163 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from carts.storage import update_sku_stocks, remove_sku_stocks
+from goods import constants
+from goods.models import GoodsCategory, Brand, SPU, SKU, SKUSpecification, SPUSpecification, SpecificationOption
+from goods.utils import sku_count_cache_key, expire_list_cache, spu_specs_version_name, comments_version_name, \
+    update_comment_stats, mark_suggest_changed, expire_facets, mark_sku_card_changed
+from orders.models import OrderGoods
+from xiaoyu_mall.utils.versions import incr_version_on_commit
+
+# 影响商品列表页所有排序的字段：上下架、分类、价格及商品卡片展示的字段
+LIST_FIELDS = {'is_launched', 'category_id', 'price', 'name', 'default_image'}
+# 影响搜索联想词的SKU字段
+SUGGEST_FIELDS = {'is_launched', 'name', 'spu_id'}
+# 影响商品筛选位图的SKU字段，品牌来自SPU
+FACET_FIELDS = {'is_launched', 'category_id', 'price', 'spu_id'}
+
+
+@receiver([post_save, post_delete], sender=GoodsCategory)
+def expire_category_index(sender, **kwargs):
+    """商品类别变化时，递增商品类别索引版本，各进程随后重新加载"""
+    incr_version_on_commit(constants.CATEGORY_INDEX_VERSION)
+
+
+def get_affected_category_ids(instance, created=False):
+    """SKU影响到的类别：当前类别，换分类时还包括原类别"""
+    category_ids = {instance.category_id}
+    if not created:
+        category_ids.add(instance.get_loaded_value('category_id', instance.category_id))
+    return category_ids
+
+
+def expire_spu_specs(*spu_ids):
+    """事务提交后使SPU规格矩阵缓存失效"""
+    for spu_id in set(spu_ids):
+        if spu_id is not None:
+            incr_version_on_commit(spu_specs_version_name(spu_id))
+
+
+def expire_sku_count(category_ids):
+    """事务提交后删除分类上架商品数量缓存"""
+    cache_keys = [sku_count_cache_key(category_id) for category_id in category_ids]
+    transaction.on_commit(lambda: cache.delete_many(cache_keys))
+
+
+@receiver(post_save, sender=SKU)
+def expire_sku_caches_on_save(sender, instance, created, **kwargs):
+    """SKU保存时，只让受影响的缓存失效"""
+    changed_fields = instance.get_changed_fields()
+    if created or changed_fields is None or 'stock' in changed_fields:
+        # 购物车校验用的库存缓存
+        update_sku_stocks({instance.id: instance.stock})
+    # 不是从数据库加载的对象无法判断变化，按全部变化处理
+    if created or changed_fields is None:
+        changed_fields = LIST_FIELDS | {'sales'}
+    category_ids = get_affected_category_ids(instance, created)
+    if changed_fields & {'category_id', 'is_launched'}:
+        expire_sku_count(category_ids)
+    if changed_fields & LIST_FIELDS:
+        expire_list_cache(category_ids)
+        # 商品卡片的字段与列表页一致
+        mark_sku_card_changed([instance.id])
+    elif 'sales' in changed_fields:
+        # 只有销量变化，只影响按人气排序
+        expire_list_cache(category_ids, 'hot')
+    if created or 'spu_id' in changed_fields:
+        expire_spu_specs(instance.spu_id, instance.get_loaded_value('spu_id'))
+    if changed_fields & SUGGEST_FIELDS:
+        mark_suggest_changed([instance.id])
+    if changed_fields & FACET_FIELDS:
+        expire_facets(category_ids)
+
+
+@receiver(post_delete, sender=SKU)
+def expire_sku_caches_on_delete(sender, instance, **kwargs):
+    """SKU删除时，删除分类上架商品数量缓存，商品列表页缓存失效"""
+    category_ids = get_affected_category_ids(instance)
+    expire_sku_count(category_ids)
+    expire_list_cache(category_ids)
+    expire_spu_specs(instance.spu_id)
+    mark_suggest_changed([instance.id])
+    expire_facets(category_ids)
+    mark_sku_card_changed([instance.id])
+    remove_sku_stocks([instance.id])
+
+
+@receiver(post_save, sender=SPU)
+def mark_suggest_changed_on_spu(sender, instance, created, **kwargs):
+    """SPU名称变化时，其下所有SKU的搜索联想词需要更新"""
+    changed_fields = instance.get_changed_fields()
+    if not created and (changed_fields is None or 'name' in changed_fields):
+        mark_suggest_changed(SKU.objects.filter(spu_id=instance.id).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=SPU)
+def expire_facets_on_spu(sender, instance, created, **kwargs):
+    """SPU更换品牌时，其下SKU所在类别的筛选位图失效"""
+    changed_fields = instance.get_changed_fields()
+    if not created and (changed_fields is None or 'brand_id' in changed_fields):
+        expire_facets(SKU.objects.filter(spu_id=instance.id).values_list('category_id', flat=True))
+
+
+@receiver(post_save, sender=Brand)
+def expire_facets_on_brand(sender, instance, created, **kwargs):
+    """品牌名称变化时，该品牌商品所在类别的筛选位图失效"""
+    if not created:
+        expire_facets(SKU.objects.filter(spu__brand_id=instance.id).values_list('category_id', flat=True))
+
+
+@receiver([post_save, post_delete], sender=SPUSpecification)
+def expire_spu_specs_on_spec(sender, instance, **kwargs):
+    """SPU规格变化时，SPU规格矩阵缓存及其SKU所在类别的筛选位图失效"""
+    expire_spu_specs(instance.spu_id)
+    expire_facets(SKU.objects.filter(spu_id=instance.spu_id).values_list('category_id', flat=True))
+
+
+@receiver([post_save, post_delete], sender=SpecificationOption)
+def expire_spu_specs_on_option(sender, instance, **kwargs):
+    """规格选项变化时，SPU规格矩阵缓存及其SKU所在类别的筛选位图失效"""
+    spu_id = SPUSpecification.objects.filter(id=instance.spec_id).values_list('spu_id', flat=True).first()
+    expire_spu_specs(spu_id)
+    expire_facets(SKU.objects.filter(spu_id=spu_id).values_list('category_id', flat=True))
+
+
+@receiver([post_save, post_delete], sender=SKUSpecification)
+def expire_spu_specs_on_sku_spec(sender, instance, **kwargs):
+    """SKU具体规格变化时，SPU规格矩阵缓存及SKU所在类别的筛选位图失效"""
+    sku = SKU.objects.filter(id=instance.sku_id).values_list('spu_id', 'category_id').first()
+    if sku is not None:
+        expire_spu_specs(sku[0])
+        expire_facets([sku[1]])
+
+
+@receiver([post_save, post_delete], sender=OrderGoods)
+def expire_comments(sender, instance, **kwargs):
+    """评价写入、修改或删除时，商品评价缓存失效"""
+    if instance.is_commented or instance.get_loaded_value('is_commented'):
+        incr_version_on_commit(comments_version_name(instance.sku_id))
+
+
+@receiver(post_save, sender=OrderGoods)
+def update_comment_stats_on_save(sender, instance, created, **kwargs):
+    """评价写入或修改评分时，增量更新SKU和SPU的评价统计"""
+    old_commented = False if created else instance.get_loaded_value('is_commented', False)
+    old_sku_id = instance.get_loaded_value('sku_id', instance.sku_id)
+    removed = [instance.get_loaded_value('score')] if old_commented else []
+    added = [instance.score] if instance.is_commented else []
+    if old_sku_id != instance.sku_id:
+        update_comment_stats(old_sku_id, removed=removed)
+        update_comment_stats(instance.sku_id, added=added)
+    elif added != removed:
+        update_comment_stats(instance.sku_id, added, removed)
+
+
+@receiver(post_delete, sender=OrderGoods)
+def update_comment_stats_on_delete(sender, instance, **kwargs):
+    """删除已评价的订单商品时，撤销其评分"""
+    if instance.get_loaded_value('is_commented', instance.is_commented):
+        update_comment_stats(instance.get_loaded_value('sku_id', instance.sku_id),
+                             removed=[instance.get_loaded_value('score', instance.score)])
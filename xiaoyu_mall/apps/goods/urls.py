@@ -1,4 +1,6 @@
 from django.urls import path
+from haystack.views import search_view_factory
+
 from . import views
 
 # 设置应用程序命名空间
@@ -10,9 +12,15 @@ urlpatterns = [
     path('hot/<int:category_id>/', views.HostGoodsView.as_view()),
     # 商品详情
     path('detail/<int:sku_id>/', views.DetailView.as_view(), name='detail'),
+    # 商品库存
+    path('detail/stock/<int:sku_id>/', views.DetailStockView.as_view()),
     # 统计商品分类的访问量
     path('detail/visit/<int:category_id>/', views.DetailVisitView.as_view()),
     # 商品评价
     path('comments/<int:sku_id>/', views.GoodsCommentView.as_view()),
+    # 商品搜索：每个请求创建一个视图实例
+    path('search/', search_view_factory(views.SKUSearchView), name='search'),
+    # 搜索联想词
+    path('search/suggest/', views.SearchSuggestView.as_view()),
 
 ]
@@ -1,7 +1,509 @@
-def get_breadcrumb(category):
+import bisect
+import datetime
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.utils import timezone
+from django.utils.http import urlencode
+from django_redis import get_redis_connection
+from haystack.query import SearchQuerySet
+from redis.exceptions import LockError
+
+from contents.utils import get_categories
+from goods import constants
+from goods.models import GoodsCategory, SPU, SKU, SKUSpecification, SPUSpecification, SpecificationOption
+from orders.models import OrderGoods
+from xiaoyu_mall.utils.bitmap import ids_to_bitmap, bitmap_to_ids
+from xiaoyu_mall.utils.search_signals import SEARCH_INDEX_VERSION
+from xiaoyu_mall.utils.paginator import keyset_page, encode_cursor, decode_cursor, get_ordering_values
+from xiaoyu_mall.utils.versions import get_version, get_versions, incr_version, incr_version_on_commit
+
+logger = logging.getLogger('django')
+
+
+class CategoryIndex(object):
+    """
+    商品类别层级的进程内索引：id ==> 父类别、级别、子类别、后代类别
+    首次使用时加载，版本号变化后重新加载，查询均为O(1)
+    """
+
+    def __init__(self):
+        # (版本号, 类别字典, 子类别id字典, 后代类别id字典)
+        self._data = (None, {}, {}, {})
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def load(self, version=None):
+        """一次查询加载所有商品类别，构造层级索引"""
+        if version is None:
+            version = get_version(constants.CATEGORY_INDEX_VERSION)
+        categories = {}
+        children = {}
+        for category_id, name, parent_id in GoodsCategory.objects.order_by('id').values_list('id', 'name', 'parent_id'):
+            categories[category_id] = {'id': category_id, 'name': name, 'parent_id': parent_id, 'level': None}
+            children.setdefault(category_id, [])
+            children.setdefault(parent_id, []).append(category_id)
+        # 从一级类别开始逐层计算级别和后代类别
+        descendants = {}
+
+        def walk(category_id, level):
+            categories[category_id]['level'] = level
+            ids = []
+            for child_id in children[category_id]:
+                ids.append(child_id)
+                ids.extend(walk(child_id, level + 1))
+            descendants[category_id] = ids
+            return ids
+
+        for category_id in children.get(None, []):
+            walk(category_id, 1)
+        children.pop(None, None)
+        self._data = (version, categories, children, descendants)
+        self._checked_at = time.time()
+
+    def refresh(self):
+        """间隔检查版本号，版本变化时重新加载"""
+        if time.time() - self._checked_at < constants.CATEGORY_INDEX_CHECK_INTERVAL:
+            return
+        with self._lock:
+            if time.time() - self._checked_at < constants.CATEGORY_INDEX_CHECK_INTERVAL:
+                return
+            version = get_version(constants.CATEGORY_INDEX_VERSION)
+            if version != self._data[0]:
+                self.load(version)
+            self._checked_at = time.time()
+
+    def get(self, category_id):
+        """获取类别：{'id', 'name', 'parent_id', 'level'}，不存在返回None"""
+        self.refresh()
+        return self._data[1].get(category_id)
+
+    def get_level(self, category_id):
+        """获取类别级别：1、2、3，不存在返回None"""
+        category = self.get(category_id)
+        return category['level'] if category else None
+
+    def get_ancestors(self, category_id):
+        """获取从一级类别到当前类别的路径：[一级, 二级, 三级]"""
+        self.refresh()
+        categories = self._data[1]
+        path = []
+        category = categories.get(category_id)
+        while category:
+            path.append(category)
+            category = categories.get(category['parent_id'])
+        path.reverse()
+        return path
+
+    def get_children_ids(self, category_id):
+        """获取直接子类别id列表"""
+        self.refresh()
+        return self._data[2].get(category_id, [])
+
+    def get_descendant_ids(self, category_id):
+        """获取所有后代类别id列表"""
+        self.refresh()
+        return self._data[3].get(category_id, [])
+
+
+category_index = CategoryIndex()
+
+
+# 联想词匹配的起始位置：英文单词、数字开头，以及每个中文字符
+SUGGEST_START_RE = re.compile(r'[a-z0-9]+|[\u4e00-\u9fff]')
+# 商品变化记录（有序集合，成员为sku_id，分数为变化时间），各进程据此增量更新联想词索引
+SUGGEST_CHANGES_KEY = 'suggest_changes'
+
+
+def suggest_keys(*names):
+    """
+    名称的联想词匹配键：从每个单词或中文字符开始的后缀
+    'Apple iPhone 8' ==> {'apple iphone 8', 'iphone 8', '8'}
+    """
+    keys = set()
+    for name in names:
+        text = name.lower()
+        for match in SUGGEST_START_RE.finditer(text):
+            keys.add(text[match.start():].strip())
+    return keys
+
+
+def mark_suggest_changed(sku_ids):
+    """记录商品变化，在事务提交后写入"""
+    sku_ids = list(sku_ids)
+    if not sku_ids:
+        return
+
+    def mark():
+        now = time.time()
+        pl = get_redis_connection('search').pipeline()
+        pl.zadd(SUGGEST_CHANGES_KEY, {sku_id: now for sku_id in sku_ids})
+        # 超过全量重建间隔的记录已经没有用处
+        pl.zremrangebyscore(SUGGEST_CHANGES_KEY, '-inf', now - 2 * constants.SUGGEST_REBUILD_INTERVAL)
+        pl.execute()
+
+    transaction.on_commit(mark)
+
+
+class SuggestIndex(object):
+    """
+    搜索联想词的进程内索引：匹配键排序后存入数组，前缀查询使用二分查找
+    商品名称、SPU名称、上下架变化时增量更新，定期全量重建以更新销量排序
+    """
+
+    def __init__(self):
+        # 排序的匹配键，及对应的sku_id
+        self._keys = []
+        self._sku_ids = []
+        # sku_id ==> (名称, 销量, 匹配键)
+        self._skus = {}
+        self._loaded_at = 0
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def load(self):
+        """一次查询加载所有上架商品"""
+        entries = []
+        skus = {}
+        for sku_id, name, sales, spu_name in SKU.objects.filter(is_launched=True) \
+                .values_list('id', 'name', 'sales', 'spu__name'):
+            keys = suggest_keys(name, spu_name)
+            skus[sku_id] = (name, sales, keys)
+            entries.extend((key, sku_id) for key in keys)
+        entries.sort()
+        self._keys = [key for key, _ in entries]
+        self._sku_ids = [sku_id for _, sku_id in entries]
+        self._skus = skus
+        self._loaded_at = self._checked_at = time.time()
+
+    def update(self, sku_ids):
+        """增量更新部分商品：先删除旧的匹配键，再插入上架商品的匹配键"""
+        for sku_id in sku_ids:
+            sku = self._skus.pop(sku_id, None)
+            if sku is None:
+                continue
+            for key in sku[2]:
+                i = bisect.bisect_left(self._keys, key)
+                while self._keys[i] != key or self._sku_ids[i] != sku_id:
+                    i += 1
+                del self._keys[i]
+                del self._sku_ids[i]
+        for sku_id, name, sales, spu_name in SKU.objects.filter(id__in=sku_ids, is_launched=True) \
+                .values_list('id', 'name', 'sales', 'spu__name'):
+            keys = suggest_keys(name, spu_name)
+            self._skus[sku_id] = (name, sales, keys)
+            for key in keys:
+                i = bisect.bisect_right(self._keys, key)
+                self._keys.insert(i, key)
+                self._sku_ids.insert(i, sku_id)
+
+    def refresh(self):
+        """间隔检查商品变化，增量更新；超过重建间隔时全量重建"""
+        now = time.time()
+        if now - self._checked_at < constants.SUGGEST_CHECK_INTERVAL:
+            return
+        with self._lock:
+            if now - self._checked_at < constants.SUGGEST_CHECK_INTERVAL:
+                return
+            if now - self._loaded_at >= constants.SUGGEST_REBUILD_INTERVAL:
+                self.load()
+                return
+            # 多取一段时间的记录，避免各服务器时间误差漏掉变化，重复更新没有影响
+            changed = get_redis_connection('search').zrangebyscore(
+                SUGGEST_CHANGES_KEY, self._checked_at - constants.SUGGEST_CHECK_INTERVAL - 5, '+inf')
+            if changed:
+                self.update([int(sku_id) for sku_id in changed])
+            self._checked_at = now
+
+    def suggest(self, prefix, limit=constants.SUGGEST_LIMIT):
+        """
+        前缀匹配的商品，按销量由高到低排序
+        :return: [{'id', 'name'}]
+        """
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        self.refresh()
+        with self._lock:
+            keys, sku_ids, skus = self._keys, self._sku_ids, self._skus
+            matched = set()
+            i = bisect.bisect_left(keys, prefix)
+            end = min(i + constants.SUGGEST_MAX_SCAN, len(keys))
+            while i < end and keys[i].startswith(prefix):
+                matched.add(sku_ids[i])
+                i += 1
+            ranked = sorted(matched, key=lambda sku_id: (-skus[sku_id][1], sku_id))
+        suggestions = []
+        names = set()
+        for sku_id in ranked:
+            name = skus[sku_id][0]
+            if name in names:
+                continue
+            names.add(name)
+            suggestions.append({'id': sku_id, 'name': name})
+            if len(suggestions) == limit:
+                break
+        return suggestions
+
+
+suggest_index = SuggestIndex()
+
+
+def facet_version_name(category_id=None):
+    """商品筛选位图版本名：类别内商品、价格、品牌或规格变化时递增，不指定类别为全部商品（搜索页使用）"""
+    return 'facets_%s' % (category_id or 'all')
+
+
+def expire_facets(category_ids):
+    """事务提交后使受影响类别及全部商品的筛选位图失效"""
+    for category_id in set(category_ids) | {None}:
+        incr_version_on_commit(facet_version_name(category_id))
+
+
+def get_price_band(price):
+    """价格所在的价格区间序号"""
+    for i, (low, high) in enumerate(constants.FACET_PRICE_BANDS):
+        if price >= low and (high is None or price < high):
+            return i
+    return None
+
+
+def price_band_label(i):
+    low, high = constants.FACET_PRICE_BANDS[i]
+    return '%s以上' % low if high is None else '%s-%s' % (low, high - 1)
+
+
+class FacetSet(object):
+    """
+    一个类别的商品筛选位图：每个筛选值对应一个上架商品的id位图
+    筛选组：brand 品牌、price 价格区间、spec_<规格名> 规格选项（按规格名和选项值合并不同SPU的规格）
+    同一组内多个值为或，不同组之间为且
+    """
+
+    def __init__(self, category_id=None):
+        # 所有上架商品
+        self.all = 0
+        # 筛选组 ==> {筛选值: 位图}
+        self.groups = {}
+        # 筛选组 ==> (组名称, {筛选值: 值名称})
+        self.labels = {}
+        self.load(category_id)
+
+    def add(self, group, group_label, key, label, ids):
+        self.groups.setdefault(group, {})[key] = ids
+        self.labels.setdefault(group, (group_label, {}))[1][key] = label
+
+    def load(self, category_id):
+        """两次查询加载类别内所有上架商品及其规格"""
+        skus = SKU.objects.filter(is_launched=True)
+        specs = SKUSpecification.objects.filter(sku__is_launched=True)
+        if category_id is not None:
+            skus = skus.filter(category_id=category_id)
+            specs = specs.filter(sku__category_id=category_id)
+        values = {}
+        all_ids = []
+        for sku_id, price, brand_id, brand_name in skus.values_list('id', 'price', 'spu__brand_id', 'spu__brand__name'):
+            all_ids.append(sku_id)
+            values.setdefault(('brand', '品牌', str(brand_id), brand_name), []).append(sku_id)
+            band = get_price_band(price)
+            if band is not None:
+                values.setdefault(('price', '价格', str(band), price_band_label(band)), []).append(sku_id)
+        for sku_id, spec_name, option_value in specs.values_list('sku_id', 'spec__name', 'option__value'):
+            group = constants.FACET_SPEC_PREFIX + spec_name
+            values.setdefault((group, spec_name, option_value, option_value), []).append(sku_id)
+        self.all = ids_to_bitmap(all_ids)
+        for (group, group_label, key, label), ids in sorted(values.items()):
+            self.add(group, group_label, key, label, ids_to_bitmap(ids))
+
+    def filter(self, selected, base=None):
+        """
+        按筛选条件过滤商品，同时计算每个筛选值的商品数量
+        某一组的数量不应用该组自身的筛选条件，以便在组内切换、多选
+        :param selected: {筛选组: {筛选值}}
+        :param base: 限定范围的商品位图，如搜索结果
+        :return: (结果位图, [{'name', 'label', 'values': [{'key', 'label', 'count', 'selected'}]}])
+        """
+        universe = self.all if base is None else self.all & base
+        masks = {}
+        for group, keys in selected.items():
+            values = self.groups.get(group, {})
+            mask = 0
+            for key in keys:
+                mask |= values.get(key, 0)
+            masks[group] = mask
+        result = universe
+        for mask in masks.values():
+            result &= mask
+        facets = []
+        for group, values in self.groups.items():
+            others = universe
+            for other, mask in masks.items():
+                if other != group:
+                    others &= mask
+            group_label, value_labels = self.labels[group]
+            facet_values = []
+            for key, bitmap in values.items():
+                count = (others & bitmap).bit_count()
+                is_selected = key in selected.get(group, ())
+                if count or is_selected:
+                    facet_values.append({'key': key, 'label': value_labels[key], 'count': count,
+                                         'selected': is_selected})
+            if facet_values:
+                facets.append({'name': group, 'label': group_label, 'values': facet_values})
+        return result, facets
+
+
+class FacetIndex(object):
+    """
+    商品筛选位图的进程内索引：按类别懒加载，间隔检查版本号，只重建发生变化的类别
+    """
+
+    def __init__(self):
+        # 类别id ==> (版本号, 检查时间, FacetSet)
+        self._facets = {}
+        self._lock = threading.Lock()
+
+    def get(self, category_id=None):
+        now = time.time()
+        entry = self._facets.get(category_id)
+        if entry is not None and now - entry[1] < constants.FACET_CHECK_INTERVAL:
+            return entry[2]
+        with self._lock:
+            entry = self._facets.get(category_id)
+            if entry is not None and now - entry[1] < constants.FACET_CHECK_INTERVAL:
+                return entry[2]
+            # 先读取版本号再加载，加载期间的变化会在下次检查时重建
+            version = get_version(facet_version_name(category_id))
+            facets = entry[2] if entry is not None and entry[0] == version else FacetSet(category_id)
+            self._facets[category_id] = (version, now, facets)
+            return facets
+
+
+facet_index = FacetIndex()
+
+
+def parse_facet_filters(query_dict):
+    """从查询参数中解析筛选条件：{筛选组: {筛选值}}"""
+    selected = {}
+    for name in query_dict:
+        if name in ('brand', 'price') or name.startswith(constants.FACET_SPEC_PREFIX):
+            keys = {key for key in query_dict.getlist(name) if key}
+            if keys:
+                selected[name] = keys
+    return selected
+
+
+def encode_facet_filters(selected):
+    """筛选条件编码为查询参数"""
+    return urlencode([(group, key) for group in sorted(selected) for key in sorted(selected[group])])
+
+
+def add_facet_queries(facets, selected):
+    """为每个筛选值加上切换选中状态后的查询参数，供页面生成链接"""
+    for facet in facets:
+        for value in facet['values']:
+            toggled = {group: set(keys) for group, keys in selected.items()}
+            keys = toggled.setdefault(facet['name'], set())
+            keys.symmetric_difference_update({value['key']})
+            value['query'] = encode_facet_filters({group: keys for group, keys in toggled.items() if keys})
+    return facets
+
+
+def normalize_search_query(query):
+    """规范化搜索词：小写、合并空白，同义的输入共用一份缓存和计数"""
+    return ' '.join(query.lower().split())
+
+
+def search_cache_key(query, generation):
+    return 'search_%s_%s' % (generation, hashlib.md5(query.encode()).hexdigest())
+
+
+def get_search_result(query):
+    """
+    搜索结果：按(规范化搜索词, 索引代数)缓存，索引更新后代数递增，旧缓存随之失效
+    缓存全部结果而不是某一页：商品筛选需要全部结果计算各筛选值的数量，各页和各筛选条件共用一份缓存
+    :return: {'sku_ids': 按相关度排序的商品id, 'count': 商品数量}
+    """
+    query = normalize_search_query(query)
+    if not query:
+        return {'sku_ids': [], 'count': 0}
+    cache_key = search_cache_key(query, get_version(SEARCH_INDEX_VERSION))
+    result = cache.get(cache_key)
+    if result is None:
+        sku_ids = [int(item.pk) for item in SearchQuerySet().models(SKU).auto_query(query)]
+        result = {'sku_ids': sku_ids, 'count': len(sku_ids)}
+        cache.set(cache_key, result, constants.SEARCH_CACHE_EXPIRES)
+    return result
+
+
+def search_queries_key(day):
+    return 'search_queries_%s' % day.strftime('%Y%m%d')
+
+
+def incr_search_query(query):
+    """
+    热门搜索词计数：每天一个有序集合
+    搜索词超过SEARCH_TOP_QUERIES_TRIM个时才裁剪到前SEARCH_TOP_QUERIES_KEEP个，
+    每次都裁剪的话，集合满了以后新搜索词以1次进入就被立即删除，永远进不了排行
+    """
+    query = normalize_search_query(query)
+    if not query:
+        return
+    key = search_queries_key(timezone.localdate())
+    redis_conn = get_redis_connection('search')
+    pl = redis_conn.pipeline()
+    pl.zincrby(key, 1, query)
+    pl.zcard(key)
+    pl.expire(key, 3600 * 24 * 2)
+    size = pl.execute()[1]
+    if size > constants.SEARCH_TOP_QUERIES_TRIM:
+        redis_conn.zremrangebyrank(key, 0, -constants.SEARCH_TOP_QUERIES_KEEP - 1)
+
+
+def get_top_search_queries(limit=constants.SEARCH_PREWARM_QUERIES):
+    """今天和昨天合计次数最多的搜索词"""
+    today = timezone.localdate()
+    pl = get_redis_connection('search').pipeline()
+    for day in (today, today - datetime.timedelta(days=1)):
+        pl.zrevrange(search_queries_key(day), 0, limit - 1, withscores=True)
+    counts = {}
+    for queries in pl.execute():
+        for query, score in queries:
+            counts[query.decode()] = counts.get(query.decode(), 0) + score
+    return sorted(counts, key=counts.get, reverse=True)[:limit]
+
+
+def prewarm_search_cache(limit=constants.SEARCH_PREWARM_QUERIES):
+    """更新索引后预热热门搜索词的结果缓存，返回预热的搜索词数量"""
+    queries = get_top_search_queries(limit)
+    for query in queries:
+        get_search_result(query)
+    return len(queries)
+
+
+def get_filtered_list_page(sku_ids, sort, page_num):
+    """
+    筛选后的商品列表页：筛选结果由位图求出，只按id查询当页商品
+    :return: [商品卡片]
+    """
+    ordering = (constants.LIST_SORT_FIELDS[sort], 'id')
+    offset = (page_num - 1) * constants.LIST_PER_PAGE
+    skus = SKU.objects.filter(id__in=sku_ids).order_by(*ordering)[offset:offset + constants.LIST_PER_PAGE]
+    return [sku_to_card(sku) for sku in skus]
+
+
+def get_breadcrumb(category_id):
     """
     获取面包屑导航
-    :param category:类别对象：一级 二级  三级
+    :param category_id:类别id：一级 二级  三级
     :return:一级：返回一级  二级：返回一级+二级  三级：一级+二级+三级
     """
     breadcrumb = {
@@ -9,14 +511,631 @@ def get_breadcrumb(category):
         'cat2': '',
         'cat3': '',
     }
-    if category.parent == None:  # 说明category是一级
-        breadcrumb['cat1'] = category
-    elif category.subs.count() == 0:  # 说明category是三级
-        cat2 = category.parent
-        breadcrumb['cat1'] = cat2.parent
-        breadcrumb['cat2'] = cat2
-        breadcrumb['cat3'] = category
-    else:  # 说明category对应的是二级
-        breadcrumb['cat1'] = category.parent
-        breadcrumb['cat2'] = category
+    for level, category in enumerate(category_index.get_ancestors(category_id), 1):
+        breadcrumb['cat%d' % level] = category
     return breadcrumb
+
+
+def sku_count_cache_key(category_id):
+    return 'sku_count_%s' % category_id
+
+
+def get_sku_count(category_id):
+    """获取分类下上架商品的数量：缓存计数器，商品新增、删除、上下架或换分类时删除"""
+    cache_key = sku_count_cache_key(category_id)
+    count = cache.get(cache_key)
+    if count is None:
+        count = SKU.objects.filter(category_id=category_id, is_launched=True).count()
+        cache.set(cache_key, count, constants.SKU_COUNT_CACHE_EXPIRES)
+    return count
+
+
+# 商品卡片数据的字段
+SKU_CARD_FIELDS = ('id', 'name', 'price', 'default_image_url')
+
+
+def sku_to_card(sku):
+    """商品卡片数据：列表、热销、购物车等页面展示SKU用"""
+    return {
+        'id': sku.id,
+        'name': sku.name,
+        'price': sku.price,
+        'default_image_url': settings.STATIC_URL + 'images/goods/' + sku.default_image.url + '.jpg',
+    }
+
+
+# SKU卡片缓存（哈希，每个SKU一个）
+SKU_CARD_KEY = 'sku_card_%s'
+# SKU卡片变化记录（有序集合，成员为sku_id，分数为变化时间），各进程据此清除进程内缓存
+SKU_CARD_CHANGES_KEY = 'sku_card_changes'
+
+
+def mark_sku_card_changed(sku_ids):
+    """SKU卡片字段变化，事务提交后删除redis中的卡片并记录变化"""
+    sku_ids = list(sku_ids)
+    if not sku_ids:
+        return
+
+    def mark():
+        now = time.time()
+        pl = get_redis_connection('default').pipeline()
+        pl.delete(*[SKU_CARD_KEY % sku_id for sku_id in sku_ids])
+        pl.zadd(SKU_CARD_CHANGES_KEY, {sku_id: now for sku_id in sku_ids})
+        # 各进程每秒检查一次，10分钟前的记录已经没有用处
+        pl.zremrangebyscore(SKU_CARD_CHANGES_KEY, '-inf', now - 600)
+        pl.execute()
+
+    transaction.on_commit(mark)
+
+
+# 从数据库读取后写入卡片：读取之后SKU又发生了变化（变化记录的时间不早于读取时间）时不写入，避免旧卡片写回redis
+# KEYS: 卡片哈希, 变化记录  ARGV: sku_id, 读取时间, 有效期, 字段, 值, ...
+_SET_CARD_IF_UNCHANGED_SCRIPT = """
+local changed = redis.call('ZSCORE', KEYS[2], ARGV[1])
+if changed and tonumber(changed) >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 4))
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+
+class SKUCardCache(object):
+    """
+    SKU卡片缓存：redis中每个SKU一个哈希，保存预先拼好的卡片数据，进程内再缓存最近使用的卡片
+    除卡片数据外还保存上下架状态和类别，供热销排行等过滤；库存随下单频繁变化，不缓存
+    """
+
+    def __init__(self, size=constants.SKU_CARD_LRU_SIZE):
+        self._size = size
+        self._cards = OrderedDict()
+        self._checked_at = time.time()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def build(sku):
+        card = sku_to_card(sku)
+        card['category_id'] = sku.category_id
+        card['is_launched'] = sku.is_launched
+        return card
+
+    @staticmethod
+    def dumps(card):
+        return {
+            'name': card['name'],
+            'price': str(card['price']),
+            'default_image_url': card['default_image_url'],
+            'category_id': card['category_id'],
+            'is_launched': int(card['is_launched']),
+        }
+
+    @staticmethod
+    def loads(sku_id, data):
+        return {
+            'id': sku_id,
+            'name': data[b'name'].decode(),
+            'price': Decimal(data[b'price'].decode()),
+            'default_image_url': data[b'default_image_url'].decode(),
+            'category_id': int(data[b'category_id']),
+            'is_launched': data[b'is_launched'] == b'1',
+        }
+
+    def refresh(self, redis_conn):
+        """间隔检查商品变化，清除进程内缓存中已变化的卡片"""
+        now = time.time()
+        if now - self._checked_at < constants.SKU_CARD_CHECK_INTERVAL:
+            return
+        # 多取一段时间的记录，避免各服务器时间误差漏掉变化
+        changed = redis_conn.zrangebyscore(
+            SKU_CARD_CHANGES_KEY, self._checked_at - constants.SKU_CARD_CHECK_INTERVAL - 5, '+inf')
+        with self._lock:
+            for sku_id in changed:
+                self._cards.pop(int(sku_id), None)
+            self._checked_at = now
+
+    def get_many(self, sku_ids):
+        """
+        批量获取SKU卡片：先查进程内缓存，再一次往返查redis，最后一次查询数据库
+        :return: {sku_id: 卡片}，不存在的SKU不在结果中
+        """
+        sku_ids = {int(sku_id) for sku_id in sku_ids}
+        redis_conn = get_redis_connection('default')
+        self.refresh(redis_conn)
+        cards = {}
+        with self._lock:
+            for sku_id in sku_ids:
+                card = self._cards.get(sku_id)
+                if card is not None:
+                    self._cards.move_to_end(sku_id)
+                    cards[sku_id] = card
+        missing = [sku_id for sku_id in sku_ids if sku_id not in cards]
+        if missing:
+            pl = redis_conn.pipeline()
+            for sku_id in missing:
+                pl.hgetall(SKU_CARD_KEY % sku_id)
+            found = {sku_id: self.loads(sku_id, data) for sku_id, data in zip(missing, pl.execute()) if data}
+            missing = [sku_id for sku_id in missing if sku_id not in found]
+            cards.update(found)
+            if missing:
+                # 读取时间减去允许的服务器时间误差
+                read_at = time.time() - 5
+                loaded = {sku.id: self.build(sku) for sku in SKU.objects.filter(id__in=missing)}
+                set_card = redis_conn.register_script(_SET_CARD_IF_UNCHANGED_SCRIPT)
+                pl = redis_conn.pipeline()
+                for sku_id, card in loaded.items():
+                    args = [sku_id, read_at, constants.SKU_CARD_EXPIRES]
+                    for field, value in self.dumps(card).items():
+                        args += [field, value]
+                    set_card(keys=[SKU_CARD_KEY % sku_id, SKU_CARD_CHANGES_KEY], args=args, client=pl)
+                # 本次请求使用读到的卡片，但只有成功写入redis的卡片才放入进程内缓存
+                cards.update(loaded)
+                for (sku_id, card), written in zip(loaded.items(), pl.execute()):
+                    if written:
+                        found[sku_id] = card
+            with self._lock:
+                self._cards.update(found)
+                while len(self._cards) > self._size:
+                    self._cards.popitem(last=False)
+        return cards
+
+    def get(self, sku_id):
+        """单个SKU卡片，sku_id无效或不存在时返回None"""
+        try:
+            sku_id = int(sku_id)
+        except (TypeError, ValueError):
+            return None
+        return self.get_many([sku_id]).get(sku_id)
+
+
+sku_card_cache = SKUCardCache()
+
+
+def list_version_names(category_id, sort):
+    """商品列表页缓存版本名：(该类别所有排序, 该类别指定排序)"""
+    return 'list_%s' % category_id, 'list_%s_%s' % (category_id, sort)
+
+
+def get_list_page(category_id, sort, page_num, cursor=None, cache_cursor_page=False):
+    """
+    获取商品列表页的一页数据，按(类别, 排序, 页码)缓存
+    缓存中只保存页码对应的标准页：游标由用户传入，可能已过期或来自其它页，
+    带游标的请求命中缓存时直接使用缓存，未命中时按游标查询，
+    游标与缓存中相邻页的边界一致时（即从相邻页翻页而来）才写入缓存
+    :param cursor: 相邻页传来的游标，没有游标时第一页使用键集分页，其它页退回OFFSET
+    :param cache_cursor_page: 游标由预热逐页生成、与页码对应时传True，查询结果写入缓存
+    :return: {'skus': [商品卡片], 'prev_cursor', 'next_cursor'}，游标无效时返回None
+    """
+    names = list_version_names(category_id, sort)
+    versions = get_versions(*names)
+
+    def get_cache_key(num):
+        return 'list_%s_%s_%s_%s_%s' % (category_id, sort, num, versions[names[0]], versions[names[1]])
+
+    cache_key = get_cache_key(page_num)
+    page = cache.get(cache_key)
+    if page is not None:
+        return page
+    # id作为第二排序字段，保证每条记录的位置唯一，键集分页需要
+    ordering = (constants.LIST_SORT_FIELDS[sort], 'id')
+    skus = SKU.objects.filter(category_id=category_id, is_launched=True)
+    if cursor or page_num == 1:
+        # 键集分页：根据相邻页边界记录的(排序字段, id)定位，查询开销与页码深度无关
+        result = keyset_page(skus, ordering, constants.LIST_PER_PAGE, cursor)
+        if result is None:
+            return None
+        page_skus, prev_cursor, next_cursor = result
+    else:
+        # 直接跳转到某一页时没有游标，退回OFFSET查询
+        offset = (page_num - 1) * constants.LIST_PER_PAGE
+        page_skus = list(skus.order_by(*ordering)[offset:offset + constants.LIST_PER_PAGE])
+        prev_cursor = next_cursor = None
+        if page_skus:
+            prev_cursor = encode_cursor('prev', get_ordering_values(page_skus[0], ordering))
+            next_cursor = encode_cursor('next', get_ordering_values(page_skus[-1], ordering))
+    page = {
+        'skus': [sku_to_card(sku) for sku in page_skus],
+        'prev_cursor': prev_cursor,
+        'next_cursor': next_cursor,
+    }
+    if cursor and not cache_cursor_page:
+        # 下一页游标来自上一页的末尾，上一页游标来自下一页的开头；相邻页缓存的版本相同，
+        # 游标与其边界一致时数据没有变化，查询结果就是该页码的标准页
+        direction = decode_cursor(cursor, len(ordering))[0]
+        neighbor = cache.get(get_cache_key(page_num - 1 if direction == 'next' else page_num + 1))
+        cache_cursor_page = neighbor is not None and neighbor['%s_cursor' % direction] == cursor
+    if not cursor or cache_cursor_page:
+        cache.set(cache_key, page, constants.LIST_CACHE_EXPIRES)
+    return page
+
+
+def prewarm_list_pages(category_id, pages):
+    """按游标逐页预热该类别所有排序的前pages页"""
+    for sort in constants.LIST_SORT_FIELDS:
+        cursor = None
+        for page_num in range(1, pages + 1):
+            page = get_list_page(category_id, sort, page_num, cursor, cache_cursor_page=True)
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+
+
+def _prewarm_in_background(category_ids):
+    try:
+        for category_id in category_ids:
+            prewarm_list_pages(category_id, settings.LIST_PREWARM_PAGES)
+    except Exception as e:
+        logger.error(e)
+    finally:
+        # 后台线程使用独立的数据库连接，用完关闭
+        connections.close_all()
+
+
+def expire_list_cache(category_ids, sort=None):
+    """
+    事务提交后使商品列表页缓存失效
+    :param category_ids: 受影响的类别id
+    :param sort: 只影响某一种排序时传入，如销量变化只影响 hot
+    """
+    category_ids = set(category_ids)
+
+    def expire():
+        for category_id in category_ids:
+            names = list_version_names(category_id, sort)
+            incr_version(names[1] if sort else names[0])
+        if settings.LIST_PREWARM_PAGES:
+            threading.Thread(target=_prewarm_in_background, args=(category_ids,), daemon=True).start()
+
+    transaction.on_commit(expire)
+
+
+def spu_specs_version_name(spu_id):
+    """SPU规格矩阵缓存版本名"""
+    return 'spu_specs_%s' % spu_id
+
+
+def build_spu_spec_matrix(spu_id):
+    """
+    批量查询构造SPU规格矩阵
+    :return: {
+        'specs': [{'id', 'name', 'options': [{'id', 'value'}]}],  按规格id排序
+        'sku_keys': {sku_id: (选项id, ...)},  规格键按规格id排序
+        'spec_sku_map': {(选项id, ...): sku_id},
+    }
+    """
+    specs = []
+    spec_index = {}
+    for spec_id, name in SPUSpecification.objects.filter(spu_id=spu_id).order_by('id').values_list('id', 'name'):
+        spec_index[spec_id] = {'id': spec_id, 'name': name, 'options': []}
+        specs.append(spec_index[spec_id])
+    options = SpecificationOption.objects.filter(spec__spu_id=spu_id).order_by('spec_id', 'id')
+    for option_id, spec_id, value in options.values_list('id', 'spec_id', 'value'):
+        spec_index[spec_id]['options'].append({'id': option_id, 'value': value})
+    # 一次查询出该SPU下所有SKU的规格选项，按SKU分组形成规格键
+    sku_keys = {}
+    sku_specs = SKUSpecification.objects.filter(sku__spu_id=spu_id).order_by('sku_id', 'spec_id')
+    for sku_id, option_id in sku_specs.values_list('sku_id', 'option_id'):
+        sku_keys.setdefault(sku_id, []).append(option_id)
+    sku_keys = {sku_id: tuple(key) for sku_id, key in sku_keys.items()}
+    spec_sku_map = {key: sku_id for sku_id, key in sku_keys.items()}
+    return {'specs': specs, 'sku_keys': sku_keys, 'spec_sku_map': spec_sku_map}
+
+
+def get_spu_spec_matrix(spu_id):
+    """获取SPU规格矩阵，按版本缓存，SKU或规格变化时失效"""
+    version = get_version(spu_specs_version_name(spu_id))
+    cache_key = 'spu_specs_%s_%s' % (spu_id, version)
+    matrix = cache.get(cache_key)
+    if matrix is None:
+        matrix = build_spu_spec_matrix(spu_id)
+        cache.set(cache_key, matrix, constants.SPU_SPECS_CACHE_EXPIRES)
+    return matrix
+
+
+def get_sku_specs(spu_id, sku_id):
+    """
+    获取详情页的规格选项：每个选项标记切换到该选项后对应的sku_id
+    :return: [{'name', 'spec_options': [{'id', 'value', 'sku_id'}]}]，当前sku规格信息不完整时返回None
+    """
+    matrix = get_spu_spec_matrix(spu_id)
+    sku_key = matrix['sku_keys'].get(sku_id, ())
+    if len(sku_key) < len(matrix['specs']):
+        return None
+    goods_specs = []
+    for index, spec in enumerate(matrix['specs']):
+        # 复制当前sku的规格键
+        key = list(sku_key)
+        spec_options = []
+        for option in spec['options']:
+            # 在规格参数sku字典中查找符合当前规格的sku
+            key[index] = option['id']
+            spec_options.append({
+                'id': option['id'],
+                'value': option['value'],
+                'sku_id': matrix['spec_sku_map'].get(tuple(key)),
+            })
+        goods_specs.append({'id': spec['id'], 'name': spec['name'], 'spec_options': spec_options})
+    return goods_specs
+
+
+def get_detail_context(sku):
+    """
+    商品详情页模板上下文
+    :param sku: 使用select_related('spu')查询出的SKU
+    :return: 上下文字典，当前sku的规格信息不完整时返回None
+    """
+    # 获取当前商品的规格信息：来自预先计算并缓存的SPU规格矩阵
+    goods_specs = get_sku_specs(sku.spu_id, sku.id)
+    if goods_specs is None:
+        return None
+    return {
+        # 查询商品频道分类
+        'categories': get_categories(),
+        # 查询面包屑导航
+        'breadcrumb': get_breadcrumb(sku.category_id),
+        'sku': sku,
+        'specs': goods_specs,
+
+        # 商品数量
+        'stock': sku.stock
+    }
+
+
+def comments_version_name(sku_id):
+    """商品评价缓存版本名：有新评价时递增"""
+    return 'comments_%s' % sku_id
+
+
+def mask_username(username):
+    """匿名评价隐藏用户名：只保留首尾字符"""
+    return username[0] + '***' + username[-1]
+
+
+def get_comment_page(sku_id, cursor=None):
+    """
+    获取商品评价的一页数据，按(商品, 游标)缓存，由新到旧排序
+    :param cursor: 上一页返回的游标，None表示第一页
+    :return: {'comments': [评价], 'next_cursor', 'stats': 评价统计}，游标无效时返回None
+    """
+    version = get_version(comments_version_name(sku_id))
+    cache_key = 'comments_%s_%s_%s' % (sku_id, cursor or '', version)
+    page = cache.get(cache_key)
+    if page is not None:
+        return page
+    # 关联查询评价用户，只查询需要的字段
+    ordering = ('-create_time', '-id')
+    order_goods = OrderGoods.objects.filter(sku_id=sku_id, is_commented=True).select_related('order__user') \
+        .only('id', 'create_time', 'comment', 'score', 'is_anonymous', 'order__user__username')
+    result = keyset_page(order_goods, ordering, constants.COMMENTS_PER_PAGE, cursor)
+    if result is None:
+        return None
+    order_goods_list, _, next_cursor = result
+    comments = []
+    for item in order_goods_list:
+        username = item.order.user.username
+        comments.append({
+            'username': mask_username(username) if item.is_anonymous else username,
+            'comment': item.comment,
+            'score': item.score,
+        })
+    # 评价统计：增量维护的评价数量、平均评分和各评分的评价数量
+    # 商品不存在时统计均为0
+    sku = SKU.objects.only(*SKU.COMMENT_STATS_FIELDS).filter(id=sku_id).first() or SKU()
+    stats = {
+        'count': sku.comments,
+        'score_avg': sku.comment_score_avg,
+        'histogram': sku.comment_score_histogram,
+    }
+    page = {'comments': comments, 'next_cursor': next_cursor, 'stats': stats}
+    cache.set(cache_key, page, constants.COMMENTS_CACHE_EXPIRES)
+    return page
+
+
+def update_comment_stats(sku_id, added=(), removed=()):
+    """
+    增量更新SKU及其SPU的评价统计
+    :param added: 新增评价的评分
+    :param removed: 撤销评价的评分
+    """
+    if not added and not removed:
+        return
+    with transaction.atomic():
+        # 锁定记录后计算，并发评价不会丢失；使用update不触发SKU的保存信号
+        sku = SKU.objects.select_for_update().only(*SKU.COMMENT_STATS_FIELDS + ['spu_id']).get(id=sku_id)
+        SKU.objects.filter(id=sku_id).update(**sku.get_comment_stats(added, removed))
+        spu = SPU.objects.select_for_update().only(*SPU.COMMENT_STATS_FIELDS).get(id=sku.spu_id)
+        SPU.objects.filter(id=spu.id).update(**spu.get_comment_stats(added, removed))
+
+
+# 排行榜存在时才累加销量，避免在已丢失的排行榜中只写入部分商品
+# 正在重建时标记排行榜已过时：重建读取的销量可能已经包含这次下单，累加后会重复计算
+# KEYS: 排行榜, 重建锁, 过时标记  ARGV: 销量, sku_id, 过时标记有效期
+_INCR_IF_EXISTS_SCRIPT = """
+if redis.call('exists', KEYS[2]) == 1 then
+    redis.call('set', KEYS[3], 1, 'ex', ARGV[3])
+end
+if redis.call('exists', KEYS[1]) == 1 then
+    return redis.call('zincrby', KEYS[1], ARGV[1], ARGV[2])
+end
+return false
+"""
+
+
+def hot_goods_key(category_id, day=None):
+    """热销排行榜（有序集合，成员为sku_id，分数为销量）：累计销量或某一天的销量"""
+    if day is None:
+        return 'hot_%s' % category_id
+    return 'hot_%s_%s' % (category_id, day.strftime('%Y%m%d'))
+
+
+def hot_goods_window_key(category_id, window):
+    """多日销量合并结果的缓存"""
+    return 'hot_%s_%s' % (category_id, window)
+
+
+def hot_goods_empty_key(category_id):
+    """没有上架商品的类别的空排行榜标记：有序集合不能为空，排行榜键不存在时用它区分"""
+    return 'hot_%s_empty' % category_id
+
+
+def hot_goods_lock_key(category_id):
+    """重建排行榜的锁，同一类别同一时间只有一个进程查询数据库重建"""
+    return 'hot_%s_lock' % category_id
+
+
+def hot_goods_stale_key(category_id):
+    """重建期间有新的下单时的过时标记，重建完成后删除排行榜，下次读取时重新重建"""
+    return 'hot_%s_stale' % category_id
+
+
+def rebuild_hot_goods(category_id, redis_conn=None):
+    """
+    从数据库重建类别的热销排行榜：累计销量取自SKU.sales，每日销量取自最近的订单商品
+    :return: 上架商品数量，其他进程正在重建时返回None
+    """
+    redis_conn = redis_conn or get_redis_connection('hot_goods')
+    lock = redis_conn.lock(hot_goods_lock_key(category_id), timeout=constants.HOT_GOODS_REBUILD_LOCK_EXPIRES,
+                           blocking=False)
+    if not lock.acquire():
+        return None
+    try:
+        return _rebuild_hot_goods(category_id, redis_conn)
+    finally:
+        try:
+            lock.release()
+        except LockError:
+            # 重建时间超过了锁的有效期
+            logger.warning('rebuild_hot_goods: 类别%s的锁已过期', category_id)
+
+
+def _rebuild_hot_goods(category_id, redis_conn):
+    redis_conn.delete(hot_goods_stale_key(category_id))
+    sales = dict(SKU.objects.filter(category_id=category_id, is_launched=True).values_list('id', 'sales'))
+
+    today = timezone.localdate()
+    days = [today - datetime.timedelta(days=i) for i in range(constants.HOT_GOODS_DAYS)]
+    start = timezone.make_aware(datetime.datetime.combine(days[-1], datetime.time.min))
+    daily_sales = {}
+    order_goods = OrderGoods.objects.filter(sku__category_id=category_id, create_time__gte=start)
+    for sku_id, count, create_time in order_goods.values_list('sku_id', 'count', 'create_time'):
+        day_sales = daily_sales.setdefault(timezone.localdate(create_time), {})
+        day_sales[sku_id] = day_sales.get(sku_id, 0) + count
+
+    # 使用事务整体替换，读取方不会看到重建了一半的排行榜
+    pl = redis_conn.pipeline()
+    pl.delete(hot_goods_key(category_id), *[hot_goods_window_key(category_id, window)
+                                            for window in constants.HOT_GOODS_WINDOWS])
+    if sales:
+        pl.zadd(hot_goods_key(category_id), sales)
+        pl.delete(hot_goods_empty_key(category_id))
+    else:
+        # 空结果也记录下来，短时间内不再重建
+        pl.set(hot_goods_empty_key(category_id), 1, ex=constants.HOT_GOODS_EMPTY_EXPIRES)
+    for day in days:
+        day_key = hot_goods_key(category_id, day)
+        pl.delete(day_key)
+        if daily_sales.get(day):
+            pl.zadd(day_key, daily_sales[day])
+            pl.expire(day_key, (constants.HOT_GOODS_DAYS + 1) * 24 * 3600)
+    pl.execute()
+    # 重建期间有新的下单，累计销量可能重复计算，丢弃重建结果，每日销量按订单商品重建，不受影响
+    if redis_conn.delete(hot_goods_stale_key(category_id)):
+        redis_conn.delete(hot_goods_key(category_id))
+    return len(sales)
+
+
+def incr_hot_goods(sku_sales):
+    """
+    下单成功后累加热销排行榜，在事务提交后执行
+    :param sku_sales: {sku_id: (category_id, 销量)}
+    """
+    if not sku_sales:
+        return
+
+    def incr():
+        redis_conn = get_redis_connection('hot_goods')
+        incr_if_exists = redis_conn.register_script(_INCR_IF_EXISTS_SCRIPT)
+        day = timezone.localdate()
+        pl = redis_conn.pipeline()
+        for sku_id, (category_id, count) in sku_sales.items():
+            incr_if_exists(keys=[hot_goods_key(category_id), hot_goods_lock_key(category_id),
+                                 hot_goods_stale_key(category_id)],
+                           args=[count, sku_id, constants.HOT_GOODS_REBUILD_LOCK_EXPIRES], client=pl)
+            day_key = hot_goods_key(category_id, day)
+            pl.zincrby(day_key, count, sku_id)
+            pl.expire(day_key, (constants.HOT_GOODS_DAYS + 1) * 24 * 3600)
+        # 多日销量合并结果已过期
+        for category_id in {category_id for category_id, _ in sku_sales.values()}:
+            pl.delete(*[hot_goods_window_key(category_id, window) for window in constants.HOT_GOODS_WINDOWS])
+        pl.execute()
+
+    transaction.on_commit(incr)
+
+
+def get_hot_sku_ids(category_id, limit, window=None):
+    """
+    读取热销排行榜，排行榜不存在时从数据库重建
+    :param window: 时间窗口，见constants.HOT_GOODS_WINDOWS，None表示累计销量
+    :return: 按销量由高到低排序的sku_id列表
+    """
+    redis_conn = get_redis_connection('hot_goods')
+    if not redis_conn.exists(hot_goods_key(category_id)):
+        # 类别没有上架商品时有空排行榜标记，标记过期前不再查询数据库重建
+        if redis_conn.exists(hot_goods_empty_key(category_id)):
+            return []
+        rebuilt = rebuild_hot_goods(category_id, redis_conn)
+        if rebuilt == 0:
+            return []
+        if rebuilt is None and window is None:
+            # 其他进程正在重建，累计销量直接按销量字段查询前几名，不等待重建
+            return list(SKU.objects.filter(category_id=category_id, is_launched=True)
+                        .order_by('-sales', 'id').values_list('id', flat=True)[:limit])
+
+    if window is None:
+        key = hot_goods_key(category_id)
+    elif window == 'today':
+        key = hot_goods_key(category_id, timezone.localdate())
+    else:
+        # 合并最近几天的销量，结果短暂缓存
+        key = hot_goods_window_key(category_id, window)
+        if not redis_conn.exists(key):
+            today = timezone.localdate()
+            day_keys = [hot_goods_key(category_id, today - datetime.timedelta(days=i))
+                        for i in range(constants.HOT_GOODS_WINDOWS[window])]
+            pl = redis_conn.pipeline()
+            pl.zunionstore(key, day_keys)
+            pl.expire(key, constants.HOT_GOODS_WINDOW_CACHE_EXPIRES)
+            pl.execute()
+    return [int(sku_id) for sku_id in redis_conn.zrevrange(key, 0, limit - 1)]
+
+
+def get_hot_skus(category_id, limit=constants.HOT_GOODS_LIMIT, window=None):
+    """
+    类别热销排行：上架商品的卡片数据
+    """
+    # 多取一些，排除排行榜中已下架或更换类别的商品
+    sku_ids = get_hot_sku_ids(category_id, limit * 2, window)
+    cards = sku_card_cache.get_many(sku_ids)
+    hot_skus = []
+    for sku_id in sku_ids:
+        card = cards.get(sku_id)
+        if card is None or not card['is_launched'] or card['category_id'] != category_id:
+            continue
+        hot_skus.append({field: card[field] for field in SKU_CARD_FIELDS})
+        if len(hot_skus) == limit:
+            break
+    return hot_skus
+
+
+def visit_count_key(day):
+    """分类商品访问量（哈希，字段为category_id，值为访问量）"""
+    return 'visit_%s' % day.strftime('%Y%m%d')
+
+
+def incr_visit_count(category_id):
+    """记录分类商品访问量：只写redis，由flush_visit_count定期写入数据库"""
+    key = visit_count_key(timezone.localdate())
+    pl = get_redis_connection('visit_count').pipeline()
+    pl.hincrby(key, category_id, 1)
+    pl.expire(key, constants.VISIT_COUNT_EXPIRES_DAYS * 24 * 3600)
+    pl.execute()
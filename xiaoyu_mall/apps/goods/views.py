@@ -1,20 +1,21 @@
-from datetime import datetime
+import math
 
-from django.conf import settings
-from django.core.paginator import Paginator, EmptyPage
 from django.http import HttpResponseForbidden, HttpResponseNotFound, JsonResponse, HttpResponseServerError
 from django.shortcuts import render
-from django.utils import timezone
 from django.views import View
+from haystack.views import SearchView
 
 from contents.utils import get_categories
-from goods.models import GoodsCategory, SKU, GoodsVisitCount
-from goods.utils import get_breadcrumb
-from orders.models import OrderGoods
+from goods.models import SKU
+from goods import constants
+from goods.utils import get_breadcrumb, category_index, get_sku_count, get_list_page, get_detail_context, \
+    get_hot_skus, incr_visit_count, get_comment_page, suggest_index, facet_index, parse_facet_filters, \
+    encode_facet_filters, add_facet_queries, get_filtered_list_page, get_search_result, incr_search_query
+from xiaoyu_mall.utils.bitmap import ids_to_bitmap, bitmap_to_ids
 from xiaoyu_mall.utils.response_code import RETCODE
 
 import logging
-logger = logging.error('django')
+logger = logging.getLogger('django')
 # Create your views here.
 
 class ListView(View):
@@ -23,47 +24,55 @@ class ListView(View):
     def get(self, request, category_id, page_num):
         """查询并渲染商品列表页"""
         # 校验参数
-        try:
-            # 三级类别
-            category = GoodsCategory.objects.get(id=category_id)
-        except GoodsCategory.DoesNotExist:
+        # 三级类别：从进程内类别索引中查询
+        if category_index.get(category_id) is None:
             return HttpResponseForbidden("参数category_id不存在")
         # 获取sort（排序规则）  如果sort没有值，取default
         sort = request.GET.get('sort', 'default')
-        # 根据sort选择排排序字段, 排序字段必须是模型类的属性
-        if sort == 'price':  # 按照价格由低到高排序
-            sort_field = 'price'
-        elif sort == 'hot':
-            sort_field = '-sales'  # 按照销量由高到低排序
-        else:  # 只要不是price和-sales其他的所有情况都归为default
+        # 只要不是price和hot其他的所有情况都归为default
+        if sort not in constants.LIST_SORT_FIELDS:
             sort = 'default'
-            sort_field = 'create_time'
         # 查询商品分类
         categories = get_categories()
         # 查询面包屑导航：一级 ==>二级==>一级
-        breadcrumb = get_breadcrumb(category)
-
-        # 分页和排序查询 category查询sku 一查多
-        skus = category.sku_set.filter(is_launched=True).order_by(sort_field)
-        # 创建分页器
-        # Paginator('要分页的记录','每页记录的条数')
-        paginator = Paginator(skus, 5)  # 把skus进行分页，每页5条记录
-        # 需要获取用户当前要看的那一页
-        try:
-            page_skus = paginator.page(page_num)  # 获取到page_num页中的5条记录
-        except EmptyPage:
-            return HttpResponseNotFound('Empty Page')
-        # 获取总页数: 前端的分页插件需要使用
-        total_page = paginator.num_pages
+        breadcrumb = get_breadcrumb(category_id)
+
+        # 商品筛选：品牌、价格区间、规格选项，由进程内位图求交集，同时得到各筛选值的商品数量
+        selected = parse_facet_filters(request.GET)
+        filtered, facets = facet_index.get(category_id).filter(selected)
+
+        if selected:
+            # 有筛选条件时，结果数量和当页商品id都来自位图
+            total_page = max(math.ceil(filtered.bit_count() / constants.LIST_PER_PAGE), 1)
+            if page_num < 1 or page_num > total_page:
+                return HttpResponseNotFound('Empty Page')
+            page = {
+                'skus': get_filtered_list_page(bitmap_to_ids(filtered), sort, page_num),
+                'prev_cursor': None,
+                'next_cursor': None,
+            }
+        else:
+            # 获取总页数: 前端的分页插件需要使用，分类商品数量来自缓存计数器，不再每次COUNT
+            total_page = max(math.ceil(get_sku_count(category_id) / constants.LIST_PER_PAGE), 1)
+            if page_num < 1 or page_num > total_page:
+                return HttpResponseNotFound('Empty Page')
+            # 分页和排序查询：按(类别, 排序, 页码)缓存
+            page = get_list_page(category_id, sort, page_num, request.GET.get('cursor'))
+            if page is None:
+                return HttpResponseForbidden('参数cursor有误')
         # 构造上下文
         context = {
             'categories': categories,
             'breadcrumb': breadcrumb,
-            'page_skus': page_skus,
+            'page_skus': page['skus'],
             'total_page': total_page,
             'page_num': page_num,
+            'prev_cursor': page['prev_cursor'],
+            'next_cursor': page['next_cursor'],
             'sort': sort,
             'category_id': category_id,
+            'facets': add_facet_queries(facets, selected),
+            'filter_query': encode_facet_filters(selected),
         }
         return render(request, 'list.html', context)
 
@@ -72,41 +81,79 @@ class HostGoodsView(View):
     """热销排行"""
 
     def get(self, request, category_id):
-        # 要查询指定分类的sku信息，而且必须是一个上架转态，然后按照由高到低排序，最后切片取出前两位
-        skus = SKU.objects.filter(category_id=category_id, is_launched=True).order_by('-sales')[:2]
-        # 将模型列表转字典构造json数据
-        hot_skus = []
-
-        for sku in skus:
-            sku_dict = {
-                'id': sku.id,
-                'name': sku.name,
-                'price': sku.price,
-                'default_image_url': settings.STATIC_URL + 'images/goods/' + sku.default_image.url + '.jpg'
-            }
-            hot_skus.append(sku_dict)
+        # 可选参数：返回的商品数量、时间窗口（today、7d、30d，不传按累计销量）
+        limit = request.GET.get('limit', str(constants.HOT_GOODS_LIMIT))
+        window = request.GET.get('window')
+        try:
+            limit = int(limit)
+        except ValueError:
+            return HttpResponseForbidden('参数limit有误')
+        if not 0 < limit <= constants.HOT_GOODS_MAX_LIMIT:
+            return HttpResponseForbidden('参数limit有误')
+        if window is not None and window not in constants.HOT_GOODS_WINDOWS:
+            return HttpResponseForbidden('参数window有误')
+        # 从redis热销排行榜中读取
+        hot_skus = get_hot_skus(category_id, limit, window)
         return JsonResponse({'code': RETCODE.OK, 'errmsg': 'OK', 'hot_skus': hot_skus})
 
 
+class SKUSearchView(SearchView):
+    """
+    商品搜索：全文检索结果按规范化的搜索词缓存，在结果上按品牌、价格区间、规格筛选
+    分页对象中是商品id，只查询当页商品
+    """
+    selected = {}
+    facets = []
+
+    def get_results(self):
+        self.selected = parse_facet_filters(self.request.GET)
+        if not self.query:
+            self.facets = []
+            return []
+        if not self.selected and self.request.GET.get('page', '1') == '1':
+            # 统计热门搜索词，翻页和筛选不重复计数
+            incr_search_query(self.query)
+        sku_ids = get_search_result(self.query)['sku_ids']
+        filtered, self.facets = facet_index.get().filter(self.selected, ids_to_bitmap(sku_ids))
+        filtered_ids = set(bitmap_to_ids(filtered))
+        # 保持全文检索的相关度排序
+        return [sku_id for sku_id in sku_ids if sku_id in filtered_ids]
+
+    def get_context(self):
+        context = super().get_context()
+        # 一次查询加载当页商品
+        page_ids = context['page'].object_list
+        skus = SKU.objects.in_bulk(page_ids)
+        context['page_skus'] = [skus[sku_id] for sku_id in page_ids if sku_id in skus]
+        return context
+
+    def extra_context(self):
+        return {
+            'facets': add_facet_queries(self.facets, self.selected),
+            'filter_query': encode_facet_filters(self.selected),
+        }
+
+
+class SearchSuggestView(View):
+    """搜索联想词"""
+
+    def get(self, request):
+        # 前缀匹配上架商品的名称，按销量排序，使用进程内索引不查询数据库
+        q = request.GET.get('q', '')[:constants.SUGGEST_MAX_QUERY_LENGTH]
+        suggestions = suggest_index.suggest(q)
+        return JsonResponse({'code': RETCODE.OK, 'errmsg': 'OK', 'suggestions': suggestions})
+
+
 class GoodsCommentView(View):
     """订单商品评价信息"""
 
     def get(self, request, sku_id):
-        # 获取被评价的订单商品信息
-        order_goods_list = OrderGoods.objects.filter(sku_id=sku_id, is_commented=True).order_by('-create_time')[:30]
-        # 序列化
-        comment_list = []
-        for order_goods in order_goods_list:
-            username = order_goods.order.user.username
-            comment_list.append({
-                'username': username[0] + '***' + username[-1]
-                if order_goods.is_anonymous else username,
-                'comment': order_goods.comment,
-                'score': order_goods.score,
-            })
-            # print('评价信息')
-            # print(comment_list)
-        return JsonResponse({'code': RETCODE.OK, 'errmsg': 'OK', 'comment_list': comment_list})
+        # 获取被评价的订单商品信息：一次关联查询，按商品缓存
+        page = get_comment_page(sku_id, request.GET.get('cursor'))
+        if page is None:
+            return HttpResponseForbidden('参数cursor有误')
+        return JsonResponse({'code': RETCODE.OK, 'errmsg': 'OK', 'comment_list': page['comments'],
+                             'next_cursor': page['next_cursor'], 'comment_stats': page['stats']})
 
 
 class DetailVisitView(View):
@@ -114,26 +161,13 @@ class DetailVisitView(View):
 
     def post(self, request, category_id):
         """记录分类商品访问量"""
-        try:
-            category = GoodsCategory.objects.get(id=category_id)
-        except GoodsCategory.DoesNotExist:
+        # 校验类别：从进程内类别索引中查询
+        if category_index.get(category_id) is None:
             return HttpResponseForbidden('缺少必传参数')
 
-        # 获取今天的日期
-        t = timezone.localtime()
-        today_str = '%d-%02d-%02d' % (t.year, t.month, t.day)
-        today_date = datetime.strptime(today_str, '%Y-%m-%d')
+        # 访问量记录在redis中，定期批量写入数据库
         try:
-            # 查询今天该类别的商品的访问量
-            counts_data = category.goodsvisitcount_set.get(date=today_date)
-        except GoodsVisitCount.DoesNotExist:
-            # 如果该类别的商品在今天没有过访问记录，就新建一个访问记录
-            counts_data = GoodsVisitCount()
-
-        try:
-            counts_data.category = category
-            counts_data.count += 1
-            counts_data.save()
+            incr_visit_count(category_id)
         except Exception as e:
             logger.error(e)
             return HttpResponseServerError('服务器异常')
@@ -148,57 +182,23 @@ class DetailView(View):
         """提供商品详情页"""
         # 获取当前sku的信息
         try:
-            sku = SKU.objects.get(id=sku_id)
+            sku = SKU.objects.select_related('spu').get(id=sku_id)
         except SKU.DoesNotExist:
             return render(request, '404.html')
 
-        # 查询商品频道分类
-        categories = get_categories()
-        # 查询面包屑导航
-        breadcrumb = get_breadcrumb(sku.category)
-
-        # 构建当前商品的规格键
-        sku_specs = sku.specs.order_by('spec_id')
-        sku_key = []
-        for spec in sku_specs:
-            sku_key.append(spec.option.id)
-        # 获取当前商品的所有SKU
-        skus = sku.spu.sku_set.all()
-        # 构建不同规格参数（选项）的sku字典
-        spec_sku_map = {}
-        for s in skus:
-            # 获取sku的规格参数
-            s_specs = s.specs.order_by('spec_id')
-            # 用于形成规格参数-sku字典的键
-            key = []
-            for spec in s_specs:
-                key.append(spec.option.id)
-            # 向规格参数-sku字典添加记录
-            spec_sku_map[tuple(key)] = s.id
-        # 获取当前商品的规格信息
-        goods_specs = sku.spu.specs.order_by('id')
+        # 渲染页面的上下文
+        context = get_detail_context(sku)
         # 若当前sku的规格信息不完整，则不再继续
-        if len(sku_key) < len(goods_specs):
+        if context is None:
             return
-        for index, spec in enumerate(goods_specs):
-            # 复制当前sku的规格键
-            key = sku_key[:]
-            # 该规格的选项
-            spec_options = spec.options.all()
-            for option in spec_options:
-                # 在规格参数sku字典中查找符合当前规格的sku
-                key[index] = option.id
-                option.sku_id = spec_sku_map.get(tuple(key))
-            spec.spec_options = spec_options
-
-        # 渲染页面
-        context = {
-            'categories': categories,
-            'breadcrumb': breadcrumb,
-            'sku': sku,
-            'specs': goods_specs,
-
-            # 商品数量
-            'stock': sku.stock
-        }
         return render(request, 'detail.html', context)
+
+
+class DetailStockView(View):
+    """商品库存：静态化的详情页通过该接口获取实时库存"""
+
+    def get(self, request, sku_id):
+        stock = SKU.objects.filter(id=sku_id).values_list('stock', flat=True).first()
+        if stock is None:
+            return JsonResponse({'code': RETCODE.NODATAERR, 'errmsg': '商品不存在'})
+        return JsonResponse({'code': RETCODE.OK, 'errmsg': 'OK', 'stock': stock})
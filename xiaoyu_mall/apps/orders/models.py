@@ -1,5 +1,5 @@
 from django.db import models
-from xiaoyu_mall.utils.models import BaseModel
+from xiaoyu_mall.utils.models import BaseModel, ChangeTrackingMixin
 from users.models import User, Address
 from goods.models import SKU
 
@@ -43,7 +43,7 @@ class OrderInfo(BaseModel):
     def __str__(self):
         return self.order_id
 
-class OrderGoods(BaseModel):
+class OrderGoods(ChangeTrackingMixin, BaseModel):
     """订单商品"""
     SCORE_CHOICES = (
         (0, '0分'),
@@ -53,6 +53,8 @@ class OrderGoods(BaseModel):
         (4, '80分'),
         (5, '100分'),
     )
+    # 加载评价状态时同时记录评分，评价统计需要撤销原来的评分（goods.signals）
+    TRACKED_TOGETHER = {'is_commented': ['score']}
     order = models.ForeignKey(OrderInfo, related_name='skus', on_delete=models.CASCADE, verbose_name="订单")
     sku = models.ForeignKey(SKU, on_delete=models.PROTECT, verbose_name="订单商品")
     count = models.IntegerField(default=1, verbose_name="数量")
@@ -65,5 +67,9 @@ class OrderGoods(BaseModel):
         db_table = "tb_order_goods"
         verbose_name = '订单商品'
         verbose_name_plural = verbose_name
+        indexes = [
+            # 商品评价按时间倒序分页
+            models.Index(fields=['sku', 'is_commented', '-create_time', '-id'], name='tb_order_goods_comment_idx'),
+        ]
     def __str__(self):
         return self.sku.name
\ No newline at end of file
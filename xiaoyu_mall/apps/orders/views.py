@@ -5,8 +5,9 @@ import logging
 
 logger = logging.getLogger('django')
 from users.models import Address
-from django_redis import get_redis_connection
+from carts.storage import RedisCart, incr_sku_stocks
 from goods.models import SKU
+from goods.utils import expire_list_cache, incr_hot_goods
 from decimal import Decimal
 import json
 from xiaoyu_mall.utils.views import LoginRequiredJSONMixin
@@ -77,13 +78,13 @@ class OrderCommitView(LoginRequiredJSONMixin, View):
                         'ALIPAY'] else OrderInfo.ORDER_STATUS_ENUM['UNSEND']
                 )
                 # 从redis读取购物⻋中被勾选的商品信息
-                redis_conn = get_redis_connection('carts')
-                redis_cart = redis_conn.hgetall('carts_%s' % user.id)
-                selected = redis_conn.smembers('selected_%s' % user.id)
-                carts = {}
-                for sku_id in selected:
-                    carts[int(sku_id)] = int(redis_cart[sku_id])
+                cart = RedisCart(str(user.id))
+                carts = cart.get_selected()
                 sku_ids = carts.keys()
+                # 销量发生变化的商品类别
+                category_ids = set()
+                # 各商品的销量变化 {sku_id: (category_id, 销量)}
+                sku_sales = {}
                 # 遍历购物车中被勾选的商品信息
                 for sku_id in sku_ids:
                     while True:
@@ -124,6 +125,8 @@ class OrderCommitView(LoginRequiredJSONMixin, View):
                         # 保存商品订单中总价和总数量
                         order.total_count += sku_count
                         order.total_amount += (sku_count * sku.price)
+                        category_ids.add(sku.category_id)
+                        sku_sales[sku.id] = (sku.category_id, sku_count)
                         # 下单成功，跳出循环
                         break
                 # 添加邮费和保存订单信息
@@ -133,11 +136,14 @@ class OrderCommitView(LoginRequiredJSONMixin, View):
                 logger.error(e)
                 transaction.savepoint_rollback(save_id)  # 出错回滚
                 return JsonResponse({'code': RETCODE.DBERR, 'errmsg': '下单失败'})
+        # 销量变化，按人气排序的商品列表页缓存失效
+        expire_list_cache(category_ids, 'hot')
+        # 累加热销排行榜
+        incr_hot_goods(sku_sales)
+        # 同步购物车校验用的库存缓存
+        incr_sku_stocks({sku_id: -count for sku_id, (category_id, count) in sku_sales.items()})
         # 清除购物车中已结算的商品
-        pl = redis_conn.pipeline()
-        pl.hdel('carts_%s' % user.id, *selected)
-        pl.srem('selected_%s' % user.id, *selected)
-        pl.execute()
+        cart.remove(*carts.keys())
         # 响应提交订单结果
         return JsonResponse({'code': RETCODE.OK, 'errmsg': '下单成功', 'order_id': order.order_id})
 
@@ -165,15 +171,8 @@ class OrderSettlementView(LoginRequiredMixin, View):
             logger(e)
 
         # 查询redis购物车中被勾选的商品
-        redis_conn = get_redis_connection('carts')
-        # 所有的购物车数据，包含了勾选和未勾选 ：{b'1': b'1', b'2': b'2'}
-        redis_cart = redis_conn.hgetall('carts_%s' % user.id)
-        # 被勾选的商品的sku_id：[b'1']
-        redis_selected = redis_conn.smembers('selected_%s' % user.id)
-        # 构造购物车中被勾选的商品的数据 {b'1': b'1'}
-        new_cart_dict = {}
-        for sku_id in redis_selected:
-            new_cart_dict[int(sku_id)] = int(redis_cart[sku_id])
+        # 被勾选的商品的数据 {1: 1}，一次HGETALL取出
+        new_cart_dict = RedisCart(str(user.id)).get_selected()
         # 获取被勾选的商品的sku_id
         sku_ids = new_cart_dict.keys()
         skus = SKU.objects.filter(id__in=sku_ids)
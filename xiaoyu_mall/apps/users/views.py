@@ -1,4 +1,3 @@
-from django.conf import settings
 from django.core.paginator import Paginator, EmptyPage
 from django.shortcuts import render, redirect, reverse
 import logging
@@ -7,6 +6,8 @@ from django_redis import get_redis_connection
 
 from orders.models import OrderInfo
 from goods.models import SKU
+from goods.utils import sku_card_cache
+from carts.utils import merge_carts
 
 logger = logging.getLogger('django')
 from django.views import View
@@ -131,7 +132,8 @@ class LoginView(View):
             response = redirect(reverse('contents:index'))
         # 登录时用户名写入到cookie，有效期15天
         response.set_cookie('username', user.username, max_age=3600 * 24 * 15)
-        return response
+        # 合并未登录时的购物车
+        return merge_carts(request, user, response)
 
 
 class LogoutView(View):
@@ -474,14 +476,17 @@ class UserBrowseHistory(LoginRequiredJSONMixin, View):
         # 获取Redis存储的sku_id列表信息
         redis_conn = get_redis_connection('history')
         sku_ids = redis_conn.lrange('history_%s' % request.user.id, 0, -1)
-        # 根据sku_ids列表数据，查询出商品sku信息
+        # 根据sku_ids列表数据，从SKU卡片缓存中一次取出所有商品信息
+        cards = sku_card_cache.get_many(sku_ids)
         skus = []
         for sku_id in sku_ids:
-            sku = SKU.objects.get(id=sku_id)
+            card = cards.get(int(sku_id))
+            if card is None:
+                continue
             skus.append({
-                'id': sku.id,
-                'name': sku.name,
-                'default_image_url': settings.STATIC_URL + 'images/goods/' + sku.default_image.url + '.jpg',
-                'price': sku.price
+                'id': card['id'],
+                'name': card['name'],
+                'default_image_url': card['default_image_url'],
+                'price': card['price']
             })
         return JsonResponse({'code': RETCODE.OK, 'errmsg': 'OK', 'skus': skus})
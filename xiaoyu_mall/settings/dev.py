@@ -150,6 +150,13 @@ USE_TZ = True
 STATIC_URL = 'static/'
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 
+# 页面静态化：生成的html文件目录，可由前端代理直接提供
+STATIC_HTML_DIR = os.path.join(os.path.dirname(BASE_DIR), 'static_html')
+# 首页直接返回静态化的html文件，广告和商品分类变化时自动重新生成
+INDEX_STATIC_ENABLED = False
+# 商品列表页缓存失效后，后台线程预热每个排序的前N页，0表示不预热
+LIST_PREWARM_PAGES = 0
+
 CACHES = {
     "default": {  # 默认
         "BACKEND": "django_redis.cache.RedisCache",
@@ -186,7 +193,30 @@ CACHES = {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
         }
     },
+    "hot_goods": {  # 热销排行榜
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": "redis://127.0.0.1:6379/5",
+        "OPTIONS": {
+            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+        }
+    },
+    "visit_count": {  # 分类商品访问量，定期写入数据库
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": "redis://127.0.0.1:6379/6",
+        "OPTIONS": {
+            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+        }
+    },
+    "search": {  # 搜索：待更新索引的记录队列等
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": "redis://127.0.0.1:6379/7",
+        "OPTIONS": {
+            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+        }
+    },
 }
+# 未登录用户购物车的保存位置：cookie 保存在cookie中；redis 保存在carts库中，cookie中只保存购物车id
+CARTS_ANONYMOUS_STORAGE = 'cookie'
 SESSION_ENGINE = "django.contrib.sessions.backends.cache"
 SESSION_CACHE_ALIAS = "session"
 # Default primary key field type
@@ -256,12 +286,18 @@ LOGIN_URL = '/login/'
 
 HAYSTACK_CONNECTIONS = {
     'default': {
-        # 使用whoosh引擎
-        'ENGINE': 'haystack.backends.whoosh_backend.WhooshEngine',
-        # 索引文件路径
-        'PATH': os.path.join(BASE_DIR, 'whoosh_index'),
+        # 使用whoosh引擎：每个进程复用打开的搜索器
+        'ENGINE': 'xiaoyu_mall.utils.whoosh_backend.CachedWhooshEngine',
+        # 索引文件路径：rebuild_sku_index 维护的符号链接，指向 search_index_<时间> 目录，不纳入版本控制
+        'PATH': os.path.join(BASE_DIR, 'search_index'),
     }
+    # 使用内存倒排索引引擎
+    # 'default': {
+    #     'ENGINE': 'xiaoyu_mall.utils.memory_backend.MemorySearchEngine',
+    #     # 索引快照文件
+    #     'PATH': os.path.join(BASE_DIR, 'memory_index.pickle'),
+    # }
 }
-# 当添加、修改、删除数据时，自动生成索引
-HAYSTACK_SIGNAL_PROCESSOR = 'haystack.signals.RealtimeSignalProcessor'
+# 当添加、修改、删除数据时，记录到redis队列中，由process_search_queue批量更新索引
+HAYSTACK_SIGNAL_PROCESSOR = 'xiaoyu_mall.utils.search_signals.QueuedSignalProcessor'
 HAYSTACK_SEARCH_RESULTS_PER_PAGE = 5
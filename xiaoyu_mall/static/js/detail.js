@@ -19,6 +19,10 @@ let vm = new Vue({
         cart_total_count: 0,
         carts: [],
         comments: [],
+        // 加载下一页评价的游标
+        comments_cursor: null,
+        // 评价数量
+        comment_count: 0,
 
         // 评分
         score_classes: {
@@ -42,6 +46,10 @@ let vm = new Vue({
         this.get_carts();
 		// 获取商品评价信息
         this.get_goods_comment();
+        // 静态化的详情页没有库存数据，从接口获取
+        if (this.stock === '') {
+            this.get_stock();
+        }
     },
     watch: {
         // 监听商品数量的变化
@@ -87,6 +95,21 @@ let vm = new Vue({
             };
             this.tab_content[name] = true;
         },
+        // 获取商品库存
+        get_stock(){
+            let url = '/detail/stock/'+ this.sku_id +'/';
+            axios.get(url, {
+                responseType: 'json'
+            })
+                .then(response => {
+                    if (response.data.code == '0') {
+                        this.stock = response.data.stock;
+                    }
+                })
+                .catch(error => {
+                    console.log(error.response);
+                })
+        },
     	// 获取热销商品数据
         get_hot_skus(){
             if (this.category_id) {
@@ -192,14 +215,21 @@ let vm = new Vue({
         get_goods_comment(){
             if (this.sku_id) {
                 let url = '/comments/'+ this.sku_id +'/';
+                if (this.comments_cursor) {
+                    url += '?cursor=' + this.comments_cursor;
+                }
                 axios.get(url, {
                     responseType: 'json'
                 })
                     .then(response => {
-                        this.comments = response.data.comment_list;
-                        for(let i=0; i<this.comments.length; i++){
-                            this.comments[i].score_class = this.score_classes[this.comments[i].score];
+                        let comments = response.data.comment_list;
+                        for(let i=0; i<comments.length; i++){
+                            comments[i].score_class = this.score_classes[comments[i].score];
                         }
+                        // 加载更多时追加到已有评价之后
+                        this.comments = this.comments.concat(comments);
+                        this.comments_cursor = response.data.next_cursor;
+                        this.comment_count = response.data.comment_stats.count;
                     })
                     .catch(error => {
                         console.log(error.response);
@@ -0,0 +1,22 @@
+# 整数位图：第i位为1表示id为i的记录在集合中，交集、并集直接使用 & |，计数使用 int.bit_count()
+# 商品id自增且较为连续，直接用Python整数存储比集合紧凑，集合运算也快得多
+
+# 每个字节值中为1的位
+_BYTE_BITS = [tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)]
+
+
+def ids_to_bitmap(ids):
+    """id列表转换为位图"""
+    ids = list(ids)
+    if not ids:
+        return 0
+    data = bytearray(max(ids) // 8 + 1)
+    for i in ids:
+        data[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(data, 'little')
+
+
+def bitmap_to_ids(bitmap):
+    """位图转换为由小到大的id列表"""
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    return [i * 8 + bit for i, byte in enumerate(data) if byte for bit in _BYTE_BITS[byte]]
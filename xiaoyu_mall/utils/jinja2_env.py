@@ -1,6 +1,52 @@
-from jinja2 import Environment
+from jinja2 import Environment, nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from django.core.cache import cache
 from django.urls import reverse
 from django.contrib.staticfiles.storage import staticfiles_storage
+
+from xiaoyu_mall.utils.versions import get_versions
+
+# 模板片段缓存全局版本名：模板发布后递增即可清空所有片段缓存
+FRAGMENTS_VERSION = 'fragments'
+# 模板片段缓存默认有效期，单位：秒
+FRAGMENT_CACHE_EXPIRES = 3600
+
+
+class FragmentCacheExtension(Extension):
+    """
+    模板片段缓存：将渲染好的html片段保存到Django缓存
+    {% cache 'index_nav', 3600, 'categories' %}...{% endcache %}
+    参数依次为：缓存键、有效期、失效标签（可多个）
+    失效标签即 xiaoyu_mall.utils.versions 中的版本名，递增版本号即可让相关片段失效
+    """
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        # 解析 {% cache %} 后以逗号分隔的参数
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_cache_support', [nodes.List(args)]),
+                               [], [], body).set_lineno(lineno)
+
+    def _cache_support(self, args, caller):
+        """缓存命中返回缓存的片段，未命中渲染片段并写入缓存"""
+        key = args[0]
+        timeout = args[1] if len(args) > 1 else FRAGMENT_CACHE_EXPIRES
+        tags = [FRAGMENTS_VERSION] + list(args[2:])
+        # 一次往返取出所有失效标签的版本号，拼接进缓存键
+        versions = get_versions(*tags)
+        cache_key = 'fragment_%s_%s' % (key, '_'.join('%s' % versions[tag] for tag in tags))
+        fragment = cache.get(cache_key)
+        if fragment is None:
+            fragment = caller()
+            cache.set(cache_key, str(fragment), timeout)
+        return Markup(fragment)
+
+
 def jinja2_environment(**options):
     """jinja2环境"""
     # 创建环境对象
@@ -10,5 +56,7 @@ def jinja2_environment(**options):
         'static': staticfiles_storage.url,   # 获取静态文件的前缀
         'url': reverse,  						# 反向解析
     })
+    # 自定义语法：{% cache 缓存键, 有效期, 失效标签 %}...{% endcache %}
+    env.add_extension(FragmentCacheExtension)
     # 返回环境对象
     return env
@@ -0,0 +1,340 @@
+"""
+内存倒排索引搜索引擎：索引常驻进程内存，搜索不读磁盘、不加文件锁
+
+HAYSTACK_CONNECTIONS = {
+    'default': {
+        'ENGINE': 'xiaoyu_mall.utils.memory_backend.MemorySearchEngine',
+        # 索引快照文件：进程中第一次搜索时加载，其它进程更新索引后自动重新加载
+        'PATH': os.path.join(BASE_DIR, 'memory_index.pickle'),
+    }
+}
+"""
+import array
+import fcntl
+import math
+import os
+import pickle
+import re
+import tempfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from haystack.backends import BaseEngine, BaseSearchBackend, log_query
+from haystack.backends.simple_backend import SimpleSearchQuery
+from haystack.constants import DJANGO_CT, DJANGO_ID, ID
+from haystack.exceptions import SkipDocument
+from haystack.models import SearchResult
+from haystack.utils import get_identifier, get_model_ct
+
+# 英文单词和数字整体作为一个词，连续的中日韩文字切分为二元组
+TOKEN_RE = re.compile(r'[a-z0-9]+|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]+')
+# BM25参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+# 快照格式版本，格式变化时递增
+SNAPSHOT_VERSION = 1
+
+
+def is_cjk(token):
+    return token[0] >= '\u3040'
+
+
+def tokenize(text):
+    """
+    分词：'Apple iPhone 8 金色手机' ==> ['apple', 'iphone', '8', '金色', '色手', '手机']
+    """
+    tokens = []
+    for run in TOKEN_RE.findall(text.lower()):
+        if is_cjk(run) and len(run) > 1:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+class InvertedIndex(object):
+    """
+    倒排索引：文档按加入顺序编号，每个词的倒排表是两个整数数组（文档编号，词频），编号递增
+    删除文档只做标记，删除的文档超过一半时压缩
+    """
+
+    def __init__(self):
+        # 文档编号 ==> 文档标识（如 goods.sku.1），已删除为None
+        self.identifiers = []
+        # 文档编号 ==> 存储字段（django_ct、django_id）
+        self.stored = []
+        # 文档编号 ==> 文档长度（词数）
+        self.lengths = array.array('I')
+        # 词 ==> (文档编号数组, 词频数组)
+        self.postings = {}
+        # 文档标识 ==> 文档编号
+        self.doc_numbers = {}
+        self.total_length = 0
+
+    @property
+    def doc_count(self):
+        return len(self.doc_numbers)
+
+    def add(self, identifier, text, stored):
+        """加入文档，文档已存在时替换"""
+        self.remove(identifier)
+        doc_number = len(self.identifiers)
+        tokens = tokenize(text)
+        for term, frequency in Counter(tokens).items():
+            doc_numbers, frequencies = self.postings.setdefault(term, (array.array('I'), array.array('I')))
+            doc_numbers.append(doc_number)
+            frequencies.append(frequency)
+        self.identifiers.append(identifier)
+        self.stored.append(stored)
+        self.lengths.append(len(tokens))
+        self.doc_numbers[identifier] = doc_number
+        self.total_length += len(tokens)
+
+    def remove(self, identifier):
+        """删除文档"""
+        doc_number = self.doc_numbers.pop(identifier, None)
+        if doc_number is None:
+            return
+        self.identifiers[doc_number] = None
+        self.stored[doc_number] = None
+        self.total_length -= self.lengths[doc_number]
+        if len(self.identifiers) > 2 * self.doc_count + 100:
+            self.compact()
+
+    def compact(self):
+        """去掉已删除的文档，重新编号"""
+        new_numbers = {}
+        identifiers, stored, lengths = [], [], array.array('I')
+        for doc_number, identifier in enumerate(self.identifiers):
+            if identifier is None:
+                continue
+            new_numbers[doc_number] = len(identifiers)
+            identifiers.append(identifier)
+            stored.append(self.stored[doc_number])
+            lengths.append(self.lengths[doc_number])
+        postings = {}
+        for term, (doc_numbers, frequencies) in self.postings.items():
+            new_doc_numbers, new_frequencies = array.array('I'), array.array('I')
+            for doc_number, frequency in zip(doc_numbers, frequencies):
+                if doc_number in new_numbers:
+                    new_doc_numbers.append(new_numbers[doc_number])
+                    new_frequencies.append(frequency)
+            if new_doc_numbers:
+                postings[term] = (new_doc_numbers, new_frequencies)
+        self.identifiers, self.stored, self.lengths, self.postings = identifiers, stored, lengths, postings
+        self.doc_numbers = {identifier: doc_number for doc_number, identifier in enumerate(identifiers)}
+
+    def get_postings(self, token):
+        """
+        查询词对应的倒排表列表：单个中文字不在二元组词表中，匹配包含该字的所有词
+        """
+        if token in self.postings:
+            return [self.postings[token]]
+        if is_cjk(token) and len(token) == 1:
+            return [postings for term, postings in self.postings.items() if token in term]
+        return []
+
+    def score(self, tokens):
+        """
+        BM25评分，文档必须包含所有查询词
+        :return: {文档编号: 评分}
+        """
+        doc_count = self.doc_count
+        if not doc_count or not tokens:
+            return {}
+        average_length = self.total_length / doc_count or 1
+        scores = None
+        for token in set(tokens):
+            token_scores = {}
+            for doc_numbers, frequencies in self.get_postings(token):
+                # 文档频率包含尚未压缩的已删除文档，是近似值
+                idf = math.log(1 + (doc_count - len(doc_numbers) + 0.5) / (len(doc_numbers) + 0.5))
+                for doc_number, frequency in zip(doc_numbers, frequencies):
+                    if self.identifiers[doc_number] is None:
+                        continue
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[doc_number] / average_length)
+                    token_scores[doc_number] = token_scores.get(doc_number, 0) + \
+                        idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {doc_number: score + token_scores[doc_number]
+                          for doc_number, score in scores.items() if doc_number in token_scores}
+            if not scores:
+                break
+        return scores or {}
+
+    def search(self, query_string):
+        """
+        搜索：空格分隔的词同时匹配，NOT开头的词排除，'*'返回所有文档
+        :return: [(文档编号, 评分)]，按评分由高到低排序
+        """
+        if query_string.strip() == '*':
+            return [(doc_number, 0) for doc_number in sorted(self.doc_numbers.values())]
+        include, exclude = [], []
+        negate = False
+        for word in query_string.split():
+            if word == 'NOT':
+                negate = True
+                continue
+            (exclude if negate else include).extend(tokenize(word))
+            negate = False
+        scores = self.score(include)
+        for token in set(exclude):
+            for doc_numbers, _ in self.get_postings(token):
+                for doc_number in doc_numbers:
+                    scores.pop(doc_number, None)
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+    def dump(self, f):
+        pickle.dump({
+            'version': SNAPSHOT_VERSION,
+            'identifiers': self.identifiers,
+            'stored': self.stored,
+            'lengths': self.lengths,
+            'postings': self.postings,
+            'total_length': self.total_length,
+        }, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, f):
+        data = pickle.load(f)
+        if data.get('version') != SNAPSHOT_VERSION:
+            raise ValueError('索引快照版本不匹配')
+        index = cls()
+        index.identifiers = data['identifiers']
+        index.stored = data['stored']
+        index.lengths = data['lengths']
+        index.postings = data['postings']
+        index.total_length = data['total_length']
+        index.doc_numbers = {identifier: doc_number for doc_number, identifier in enumerate(index.identifiers)
+                             if identifier is not None}
+        return index
+
+
+class MemorySearchBackend(BaseSearchBackend):
+    """
+    内存倒排索引：进程启动后从快照文件加载，快照文件变化时重新加载
+    更新索引时加文件锁，先加载最新快照，修改后原子替换快照文件
+    """
+
+    def __init__(self, connection_alias, **connection_options):
+        super().__init__(connection_alias, **connection_options)
+        self.path = connection_options.get('PATH')
+        self.index = InvertedIndex()
+        # 已加载快照的(inode, 修改时间)
+        self.snapshot_stat = None
+        self.lock = threading.RLock()
+
+    def get_index(self):
+        """当前进程的索引，快照文件变化时重新加载"""
+        if not self.path:
+            return self.index
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return self.index
+        snapshot_stat = (stat.st_ino, stat.st_mtime_ns)
+        if snapshot_stat != self.snapshot_stat:
+            with self.lock:
+                if snapshot_stat != self.snapshot_stat:
+                    with open(self.path, 'rb') as f:
+                        self.index = InvertedIndex.load(f)
+                    self.snapshot_stat = snapshot_stat
+        return self.index
+
+    def save(self):
+        """原子替换快照文件"""
+        if not self.path:
+            return
+        file_dir = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(file_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=file_dir, prefix='.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                self.index.dump(f)
+            # mkstemp创建的文件只有属主可读，其它用户运行的进程也需要加载
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        stat = os.stat(self.path)
+        self.snapshot_stat = (stat.st_ino, stat.st_mtime_ns)
+
+    @contextmanager
+    def writing(self, commit=True):
+        """修改索引：多个进程同时更新时依次执行，每个进程都在最新的快照上修改"""
+        with self.lock:
+            if not self.path:
+                yield self.index
+                return
+            with open(self.path + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield self.get_index()
+                    if commit:
+                        self.save()
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def update(self, index, iterable, commit=True):
+        with self.writing(commit) as inverted_index:
+            for obj in iterable:
+                try:
+                    doc = index.full_prepare(obj)
+                except SkipDocument:
+                    continue
+                # 所有文本字段合并建立索引
+                text = ' '.join(str(value) for key, value in doc.items()
+                                if key not in (ID, DJANGO_CT, DJANGO_ID) and isinstance(value, str))
+                inverted_index.add(doc[ID], text, {DJANGO_CT: doc[DJANGO_CT], DJANGO_ID: doc[DJANGO_ID]})
+
+    def remove(self, obj_or_string, commit=True):
+        with self.writing(commit) as inverted_index:
+            inverted_index.remove(get_identifier(obj_or_string))
+
+    def clear(self, models=None, commit=True):
+        with self.writing(commit) as inverted_index:
+            if models is None:
+                self.index = InvertedIndex()
+                return
+            model_cts = {get_model_ct(model) for model in models}
+            # 先找出所有要删除的文档：删除时可能压缩索引，文档编号会变化
+            identifiers = [identifier for identifier, doc_number in inverted_index.doc_numbers.items()
+                           if inverted_index.stored[doc_number][DJANGO_CT] in model_cts]
+            for identifier in identifiers:
+                inverted_index.remove(identifier)
+
+    @log_query
+    def search(self, query_string, start_offset=0, end_offset=None, models=None, result_class=None, **kwargs):
+        if not query_string:
+            return {'results': [], 'hits': 0}
+        inverted_index = self.get_index()
+        matches = inverted_index.search(query_string)
+        if models:
+            model_cts = {get_model_ct(model) for model in models}
+            matches = [(doc_number, score) for doc_number, score in matches
+                       if inverted_index.stored[doc_number][DJANGO_CT] in model_cts]
+        result_class = result_class or SearchResult
+        results = []
+        for doc_number, score in matches[start_offset:end_offset]:
+            stored = inverted_index.stored[doc_number]
+            app_label, model_name = stored[DJANGO_CT].split('.')
+            results.append(result_class(app_label, model_name, stored[DJANGO_ID], score))
+        return {'results': results, 'hits': len(matches)}
+
+    def more_like_this(self, model_instance, additional_query_string=None, start_offset=0, end_offset=None,
+                       models=None, limit_to_registered_models=None, result_class=None, **kwargs):
+        return {'results': [], 'hits': 0}
+
+
+class MemorySearchQuery(SimpleSearchQuery):
+    """查询条件拼接为空格分隔的词，排除的词为 NOT xxx"""
+    pass
+
+
+class MemorySearchEngine(BaseEngine):
+    backend = MemorySearchBackend
+    query = MemorySearchQuery
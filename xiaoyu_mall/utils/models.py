@@ -5,3 +5,41 @@ class BaseModel(models.Model):
     update_time = models.DateTimeField(auto_now=True, verbose_name="更新时间")
     class Meta:
         abstract = True
+
+
+class ChangeTrackingMixin(object):
+    """记录从数据库加载时的字段值，保存时可判断哪些字段发生了变化"""
+    # 需要一起记录的字段 {attname: [attname, ...]}：加载了前者而后者被延迟加载（only/defer）时，补充查询后者
+    TRACKED_TOGETHER = {}
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        missing = {attname for name in field_names for attname in cls.TRACKED_TOGETHER.get(name, ())} \
+            - set(field_names)
+        if missing and instance.pk is not None:
+            missing = sorted(missing)
+            row = cls._base_manager.using(db).filter(pk=instance.pk).values_list(*missing).first()
+            if row is not None:
+                instance._loaded_values.update(zip(missing, row))
+                # 同时赋值给实例，避免访问时再次延迟加载
+                for attname, value in zip(missing, row):
+                    setattr(instance, attname, value)
+        return instance
+
+    def get_loaded_value(self, attname, default=None):
+        """获取加载时的字段值，如 category_id"""
+        return getattr(self, '_loaded_values', {}).get(attname, default)
+
+    def get_changed_fields(self):
+        """与加载时相比发生变化的字段集合（attname），不是从数据库加载的对象返回None"""
+        loaded_values = getattr(self, '_loaded_values', None)
+        if loaded_values is None:
+            return None
+        return {attname for attname, value in loaded_values.items() if getattr(self, attname) != value}
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # 保存后以当前值作为新的基准
+        self._loaded_values = {field.attname: getattr(self, field.attname) for field in self._meta.concrete_fields}
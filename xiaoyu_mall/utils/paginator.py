@@ -0,0 +1,121 @@
+import base64
+import datetime
+import decimal
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+def _to_json(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    return value
+
+
+def encode_cursor(direction, values):
+    """
+    生成游标：记录翻页方向和边界记录的排序字段值
+    :param direction: 'next' 下一页，'prev' 上一页
+    :param values: 边界记录的排序字段值，如 (price, id)
+    """
+    data = json.dumps([direction] + [_to_json(value) for value in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    """
+    解析游标
+    :param size: 排序字段个数
+    :return: (direction, values)，游标无效时返回None
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode())
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(data, list) or len(data) != size + 1 or data[0] not in ('next', 'prev'):
+        return None
+    return data[0], data[1:]
+
+
+def to_field_values(model, ordering, values):
+    """
+    按排序字段的类型转换游标中的值，如 create_time 的字符串转换为datetime
+    :return: 转换后的值列表，值无效时返回None
+    """
+    result = []
+    for field, value in zip(ordering, values):
+        try:
+            value = model._meta.get_field(field.lstrip('-')).to_python(value)
+        except (ValidationError, TypeError, ValueError):
+            return None
+        if value is None:
+            return None
+        result.append(value)
+    return result
+
+
+def keyset_filter(queryset, ordering, values, reverse=False):
+    """
+    按多字段排序的键集分页条件：取排在边界记录之后（reverse时为之前）的记录
+    如 ordering=('-sales', 'id')：sales < v1 or (sales = v1 and id > v2)
+    """
+    condition = Q()
+    equals = {}
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        descending = field.startswith('-')
+        lookup = 'lt' if descending != reverse else 'gt'
+        condition |= Q(**equals, **{'%s__%s' % (name, lookup): value})
+        equals[name] = value
+    return queryset.filter(condition)
+
+
+def reverse_ordering(ordering):
+    """反转排序字段：('-sales', 'id') ==> ('sales', '-id')"""
+    return tuple(field[1:] if field.startswith('-') else '-' + field for field in ordering)
+
+
+def get_ordering_values(obj, ordering):
+    """取出记录的排序字段值"""
+    return [getattr(obj, field.lstrip('-')) for field in ordering]
+
+
+def keyset_page(queryset, ordering, per_page, cursor=None):
+    """
+    键集（游标）分页：不使用OFFSET，查询开销与页码深度无关
+    :param queryset: 未排序的查询集
+    :param ordering: 排序字段，最后一个字段必须唯一，如 ('price', 'id')
+    :param per_page: 每页记录条数
+    :param cursor: 上一次返回的游标，None表示第一页
+    :return: (记录列表, 上一页游标, 下一页游标)，游标无效时返回None
+    """
+    direction, values = 'next', None
+    if cursor:
+        decoded = decode_cursor(cursor, len(ordering))
+        if decoded is None:
+            return None
+        direction, values = decoded
+        values = to_field_values(queryset.model, ordering, values)
+        if values is None:
+            return None
+    if direction == 'prev':
+        queryset = keyset_filter(queryset, ordering, values, reverse=True).order_by(*reverse_ordering(ordering))
+    else:
+        if values is not None:
+            queryset = keyset_filter(queryset, ordering, values)
+        queryset = queryset.order_by(*ordering)
+    # 多取一条判断是否还有更多记录
+    items = list(queryset[:per_page + 1])
+    has_more = len(items) > per_page
+    items = items[:per_page]
+    if direction == 'prev':
+        items.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = values is not None, has_more
+    prev_cursor = encode_cursor('prev', get_ordering_values(items[0], ordering)) if items and has_prev else None
+    next_cursor = encode_cursor('next', get_ordering_values(items[-1], ordering)) if items and has_next else None
+    return items, prev_cursor, next_cursor
@@ -0,0 +1,104 @@
+import logging
+
+from django.apps import apps
+from django.db import models, transaction
+from django_redis import get_redis_connection
+from haystack import connections, connection_router
+from haystack.exceptions import NotHandled
+from haystack.signals import BaseSignalProcessor
+from haystack.utils import get_identifier
+
+from xiaoyu_mall.utils.versions import incr_version
+
+logger = logging.getLogger('django')
+
+# 待更新索引的记录（集合，成员为 app_label.model_name.pk，同一记录多次修改只更新一次）
+SEARCH_DIRTY_KEY = 'search_dirty'
+# 搜索索引代数的版本名：每次更新索引后递增，搜索结果缓存随之失效
+SEARCH_INDEX_VERSION = 'search_index'
+
+
+def mark_dirty(identifiers):
+    """记录待更新索引的记录，在事务提交后写入，保证更新索引时读到的是提交后的数据"""
+    identifiers = list(identifiers)
+    if identifiers:
+        transaction.on_commit(lambda: get_redis_connection('search').sadd(SEARCH_DIRTY_KEY, *identifiers))
+
+
+class QueuedSignalProcessor(BaseSignalProcessor):
+    """
+    保存、删除数据时不直接更新索引，只把记录放入redis队列，由process_search_queue批量更新
+    索引类定义了tracked_fields时，只有这些字段变化才放入队列（如商品库存、销量变化不影响索引）
+    """
+
+    def setup(self):
+        models.signals.post_save.connect(self.handle_save)
+        models.signals.post_delete.connect(self.handle_delete)
+
+    def teardown(self):
+        models.signals.post_save.disconnect(self.handle_save)
+        models.signals.post_delete.disconnect(self.handle_delete)
+
+    def get_index(self, sender):
+        """模型的索引类，没有建立索引的模型返回None"""
+        try:
+            return self.connections['default'].get_unified_index().get_index(sender)
+        except NotHandled:
+            return None
+
+    def handle_save(self, sender, instance, created=False, update_fields=None, **kwargs):
+        index = self.get_index(sender)
+        if index is None:
+            return
+        tracked_fields = getattr(index, 'tracked_fields', None)
+        if tracked_fields and not created:
+            # 指定了保存的字段，或者模型记录了加载时的字段值（ChangeTrackingMixin）
+            changed_fields = set(update_fields) if update_fields is not None else None
+            if changed_fields is None and hasattr(instance, 'get_changed_fields'):
+                changed_fields = instance.get_changed_fields()
+            if changed_fields is not None:
+                # 字段名和attname（外键为xxx_id）都可以
+                tracked = set(tracked_fields) | {sender._meta.get_field(name).attname for name in tracked_fields}
+                if not changed_fields & tracked:
+                    return
+        mark_dirty([get_identifier(instance)])
+
+    def handle_delete(self, sender, instance, **kwargs):
+        if self.get_index(sender) is not None:
+            mark_dirty([get_identifier(instance)])
+
+
+def process_search_queue(batch_size=500):
+    """
+    从队列中取出一批记录更新索引：仍在index_queryset中的记录更新，其它记录从索引中删除
+    :return: 处理的记录数量，队列为空时返回0
+    """
+    redis_conn = get_redis_connection('search')
+    identifiers = [identifier.decode() for identifier in redis_conn.spop(SEARCH_DIRTY_KEY, batch_size) or []]
+    if not identifiers:
+        return 0
+    # 按模型分组 {app_label.model_name: {pk}}
+    dirty = {}
+    for identifier in identifiers:
+        model_label, pk = identifier.rsplit('.', 1)
+        dirty.setdefault(model_label, set()).add(pk)
+    try:
+        for using in connection_router.for_write():
+            backend = connections[using].get_backend()
+            unified_index = connections[using].get_unified_index()
+            for model_label, pks in dirty.items():
+                model = apps.get_model(model_label)
+                index = unified_index.get_index(model)
+                objs = list(index.index_queryset(using=using).filter(pk__in=pks))
+                if objs:
+                    # 一次写入所有更新的记录
+                    backend.update(index, objs)
+                for pk in pks - {str(obj.pk) for obj in objs}:
+                    backend.remove('%s.%s' % (model_label, pk))
+    except Exception:
+        # 更新失败放回队列，下一次重试
+        redis_conn.sadd(SEARCH_DIRTY_KEY, *identifiers)
+        raise
+    incr_version(SEARCH_INDEX_VERSION)
+    logger.info('process_search_queue: %d' % len(identifiers))
+    return len(identifiers)
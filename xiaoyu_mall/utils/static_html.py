@@ -0,0 +1,54 @@
+import os
+import tempfile
+
+from django.conf import settings
+
+# 进程内缓存：{文件路径: (修改时间, 文件内容)}
+_html_local = {}
+
+
+def get_static_html_path(name):
+    """静态化html文件的绝对路径，name为相对STATIC_HTML_DIR的路径"""
+    return os.path.join(settings.STATIC_HTML_DIR, name)
+
+
+def write_static_html(name, html_text):
+    """
+    写入静态化html文件：先写临时文件再原子替换，读取方不会读到写了一半的文件
+    :param name: 相对STATIC_HTML_DIR的路径，如 index.html
+    :param html_text: 渲染好的html字符串
+    :return: 文件的绝对路径
+    """
+    file_path = get_static_html_path(name)
+    file_dir = os.path.dirname(file_path)
+    os.makedirs(file_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=file_dir, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(html_text)
+        # mkstemp创建的文件只有属主可读，前端代理需要读取权限
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return file_path
+
+
+def read_static_html(name):
+    """
+    读取静态化html文件，文件未变化时直接返回进程内缓存
+    :return: bytes，文件不存在时返回None
+    """
+    file_path = get_static_html_path(name)
+    try:
+        mtime = os.stat(file_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    cached = _html_local.get(file_path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(file_path, 'rb') as f:
+        content = f.read()
+    _html_local[file_path] = (mtime, content)
+    return content
@@ -0,0 +1,47 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+def _version_key(name):
+    return 'version_%s' % name
+
+
+def get_version(name):
+    """
+    获取缓存数据的版本号
+    :param name: 版本名，如 categories
+    :return: 版本号，不存在时以当前时间戳初始化，避免与已淘汰的旧版本重复
+    """
+    key = _version_key(name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time()), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def get_versions(*names):
+    """一次往返获取多个版本号：{版本名: 版本号}"""
+    keys = {_version_key(name): name for name in names}
+    found = cache.get_many(list(keys))
+    versions = {}
+    for key, name in keys.items():
+        versions[name] = found[key] if key in found else get_version(name)
+    return versions
+
+
+def incr_version(name):
+    """递增版本号，使该版本名下所有旧缓存失效"""
+    key = _version_key(name)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, int(time.time()), timeout=None)
+        return cache.incr(key)
+
+
+def incr_version_on_commit(name):
+    """事务提交后再递增版本号，防止其它请求用未提交的旧数据重建缓存"""
+    transaction.on_commit(lambda: incr_version(name))
@@ -0,0 +1,107 @@
+import logging
+import os
+import re
+import threading
+from collections import Counter
+
+from haystack.backends.whoosh_backend import WhooshEngine, WhooshSearchBackend
+
+logger = logging.getLogger('django')
+
+# 索引目录中的TOC文件，文件名中的数字是索引代数，每次提交递增
+TOC_RE = re.compile(r'^_MAIN_(\d+)\.toc$')
+
+# 搜索器缓存统计：hits 复用已打开的搜索器，reopens 重新打开搜索器
+searcher_stats = Counter()
+
+
+def get_searcher_stats():
+    """搜索器缓存的命中和重新打开次数"""
+    return dict(searcher_stats)
+
+
+def get_index_generation(path):
+    """
+    索引目录的当前代数：(实际目录, 最新TOC文件的代数)
+    索引路径是符号链接（并行重建后切换）时，实际目录变化也视为代数变化
+    """
+    real_path = os.path.realpath(path)
+    generations = [int(match.group(1)) for match in map(TOC_RE.match, os.listdir(real_path)) if match]
+    return real_path, max(generations, default=-1)
+
+
+class SharedSearcher(object):
+    """缓存的搜索器：haystack每次搜索后调用close()，忽略，由缓存决定何时关闭"""
+
+    def __init__(self, searcher):
+        self._searcher = searcher
+
+    def __getattr__(self, name):
+        return getattr(self._searcher, name)
+
+    def close(self):
+        pass
+
+
+class CachedSearcherIndex(object):
+    """
+    包装Whoosh索引：searcher()返回缓存的搜索器，索引代数变化时才重新打开
+    先比较索引目录的(inode, 修改时间)，提交生成新的TOC文件时目录修改时间才会变化，没有变化时只需一次stat
+    写入相关的方法直接交给原索引
+    """
+
+    def __init__(self, index, path):
+        self._index = index
+        self._path = path
+        # 每个线程一个搜索器，Whoosh的搜索器不保证线程安全
+        self._local = threading.local()
+
+    def __getattr__(self, name):
+        return getattr(self._index, name)
+
+    def refresh(self):
+        # haystack搜索前调用refresh()重新读取TOC，由get_searcher()按需检查
+        return self
+
+    def get_searcher(self):
+        local = self._local
+        stat = os.stat(self._path)
+        dir_state = (stat.st_ino, stat.st_mtime_ns)
+        searcher = getattr(local, 'searcher', None)
+        if searcher is not None and local.dir_state == dir_state:
+            searcher_stats['hits'] += 1
+            return searcher
+        generation = get_index_generation(self._path)
+        if searcher is not None and local.generation == generation:
+            # 目录有变化但没有新的提交（如写锁文件）
+            local.dir_state = dir_state
+            searcher_stats['hits'] += 1
+            return searcher
+        if searcher is not None:
+            searcher.close()
+        self._index = self._index.refresh()
+        local.searcher = self._index.searcher()
+        local.dir_state = dir_state
+        local.generation = generation
+        searcher_stats['reopens'] += 1
+        logger.info('whoosh searcher reopened: %s generation %s' % generation)
+        return local.searcher
+
+    def searcher(self, **kwargs):
+        return SharedSearcher(self.get_searcher())
+
+    def doc_count(self):
+        return self.get_searcher().doc_count()
+
+
+class CachedWhooshSearchBackend(WhooshSearchBackend):
+    """每个进程复用打开的搜索器，避免每次搜索重新读取TOC和段文件"""
+
+    def setup(self):
+        super().setup()
+        if self.use_file_storage:
+            self.index = CachedSearcherIndex(self.index, self.path)
+
+
+class CachedWhooshEngine(WhooshEngine):
+    backend = CachedWhooshSearchBackend